@@ -0,0 +1,239 @@
+"""
+merge_key / IBKR conid と MoneyForward asset_id の永続マッピング
+Persistent mapping from merge_key / IBKR conid to the MoneyForward asset_id
+
+資産の作成・更新・削除のたびに、どのキーがどのMoneyForward資産（asset_id・テーブル）に
+対応するかをキャッシュボリューム上のSQLiteに記録します。次回以降は、銘柄名からの
+merge_keyの推定よりも記録済みの対応を優先し、スクレイプ結果とは照合のみ行います。
+Every create/modify/delete records which key maps to which MoneyForward asset (asset_id and table)
+in SQLite on the cache volume. Later runs trust the recorded mapping over the merge_key parsed from
+the display name, and only validate it against the scrape.
+
+マッピングは補助的な情報のため、SQLiteのエラーは警告としてログに出力し、同期は継続します。
+The mapping is auxiliary: SQLite errors are logged as warnings and the sync continues.
+"""
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+import flex_cache
+
+# ロギング設定 / Configure logging
+logger = logging.getLogger(__name__)
+
+ASSET_MAP_PATH = os.path.join(flex_cache.CACHE_DIR, 'asset_map.sqlite3')
+
+# セクション名（sync_stateと同じ） / Section names (same as sync_state)
+SECTION_FOR_TABLE = {'table-depo': 'cash', 'table-eq': 'equity', 'table-drv': 'equity'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS asset_map (
+    section TEXT NOT NULL,
+    merge_key TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    source_table TEXT NOT NULL,
+    conid TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (section, merge_key)
+);
+CREATE INDEX IF NOT EXISTS asset_map_asset_id ON asset_map (asset_id);
+CREATE INDEX IF NOT EXISTS asset_map_conid ON asset_map (conid);
+"""
+
+
+def _clean(value):
+    # NaN・'NONE'・空文字はNULLとして扱う / Treat NaN, 'NONE' and empty strings as NULL
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    value = str(value).strip()
+    if not value or value == 'NONE':
+        return None
+    # IBKRのconidは数値として読まれることがある / IBKR conids may have been read as numbers
+    return value[:-2] if value.endswith('.0') and value[:-2].isdigit() else value
+
+
+class AssetMap:
+    """
+    (section, merge_key) → (asset_id, source_table, conid) の対応をSQLiteに保存します。
+    Store the (section, merge_key) -> (asset_id, source_table, conid) mapping in SQLite.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ASSET_MAP_PATH
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        if not self._initialized:
+            conn.executescript(_SCHEMA)
+            self._initialized = True
+        return conn
+
+    def _execute(self, sql, params=(), many=False):
+        try:
+            with closing(self._connect()) as conn, conn:
+                if many:
+                    conn.executemany(sql, params)
+                    return []
+                return conn.execute(sql, params).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Asset map {self.path} unavailable: {e}")
+            return []
+
+    def record(self, section, merge_key, asset_id, source_table, conid=None, updated_at=None):
+        """
+        キーとasset_idの対応を記録します（同じasset_idの古いキーは置き換え）。
+        Record the mapping of a key to an asset_id (replacing any older key of the same asset_id).
+        """
+        merge_key, asset_id = _clean(merge_key), _clean(asset_id)
+        if not merge_key or not asset_id:
+            return
+        updated_at = (updated_at or datetime.now()).isoformat()
+        self._execute("DELETE FROM asset_map WHERE section = ? AND asset_id = ? AND merge_key != ?",
+                      (section, asset_id, merge_key))
+        self._execute("INSERT OR REPLACE INTO asset_map VALUES (?, ?, ?, ?, ?, ?)",
+                      (section, merge_key, asset_id, source_table, _clean(conid), updated_at))
+
+    def forget(self, section, asset_id):
+        """削除した資産の対応を消去します / Drop the mapping of a deleted asset"""
+        self._execute("DELETE FROM asset_map WHERE section = ? AND asset_id = ?", (section, _clean(asset_id)))
+
+    def lookup(self, section, merge_key):
+        """
+        キーに対応する(asset_id, source_table)を返します（未登録ならNone）。
+        Return (asset_id, source_table) for a key (None when unknown).
+        """
+        rows = self._execute("SELECT asset_id, source_table FROM asset_map WHERE section = ? AND merge_key = ?",
+                             (section, merge_key))
+        return rows[0] if rows else None
+
+    def lookup_conid(self, conid):
+        """
+        IBKR conidに対応する(merge_key, asset_id, source_table)を返します（未登録ならNone）。
+        Return (merge_key, asset_id, source_table) for an IBKR conid (None when unknown).
+        """
+        rows = self._execute("SELECT merge_key, asset_id, source_table FROM asset_map WHERE conid = ?",
+                             (_clean(conid),))
+        return rows[0] if rows else None
+
+    def keys_by_asset_id(self, section):
+        """セクション内の {asset_id: merge_key} / {asset_id: merge_key} of a section"""
+        rows = self._execute("SELECT asset_id, merge_key FROM asset_map WHERE section = ?", (section,))
+        return dict(rows)
+
+    def keys_by_conid(self, section):
+        """セクション内の {conid: merge_key} / {conid: merge_key} of a section"""
+        rows = self._execute("SELECT conid, merge_key FROM asset_map WHERE section = ? AND conid IS NOT NULL",
+                             (section,))
+        return dict(rows)
+
+    def rekey_by_conid(self, section, df, conids, merge_keys):
+        """
+        IBKRのmerge_keyが変わった銘柄（表示形式の変更など）を、conidで同じ資産として扱えるよう
+        スクレイプした表のキーを新しいmerge_keyに置き換えます。
+        For instruments whose IBKR merge_key changed (e.g. a new display format), replace the key of
+        the scraped table with the new merge_key so the conid still matches the same asset.
+
+        Args:
+            df: Scraped MoneyForward table with 'merge_key'
+            conids, merge_keys: IBKR conid and current merge_key of each position
+
+        Returns:
+            DataFrame (a copy when any key was replaced)
+        """
+        if df.empty or 'merge_key' not in df.columns:
+            return df
+        recorded = self.keys_by_conid(section)
+        renamed = {}
+        for conid, key in zip(conids, merge_keys):
+            old_key = recorded.get(_clean(conid))
+            if old_key and old_key != key:
+                renamed[old_key] = key
+        renamed = {old: new for old, new in renamed.items() if new not in set(df['merge_key'])}
+        if not renamed:
+            return df
+        for old, new in renamed.items():
+            logger.info(f"IBKR key changed for the same conid: '{old}' -> '{new}'")
+        df = df.copy()
+        df['merge_key'] = df['merge_key'].replace(renamed)
+        return df
+
+    def apply_to_scrape(self, section, df, key_col):
+        """
+        スクレイプした表のキー列を、asset_idで記録済みのキーで置き換えます。
+        Replace the key column of a scraped table with the keys recorded for each asset_id.
+
+        銘柄名から推定したキーと記録が食い違う場合は警告を出し、記録を優先します。
+        When the key parsed from the name disagrees with the record, a warning is logged and the
+        record wins.
+
+        Returns:
+            DataFrame (a copy when any key was replaced)
+        """
+        if df.empty or 'asset_id' not in df.columns:
+            return df
+        known = self.keys_by_asset_id(section)
+        if not known:
+            return df
+        recorded = df['asset_id'].map(lambda a: known.get(_clean(a)))
+        differs = recorded.notna() & (recorded != df[key_col])
+        if differs.any():
+            for asset_id, parsed, key in zip(df.loc[differs, 'asset_id'], df.loc[differs, key_col],
+                                             recorded[differs]):
+                logger.warning(f"Asset {asset_id}: name parses to '{parsed}', using recorded key '{key}'")
+            df = df.copy()
+            df.loc[differs, key_col] = recorded[differs]
+        return df
+
+    def sync_from_scrape(self, section, df, key_col, scraped_tables, source_table=None):
+        """
+        スクレイプした表と照合します。未登録の資産を記録し、読み取ったテーブルから消えた資産
+        （手動削除など）の対応を消去します。
+        Reconcile the mapping with a scrape: record unknown assets and drop the mappings of assets
+        that are gone from the scraped tables (e.g. deleted by hand).
+
+        表が空の場合（ページの読み込み途中やレイアウト変更の可能性）は消去を行わず、
+        消去の対象は実際に読み取ったテーブル（source_table）の資産に限ります。
+        Nothing is dropped when the scrape is empty (the page may not have settled, or the layout
+        changed), and only assets of the tables actually scraped are dropped.
+
+        Args:
+            section: 'cash' or 'equity'
+            df: Scraped MoneyForward rows with 'asset_id' and key_col
+            key_col: Column holding the key ('currency' / 'merge_key')
+            scraped_tables: Table types that were found on the page and read (e.g. ['table-eq'])
+            source_table: Table type of every row when df has no 'source_table' column
+        """
+        if 'asset_id' not in df.columns:
+            return
+        known = self.keys_by_asset_id(section)
+        scraped = {_clean(a) for a in df['asset_id']} - {None}
+        if scraped:
+            scraped_tables = tuple(scraped_tables)
+            tables_by_asset_id = dict(self._execute(
+                "SELECT asset_id, source_table FROM asset_map WHERE section = ?", (section,)))
+            gone = [(section, asset_id) for asset_id in known.keys() - scraped
+                    if tables_by_asset_id.get(asset_id) in scraped_tables]
+            if gone:
+                logger.info(f"Dropping {len(gone)} asset map entries no longer in MoneyForward "
+                            f"({section}: {', '.join(scraped_tables)})")
+                self._execute("DELETE FROM asset_map WHERE section = ? AND asset_id = ?", gone, many=True)
+                known = {asset_id: key for asset_id, key in known.items() if (section, asset_id) not in gone}
+        # 同じキーに推定される資産が複数ある場合は、最初の1件のみ記録
+        # When several assets parse to the same key, only the first one is recorded
+        taken = set(known.values())
+        tables = df['source_table'] if 'source_table' in df.columns else [source_table] * len(df)
+        for asset_id, key, table_type in zip(df['asset_id'], df[key_col], tables):
+            if _clean(asset_id) and _clean(asset_id) not in known and _clean(key) not in taken:
+                self.record(section, key, asset_id, table_type)
+                taken.add(_clean(key))
+
+
+# 既定のマッピング / Default mapping
+store = AssetMap()
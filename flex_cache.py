@@ -0,0 +1,378 @@
+"""
+IBKR Flexステートメントの生データキャッシュ
+Raw IBKR Flex statement cache
+
+ダウンロードしたFlexQueryResponseのバイト列をgzip圧縮して保存します。
+ファイル名はクエリID + レポート日付(toDate) + 生成日時(whenGenerated) + 内容ハッシュで決まるため、
+同じステートメントは二重に保存されません。保存されたステートメントからは、
+ネットワークアクセスなしで任意のセクションを再解析できます（オフライン再生・デバッグ用）。
+Stores the downloaded FlexQueryResponse bytes gzip-compressed. File names are derived from
+query id + report date (toDate) + whenGenerated + a content hash, so the same statement is
+never stored twice. Any section can be re-derived from a stored statement with zero network
+calls (offline replay / debugging).
+
+キャッシュディレクトリの索引（index.json）も管理します。キャッシュタイプ・クエリIDごとに
+最新ファイルへのポインタと履歴を保持し、保存時に経過日数と件数で古いファイルを削除します。
+Also maintains the cache directory index (index.json): a latest pointer and history per
+cache type and query id, with age/count based eviction of old files on every save.
+"""
+import glob
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+
+# ロギング設定 / Configure logging
+logger = logging.getLogger(__name__)
+
+# キャッシュディレクトリ（Dockerではibkr-cacheボリューム） / Cache directory (ibkr-cache volume in Docker)
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+RAW_CACHE_DIR = os.path.join(CACHE_DIR, 'raw')
+
+MANIFEST_PATH = os.path.join(CACHE_DIR, 'index.json')
+GENERATION_TIMES_PATH = os.path.join(CACHE_DIR, 'flex_generation_times.json')
+_GENERATION_TIMES_KEPT = 20
+_MANIFEST_VERSION = 1
+
+_RAW_SUFFIX = '.xml.gz'
+RAW_CACHE_TYPE = 'raw'
+
+# 保持ポリシー（キャッシュタイプ・クエリIDごと） / Retention policy (per cache type and query id)
+RETENTION_DAYS = int(os.environ.get('IBKR_CACHE_RETENTION_DAYS', '14'))
+RETENTION_COUNT = int(os.environ.get('IBKR_CACHE_RETENTION_COUNT', '5'))
+
+# 索引・生成時間ファイルの読み込み→更新→書き込みを直列化（ステートメントは複数スレッドで保存される）
+# Serializes read-modify-write of the index and generation-time files (statements are saved from worker threads)
+_index_lock = threading.RLock()
+
+
+def safe_component(value):
+    # ファイル名に使えない文字を置換（パストラバーサル防止） / Replace unsafe characters (prevents path traversal)
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(value)) or 'unknown'
+
+
+def _empty_manifest():
+    return {'version': _MANIFEST_VERSION, 'entries': {}}
+
+
+def load_manifest():
+    """
+    キャッシュ索引を読み込みます（存在しない・壊れている場合は空の索引）。
+    Load the cache index (an empty index if missing or corrupt).
+    """
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != _MANIFEST_VERSION or not isinstance(manifest.get('entries'), dict):
+            logger.info("Cache index has an unknown version, rebuilding")
+            return _empty_manifest()
+        return manifest
+    except FileNotFoundError:
+        return _empty_manifest()
+    except Exception as e:
+        logger.warning(f"Failed to read cache index, rebuilding: {e}")
+        return _empty_manifest()
+
+
+def write_atomic(path, write, binary=False):
+    """
+    同じディレクトリの一意な一時ファイルに書き込み、アトミックに置き換えます（失敗時は一時ファイルを削除）。
+    Write to a unique temp file in the same directory and atomically replace the target
+    (the temp file is removed on failure).
+
+    Args:
+        path: Destination path
+        write: Callable receiving the open temp file
+        binary: Open the temp file in binary mode
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """JSONをアトミックに書き込みます / Write JSON atomically (see write_atomic)"""
+    write_atomic(path, lambda f: json.dump(data, f, **dump_kwargs))
+
+
+def _write_manifest(manifest):
+    write_json_atomic(MANIFEST_PATH, manifest, indent=2)
+
+
+def _manifest_key(cache_type, query_id=None):
+    return f'{safe_component(query_id) if query_id is not None else "default"}/{cache_type}'
+
+
+def _to_abs_path(rel_path):
+    return os.path.join(CACHE_DIR, rel_path)
+
+
+def get_latest_entry(cache_type, query_id=None, manifest=None):
+    """
+    索引から最新のキャッシュエントリを取得します（ディレクトリ走査なし）。
+    Get the latest cache entry from the index (no directory scan).
+
+    Args:
+        cache_type: e.g. 'cash', 'positions', 'raw'
+        query_id: IBKR Flex Query ID (None = default slot)
+        manifest: Already loaded index (optional)
+
+    Returns:
+        dict or None: {'path': absolute path, 'timestamp': ISO timestamp, ...}
+    """
+    manifest = manifest if manifest is not None else load_manifest()
+    entry = manifest['entries'].get(_manifest_key(cache_type, query_id))
+    if not entry or not entry.get('history'):
+        return None
+    latest = dict(entry['history'][0])
+    latest['path'] = _to_abs_path(latest['path'])
+    return latest
+
+
+def get_entries(cache_type, query_id=None):
+    """
+    索引のエントリ履歴を新しい順に返します。
+    Return the index history for a cache type, newest first.
+    """
+    entry = load_manifest()['entries'].get(_manifest_key(cache_type, query_id)) or {}
+    return [dict(item, path=_to_abs_path(item['path'])) for item in entry.get('history', [])]
+
+
+def _evict(history, retention_days, retention_count):
+    # 最新エントリは常に保持 / The latest entry is always kept
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    kept, evicted = history[:1], []
+    for item in history[1:]:
+        try:
+            too_old = datetime.fromisoformat(item['timestamp']) < cutoff
+        except (KeyError, ValueError):
+            too_old = True
+        if too_old or len(kept) >= retention_count:
+            evicted.append(item)
+        else:
+            kept.append(item)
+    return kept, evicted
+
+
+def record_entry(cache_type, path, query_id=None, timestamp=None, extra=None,
+                 retention_days=None, retention_count=None):
+    """
+    キャッシュファイルを索引の最新エントリとして登録し、保持ポリシーを適用します。
+    Register a cache file as the latest index entry and apply the retention policy.
+
+    Args:
+        cache_type: e.g. 'cash', 'positions', 'raw'
+        path: Path of the cache file (inside CACHE_DIR)
+        query_id: IBKR Flex Query ID (None = default slot)
+        timestamp: ISO timestamp of the data (default: now)
+        extra: Additional fields stored with the entry
+        retention_days: Evict entries older than this (default: RETENTION_DAYS)
+        retention_count: Keep at most this many entries (default: RETENTION_COUNT)
+    """
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    retention_count = max(1, RETENTION_COUNT if retention_count is None else retention_count)
+    try:
+        with _index_lock:
+            manifest = load_manifest()
+            key = _manifest_key(cache_type, query_id)
+            rel_path = os.path.relpath(path, CACHE_DIR)
+            item = dict(extra or {}, path=rel_path, timestamp=timestamp or datetime.now().isoformat())
+
+            entry = manifest['entries'].setdefault(key, {'history': []})
+            history = [item] + [h for h in entry['history'] if h.get('path') != rel_path]
+            kept, evicted = _evict(history, retention_days, retention_count)
+            entry['history'] = kept
+            _write_manifest(manifest)
+
+        # 索引の更新後に古いファイルを削除 / Delete evicted files after the index is updated
+        kept_paths = {h['path'] for h in kept}
+        for old in evicted:
+            if old['path'] in kept_paths:
+                continue
+            try:
+                os.remove(_to_abs_path(old['path']))
+                logger.info(f"Evicted old cache file {old['path']}")
+            except FileNotFoundError:
+                pass
+    except Exception as e:
+        logger.warning(f"Failed to update cache index for {cache_type}: {e}")
+
+
+def read_statement_header(source):
+    """
+    最初のFlexStatement要素の属性を読み取ります（文書全体は解析しない）。
+    Read the attributes of the first FlexStatement element without parsing the whole document.
+
+    Args:
+        source: Binary file-like object or file path
+
+    Returns:
+        dict: FlexStatement attributes (accountId, fromDate, toDate, whenGenerated, ...)
+    """
+    try:
+        for event, element in ET.iterparse(source, events=('start',)):
+            if element.tag == 'FlexStatement':
+                return dict(element.attrib)
+    except ET.ParseError as e:
+        raise ValueError(f"Malformed Flex statement: {e}") from e
+    return {}
+
+
+def raw_statement_path(query_id, content, header=None):
+    """
+    ステートメントのキャッシュファイルパスを返します（内容アドレス方式）。
+    Return the content-addressed cache path for a statement.
+
+    Args:
+        query_id: IBKR Flex Query ID
+        content: FlexQueryResponse bytes
+        header: Statement header from read_statement_header (parsed from content when omitted)
+
+    Returns:
+        str: Path under RAW_CACHE_DIR
+    """
+    if header is None:
+        header = read_statement_header(io.BytesIO(content))
+    report_date = safe_component(header.get('toDate', 'unknown'))
+    when_generated = safe_component(header.get('whenGenerated', 'unknown'))
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    file_name = f'flex_{safe_component(query_id)}_{report_date}_{when_generated}_{digest}{_RAW_SUFFIX}'
+    return os.path.join(RAW_CACHE_DIR, file_name)
+
+
+def save_raw_statement(query_id, content):
+    """
+    FlexQueryResponseのバイト列を圧縮して保存します。
+    Save the FlexQueryResponse bytes compressed.
+
+    Args:
+        query_id: IBKR Flex Query ID
+        content: FlexQueryResponse bytes
+
+    Returns:
+        str or None: Path of the cached statement, None if saving failed
+    """
+    try:
+        header = read_statement_header(io.BytesIO(content))
+        path = raw_statement_path(query_id, content, header)
+        if os.path.exists(path):
+            # 同一内容は保存済み / Identical content already stored
+            logger.info(f"Raw Flex statement already cached at {path}")
+        else:
+            # 一意な一時ファイルに書き込んでから置き換え（書き込み途中のファイルを残さない）
+            # Write to a unique temp file and replace (never leave a half-written file)
+            def write(f):
+                with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+                    gz.write(content)
+            write_atomic(path, write, binary=True)
+            logger.info(f"Cached raw Flex statement to {path}")
+
+        record_entry(RAW_CACHE_TYPE, path, query_id=query_id,
+                     extra={'when_generated': header.get('whenGenerated'), 'report_date': header.get('toDate')})
+        return path
+    except Exception as e:
+        logger.warning(f"Failed to save raw Flex statement for query {query_id}: {e}")
+        return None
+
+
+def find_raw_statement(query_id, max_age_hours=None, when_generated=None):
+    """
+    指定クエリの最新の生ステートメントを索引から探します。
+    Find the latest raw statement for a query using the cache index.
+
+    Args:
+        query_id: IBKR Flex Query ID
+        max_age_hours: Ignore statements older than this (None = any age)
+        when_generated: Only match this whenGenerated value (e.g. '20240116;083000')
+
+    Returns:
+        str or None: Path of the cached statement
+    """
+    entries = get_entries(RAW_CACHE_TYPE, query_id)
+    if not entries:
+        # 索引導入前のファイルを一度だけ取り込む / Adopt files written before the index existed (once)
+        entries = _adopt_legacy_raw_statements(query_id)
+    if when_generated is not None:
+        entries = [e for e in entries if e.get('when_generated') == when_generated]
+    entries = [e for e in entries if os.path.exists(e['path'])]
+    if not entries:
+        return None
+
+    latest = entries[0]
+    if max_age_hours is not None:
+        age_hours = (datetime.now() - datetime.fromisoformat(latest['timestamp'])).total_seconds() / 3600
+        if age_hours > max_age_hours:
+            logger.info(f"Raw Flex statement {latest['path']} is stale ({age_hours:.1f} hours old, max {max_age_hours} hours)")
+            return None
+    return latest['path']
+
+
+def _adopt_legacy_raw_statements(query_id):
+    pattern = os.path.join(RAW_CACHE_DIR, f'flex_{safe_component(query_id)}_*{_RAW_SUFFIX}')
+    for path in sorted(glob.glob(pattern), key=os.path.getmtime):
+        with open_raw_statement(path) as stream:
+            header = read_statement_header(stream)
+        record_entry(RAW_CACHE_TYPE, path, query_id=query_id,
+                     timestamp=datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+                     extra={'when_generated': header.get('whenGenerated'), 'report_date': header.get('toDate')})
+    return get_entries(RAW_CACHE_TYPE, query_id)
+
+
+def open_raw_statement(path):
+    """
+    キャッシュされたステートメントをバイナリストリームとして開きます。
+    Open a cached statement as a binary stream.
+    """
+    return gzip.open(path, 'rb')
+
+
+def load_generation_times(query_id):
+    """
+    クエリのステートメント生成時間の履歴（秒、古い順）を返します。
+    Return the observed statement generation times (seconds, oldest first) for a query.
+    """
+    try:
+        with open(GENERATION_TIMES_PATH, 'r') as f:
+            history = json.load(f)
+        return [float(t) for t in history.get(safe_component(query_id), [])]
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        logger.warning(f"Failed to read Flex generation time history: {e}")
+        return []
+
+
+def record_generation_time(query_id, seconds):
+    """
+    観測したステートメント生成時間を記録します（直近の件数のみ保持）。
+    Record an observed statement generation time (only the most recent ones are kept).
+    """
+    try:
+        with _index_lock:
+            try:
+                with open(GENERATION_TIMES_PATH, 'r') as f:
+                    history = json.load(f)
+            except (FileNotFoundError, ValueError):
+                history = {}
+            key = safe_component(query_id)
+            history[key] = (history.get(key, []) + [round(float(seconds), 2)])[-_GENERATION_TIMES_KEPT:]
+            write_json_atomic(GENERATION_TIMES_PATH, history)
+    except Exception as e:
+        logger.warning(f"Failed to record Flex generation time: {e}")
@@ -1,32 +1,190 @@
+import asyncio
+import io
+import os
+import random
+import statistics
+import threading
 import pandas as pd
 import xml.etree.ElementTree as ET
 import logging
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import flex_cache
 
 # ロギング設定 / Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# IBKR Flex Web Service v3 エンドポイント / IBKR Flex Web Service v3 endpoints
-_SEND_URL = "https://ndcdyn.interactivebrokers.com/AccountManagement/FlexWebService/SendRequest"
-_GET_URL  = "https://ndcdyn.interactivebrokers.com/AccountManagement/FlexWebService/GetStatement"
+# IBKR Flex Web Service v3 ベースURL（IBKR_FLEX_BASE_URLでローカルスタブに差し替え可能）
+# IBKR Flex Web Service v3 base URL (point IBKR_FLEX_BASE_URL at a local stub server for testing)
+FLEX_BASE_URL = os.environ.get(
+    'IBKR_FLEX_BASE_URL', "https://ndcdyn.interactivebrokers.com/AccountManagement/FlexWebService")
+
+# HTTP接続プール設定 / HTTP connection pool settings
+_HTTP_RETRIES = int(os.environ.get('IBKR_FLEX_HTTP_RETRIES', '3'))
+_HTTP_POOL_SIZE = 4
+
+_session = None
+_session_lock = threading.Lock()
 
 # 一時的なエラーコード（リトライ対象） / Transient error codes (eligible for retry)
 _RETRYABLE_CODES = {"1001", "1004", "1009", "1018", "1019", "1021"}
+# 生成中を示すエラーコード / Error codes meaning "still generating"
+_GENERATING_CODES = {"1004", "1019"}
 _MAX_RETRIES = 5
-_RETRY_DELAY_SECONDS = 30
 
 
-def _flex_request(url, params, timeout=15):
-    resp = requests.get(url, params=params, headers={"user-agent": "Java"}, timeout=timeout)
+class FlexPollPolicy:
+    """
+    GetStatementのポーリング戦略（短い初回待機 + 上限付き指数バックオフ + ジッター + 全体期限）。
+    Polling strategy for GetStatement: short first poll, capped exponential backoff with jitter,
+    and an overall deadline shared by all retries.
+
+    初回待機は、そのクエリで過去に観測した生成時間の中央値に適応します。
+    The first poll delay adapts to the median generation time previously observed for the query.
+
+    環境変数で設定可能 / Configurable via environment variables:
+        IBKR_FLEX_FIRST_POLL_SECONDS  (default: 1.5)
+        IBKR_FLEX_MAX_POLL_SECONDS    (default: 15)
+        IBKR_FLEX_DEADLINE_SECONDS    (default: 300)
+    """
+    def __init__(self, first_delay=1.5, backoff=1.6, max_delay=15.0, jitter=0.2,
+                 deadline_seconds=300.0, retry_delay=5.0, max_retry_delay=30.0, adaptive=True):
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline_seconds = deadline_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.adaptive = adaptive
+
+    @classmethod
+    def from_env(cls):
+        """環境変数からポリシーを作成 / Build a policy from environment variables"""
+        return cls(
+            first_delay=float(os.environ.get('IBKR_FLEX_FIRST_POLL_SECONDS', '1.5')),
+            max_delay=float(os.environ.get('IBKR_FLEX_MAX_POLL_SECONDS', '15')),
+            deadline_seconds=float(os.environ.get('IBKR_FLEX_DEADLINE_SECONDS', '300')),
+        )
+
+    def _jittered(self, delay):
+        return max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def initial_delay(self, query_id):
+        """
+        初回ポーリングまでの待機時間（秒）。履歴があれば中央値に合わせる。
+        Delay before the first poll, matched to the median of the observed history if available.
+        """
+        if self.adaptive:
+            history = flex_cache.load_generation_times(query_id)
+            if history:
+                return min(self.max_delay, max(self.first_delay, statistics.median(history)))
+        return self.first_delay
+
+    def poll_delays(self, query_id):
+        """ポーリング間の待機時間を無限に生成 / Yield delays between polls indefinitely"""
+        yield self._jittered(self.initial_delay(query_id))
+        delay = self.first_delay
+        while True:
+            delay = min(self.max_delay, delay * self.backoff)
+            yield self._jittered(delay)
+
+    def retry_backoff(self, attempt):
+        """一時的エラー後のリトライ待機時間 / Delay before retrying after a transient error"""
+        return self._jittered(min(self.max_retry_delay, self.retry_delay * (2 ** (attempt - 1))))
+
+
+class _Deadline:
+    # 全リトライで共有される期限 / Deadline shared across all retries
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def check(self, seconds, what):
+        # 期限を超える待機はせず、タイムアウトとして扱う / Never sleep past the deadline
+        if seconds > self.remaining():
+            raise RuntimeError(f"IBKR Flex deadline exceeded while waiting for {what}")
+
+    def sleep(self, seconds, what):
+        self.check(seconds, what)
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds, what):
+        self.check(seconds, what)
+        await asyncio.sleep(seconds)
+
+
+def create_session(max_retries=_HTTP_RETRIES, backoff_factor=0.5, pool_maxsize=_HTTP_POOL_SIZE):
+    """
+    Flex Web Service用のHTTPセッションを作成します（keep-alive、gzip、リトライアダプタ付き）。
+    Create an HTTP session for the Flex Web Service (keep-alive, gzip, retrying adapter).
+
+    Args:
+        max_retries: Retries for connection errors and 429/5xx responses
+        backoff_factor: urllib3 backoff factor between retries
+        pool_maxsize: Connections kept alive per host
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    session.headers.update({"user-agent": "Java", "Accept-Encoding": "gzip, deflate"})
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    モジュール共有のHTTPセッションを返します（初回呼び出し時に作成）。
+    Return the module-wide HTTP session, creating it on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def set_session(session):
+    """
+    モジュール共有のHTTPセッションを差し替えます（テスト用スタブなど）。Noneで既定に戻します。
+    Replace the module-wide HTTP session (e.g. a stub for tests). Pass None to reset to the default.
+
+    Returns:
+        The previous session (or None)
+    """
+    global _session
+    with _session_lock:
+        previous, _session = _session, session
+        return previous
+
+
+def _flex_url(endpoint):
+    return f"{FLEX_BASE_URL.rstrip('/')}/{endpoint}"
+
+
+def _flex_request(url, params, timeout=15, session=None):
+    resp = (session or get_session()).get(url, params=params, timeout=timeout)
     resp.raise_for_status()
     return resp.content
 
 
-def _download_flex(token, query_id):
-    # ステップ1: レポート生成リクエスト / Step 1: request statement generation
-    content = _flex_request(_SEND_URL, {"v": "3", "t": token, "q": query_id})
+def _parse_send_response(content):
+    # SendRequestの応答から参照コードと取得URLを取り出す / Extract reference code and statement URL from SendRequest
     root = ET.fromstring(content)
     status = root.findtext("Status")
     if status != "Success":
@@ -34,39 +192,142 @@ def _download_flex(token, query_id):
         msg  = root.findtext("ErrorMessage") or "unknown error"
         raise RuntimeError(f"IBKR SendRequest failed: Code={code}: {msg}")
     ref_code  = root.findtext("ReferenceCode")
-    stmt_url  = root.findtext("Url") or _GET_URL
+    stmt_url  = root.findtext("Url") or _flex_url("GetStatement")
+    return ref_code, stmt_url
+
+
+def _statement_ready(content, poll):
+    # True: 生成完了、False: 生成中、それ以外は例外 / True: ready, False: still generating, otherwise raise
+    if b"FlexQueryResponse" in content:
+        return True
+    inner = ET.fromstring(content)
+    code = inner.findtext("ErrorCode") or ""
+    msg  = inner.findtext("ErrorMessage") or ""
+    if code in _GENERATING_CODES:
+        logger.info(f"Statement still generating (poll {poll}): {msg}")
+        return False
+    raise RuntimeError(f"IBKR GetStatement failed: Code={code}: {msg}")
+
+
+def _record_ready(query_id, requested_at, poll):
+    # 生成時間を記録し、次回の初回待機に反映 / Record generation time for the next first-poll delay
+    elapsed = time.monotonic() - requested_at
+    logger.info(f"Flex statement ready after {elapsed:.1f}s ({poll} polls)")
+    flex_cache.record_generation_time(query_id, elapsed)
+
+
+def _retryable_code(error):
+    msg = str(error)
+    code = msg.split("Code=")[1].split(":")[0] if "Code=" in msg else ""
+    return code in _RETRYABLE_CODES
+
+
+def _download_flex(token, query_id, policy=None, deadline=None):
+    policy = policy or FlexPollPolicy.from_env()
+    deadline = deadline or _Deadline(policy.deadline_seconds)
+
+    # ステップ1: レポート生成リクエスト / Step 1: request statement generation
+    content = _flex_request(_flex_url("SendRequest"), {"v": "3", "t": token, "q": query_id})
+    ref_code, stmt_url = _parse_send_response(content)
+    requested_at = time.monotonic()
 
     # ステップ2: レポート取得（生成完了まで待機） / Step 2: retrieve statement (poll until ready)
-    for poll in range(1, 20):
-        time.sleep(poll * 2)
+    for poll, delay in enumerate(policy.poll_delays(query_id), start=1):
+        deadline.sleep(delay, "statement generation")
         content = _flex_request(stmt_url, {"v": "3", "t": token, "q": ref_code})
-        if b"FlexQueryResponse" in content:
+        if _statement_ready(content, poll):
+            _record_ready(query_id, requested_at, poll)
             return content
-        inner = ET.fromstring(content)
-        code = inner.findtext("ErrorCode") or ""
-        msg  = inner.findtext("ErrorMessage") or ""
-        if code in ("1004", "1019"):
-            logger.info(f"Statement still generating (poll {poll}): {msg}")
-            continue
-        raise RuntimeError(f"IBKR GetStatement failed: Code={code}: {msg}")
-    raise RuntimeError("IBKR statement generation timed out after polling")
 
 
-def get_ib_flex_report(ib_flex_token, ib_flex_query_id, report_type):
-    # IB FLEXレポートを取得（リトライ付き）
-    # Get the IB FLEX report (with retry for transient errors)
+# レポートタイプ → 行要素タグ / Report type → row element tag
+# 新しいセクションを追加する場合はここに登録 / Register new sections here to support them
+_REPORT_ROW_TAGS = {
+    'CashReport': 'CashReportCurrency',
+    'OpenPositions': 'OpenPosition',
+}
+DEFAULT_REPORT_TYPES = ('CashReport', 'OpenPositions')
+
+# サポート対象の全資産カテゴリ
+# All supported asset categories
+#   STK - 株式 (Stock)
+#   OPT - オプション (Option)
+#   FUT - 先物 (Future)
+#   CFD - 差金決済取引 (Contract for Difference)
+#   WAR - ワラント (Warrant)
+#   SWP - 外国為替 (Forex)
+#   FND - 投資信託 (Mutual Fund)
+#   BND - 債券 (Bond)
+#   ICS - 商品間スプレッド (Inter-Commodity Spread)
+_SUPPORTED_ASSET_CATEGORIES = frozenset(["STK", "OPT", "FUT", "CFD", "WAR", "SWP", "FND", "BND", "ICS"])
+
+# 必要な属性のみ保持 / Only these attributes are kept
+_ATTRIBUTES_TO_KEEP = (
+    # 共通属性 / Common attributes
+    'currency',
+    'assetCategory',
+    'fxRateToBase',      # IBKRの為替レート（yfinanceの代替） / IBKR FX rate (replaces yfinance)
+
+    # 現金報告用 / For CashReport
+    'endingCash',
+
+    # 保有ポジション用 / For OpenPositions
+    'symbol',
+    'position',
+    'positionValue',
+    'costBasisMoney',
+    'costBasisPrice',    # 1株あたりのコストベース / Cost basis per share
+    'markPrice',         # 現在の市場価格 / Current market price
+    'openPrice',         # オープン価格 / Opening price
+    'percentOfNAV',      # 純資産価値の割合 / Percentage of NAV
+    'subCategory',
+    'description',  # BND用の利率抽出に使用 / Used for coupon extraction in BND
+
+    # 識別子 / Identifiers
+    'conid',             # IBKRコントラクトID / IBKR contract ID
+    'isin',              # 国際証券識別番号 / International Securities ID
+    'cusip',             # CUSIP番号 / CUSIP code
+
+    # 日付属性 / Date attributes (if available in Flex Query)
+    'openDateTime',           # ポジションオープン日時 / Position open date/time
+    'holdingPeriodDateTime',  # 保有期間開始日時 / Holding period start date/time
+    'reportDate',             # レポート日付 / Report date
+
+    # オプション固有属性 / Option-specific attributes
+    'strike',
+    'expiry',
+    'putCall'
+)
+
+# 数値として型付けする属性 / Attributes typed as numeric
+# strikeはmerge_keyの一部として文字列のまま保持 / strike stays a string as it is part of merge_key
+_NUMERIC_ATTRIBUTES = frozenset([
+    'fxRateToBase',
+    'endingCash',
+    'position',
+    'positionValue',
+    'costBasisMoney',
+    'costBasisPrice',
+    'markPrice',
+    'openPrice',
+    'percentOfNAV',
+])
+
+
+def _download_flex_with_retry(ib_flex_token, ib_flex_query_id, poll_policy=None):
+    # IB FLEXレポートを取得（リトライ付き、全体期限はリトライ間で共有）
+    # Get the IB FLEX report (with retry for transient errors; one deadline shared across retries)
+    policy = poll_policy or FlexPollPolicy.from_env()
+    deadline = _Deadline(policy.deadline_seconds)
     for attempt in range(1, _MAX_RETRIES + 1):
         try:
-            response = _download_flex(ib_flex_token, ib_flex_query_id)
+            response = _download_flex(ib_flex_token, ib_flex_query_id, policy, deadline)
             break
         except RuntimeError as e:
-            code = ""
-            msg = str(e)
-            if "Code=" in msg:
-                code = msg.split("Code=")[1].split(":")[0]
-            if code in _RETRYABLE_CODES and attempt < _MAX_RETRIES:
-                logger.warning(f"Transient IBKR error (attempt {attempt}/{_MAX_RETRIES}): {e}. Retrying in {_RETRY_DELAY_SECONDS}s...")
-                time.sleep(_RETRY_DELAY_SECONDS)
+            if _retryable_code(e) and attempt < _MAX_RETRIES:
+                delay = policy.retry_backoff(attempt)
+                logger.warning(f"Transient IBKR error (attempt {attempt}/{_MAX_RETRIES}): {e}. Retrying in {delay:.1f}s...")
+                deadline.sleep(delay, "retry")
                 continue
             logger.error(f"Failed to download IBKR Flex report: {e}")
             raise
@@ -77,127 +338,296 @@ def get_ib_flex_report(ib_flex_token, ib_flex_query_id, report_type):
     if not response:
         logger.error("Empty response received from IBKR API")
         raise ValueError("Empty response from IBKR API")
+    return response
+
+
+def _validate_report_types(report_types):
+    for report_type in report_types:
+        if report_type not in _REPORT_ROW_TAGS:
+            logger.error(f"Unsupported report type: {report_type}")
+            raise ValueError(f"Unsupported report type: {report_type}. Expected one of {list(_REPORT_ROW_TAGS)}")
+
+
+def download_flex_statement(ib_flex_token, ib_flex_query_id, save_raw=True, poll_policy=None):
+    """
+    FlexQueryResponseのバイト列をダウンロードし、生データキャッシュに保存します。
+    Download the FlexQueryResponse bytes and store them in the raw statement cache.
+
+    Args:
+        ib_flex_token: IBKR Flex token
+        ib_flex_query_id: IBKR Flex Query ID
+        save_raw: If True, store the compressed response under .cache/raw
+        poll_policy: FlexPollPolicy (default: FlexPollPolicy.from_env())
+
+    Returns:
+        bytes: FlexQueryResponse document
+    """
+    response = _download_flex_with_retry(ib_flex_token, ib_flex_query_id, poll_policy)
+    if save_raw:
+        flex_cache.save_raw_statement(ib_flex_query_id, response)
+    return response
 
-    try:
-        xml_string = response.decode('utf-8')
-    except (UnicodeDecodeError, AttributeError) as e:
-        logger.error(f"Failed to decode response: {e}")
-        raise ValueError(f"Invalid response format from IBKR API: {e}") from e
 
+def get_ib_flex_reports(ib_flex_token, ib_flex_query_id, report_types=DEFAULT_REPORT_TYPES, save_raw=True,
+                        poll_policy=None):
+    """
+    Flexステートメントを1回だけダウンロードし、要求された全セクションを解析します。
+    Download the Flex statement once and parse every requested section from it.
+
+    Args:
+        ib_flex_token: IBKR Flex token
+        ib_flex_query_id: IBKR Flex Query ID
+        report_types: Sections to extract (e.g. ('CashReport', 'OpenPositions'))
+        save_raw: If True, store the compressed response in the raw statement cache
+        poll_policy: FlexPollPolicy (default: FlexPollPolicy.from_env())
+
+    Returns:
+        dict: {report_type: pandas.DataFrame}
+    """
+    report_types = list(report_types)
+    _validate_report_types(report_types)
+
+    response = download_flex_statement(ib_flex_token, ib_flex_query_id, save_raw=save_raw, poll_policy=poll_policy)
+    return parse_flex_statement(response, report_types)
+
+
+def get_ib_flex_reports_from_cache(ib_flex_query_id, report_types=DEFAULT_REPORT_TYPES,
+                                   max_age_hours=None, when_generated=None):
+    """
+    生データキャッシュからセクションを再解析します（ネットワークアクセスなし）。
+    Re-derive sections from the raw statement cache with zero network calls.
+
+    Args:
+        ib_flex_query_id: IBKR Flex Query ID
+        report_types: Sections to extract
+        max_age_hours: Ignore cached statements older than this (None = any age)
+        when_generated: Replay a specific statement by its whenGenerated value
+
+    Returns:
+        dict or None: {report_type: pandas.DataFrame}, None if no cached statement matches
+    """
+    path = flex_cache.find_raw_statement(ib_flex_query_id, max_age_hours=max_age_hours,
+                                         when_generated=when_generated)
+    if path is None:
+        return None
+
+    logger.info(f"Parsing Flex statement from raw cache: {path}")
+    with flex_cache.open_raw_statement(path) as stream:
+        return parse_flex_statement(stream, report_types)
+
+
+def get_ib_flex_report(ib_flex_token, ib_flex_query_id, report_type):
+    # 単一セクション用の互換API / Compatibility API for a single section
+    return get_ib_flex_reports(ib_flex_token, ib_flex_query_id, [report_type])[report_type]
+
+
+# 同一トークンでの既定の同時実行数 / Default concurrent downloads per token
+_DEFAULT_PER_TOKEN_CONCURRENCY = 2
+
+
+async def _download_flex_async(token, query_id, policy, deadline):
+    # HTTP呼び出しはプール済みセッションでスレッド実行、待機はasyncio.sleep
+    # HTTP calls run in a worker thread on the pooled session; waits use asyncio.sleep
+    content = await asyncio.to_thread(_flex_request, _flex_url("SendRequest"), {"v": "3", "t": token, "q": query_id})
+    ref_code, stmt_url = _parse_send_response(content)
+    requested_at = time.monotonic()
+
+    for poll, delay in enumerate(policy.poll_delays(query_id), start=1):
+        await deadline.async_sleep(delay, "statement generation")
+        content = await asyncio.to_thread(_flex_request, stmt_url, {"v": "3", "t": token, "q": ref_code})
+        if _statement_ready(content, poll):
+            _record_ready(query_id, requested_at, poll)
+            return content
+
+
+async def get_ib_flex_reports_async(ib_flex_token, ib_flex_query_id, report_types=DEFAULT_REPORT_TYPES,
+                                    save_raw=True, poll_policy=None):
+    """
+    get_ib_flex_reports()の非同期版（ポーリング中にイベントループをブロックしない）。
+    Async variant of get_ib_flex_reports() that does not block the event loop while polling.
+
+    Args:
+        ib_flex_token: IBKR Flex token
+        ib_flex_query_id: IBKR Flex Query ID
+        report_types: Sections to extract
+        save_raw: If True, store the compressed response in the raw statement cache
+        poll_policy: FlexPollPolicy (default: FlexPollPolicy.from_env())
+
+    Returns:
+        dict: {report_type: pandas.DataFrame}
+    """
+    report_types = list(report_types)
+    _validate_report_types(report_types)
+    policy = poll_policy or FlexPollPolicy.from_env()
+    deadline = _Deadline(policy.deadline_seconds)
+
+    for attempt in range(1, _MAX_RETRIES + 1):
+        try:
+            response = await _download_flex_async(ib_flex_token, ib_flex_query_id, policy, deadline)
+            break
+        except RuntimeError as e:
+            if _retryable_code(e) and attempt < _MAX_RETRIES:
+                delay = policy.retry_backoff(attempt)
+                logger.warning(f"Transient IBKR error for query {ib_flex_query_id} "
+                               f"(attempt {attempt}/{_MAX_RETRIES}): {e}. Retrying in {delay:.1f}s...")
+                await deadline.async_sleep(delay, "retry")
+                continue
+            logger.error(f"Failed to download IBKR Flex report for query {ib_flex_query_id}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Failed to download IBKR Flex report for query {ib_flex_query_id}: {e}")
+            raise RuntimeError(f"IBKR API download failed: {e}") from e
+
+    if not response:
+        raise ValueError("Empty response from IBKR API")
+    if save_raw:
+        await asyncio.to_thread(flex_cache.save_raw_statement, ib_flex_query_id, response)
+    return await asyncio.to_thread(parse_flex_statement, response, report_types)
+
+
+async def gather_ib_flex_reports(queries, report_types=DEFAULT_REPORT_TYPES,
+                                 per_token_limit=_DEFAULT_PER_TOKEN_CONCURRENCY,
+                                 save_raw=True, poll_policy=None, return_exceptions=False):
+    """
+    複数のFlexクエリを並行して取得します（トークンごとに同時実行数を制限）。
+    Fetch several Flex queries concurrently, limiting concurrency per token.
+
+    合計時間はクエリの合計ではなく、おおよそ最も遅いクエリの時間になります。
+    Total time is roughly that of the slowest query instead of the sum.
+
+    Args:
+        queries: Iterable of (token, query_id) pairs
+        report_types: Sections to extract from every statement
+        per_token_limit: Maximum concurrent downloads sharing one token
+        save_raw: If True, store each response in the raw statement cache
+        poll_policy: FlexPollPolicy (default: FlexPollPolicy.from_env())
+        return_exceptions: If True, failed queries map to their exception instead of raising
+
+    Returns:
+        dict: {query_id: {report_type: pandas.DataFrame}} (or exception when return_exceptions=True)
+    """
+    queries = list(queries)
+    semaphores = {token: asyncio.Semaphore(max(1, per_token_limit)) for token, _ in queries}
+
+    async def fetch(token, query_id):
+        async with semaphores[token]:
+            return await get_ib_flex_reports_async(token, query_id, report_types,
+                                                   save_raw=save_raw, poll_policy=poll_policy)
+
+    results = await asyncio.gather(*(fetch(token, query_id) for token, query_id in queries),
+                                   return_exceptions=return_exceptions)
+    return {query_id: result for (_, query_id), result in zip(queries, results)}
+
+
+def fetch_ib_flex_reports_concurrently(queries, report_types=DEFAULT_REPORT_TYPES, **kwargs):
+    """
+    同期コードからgather_ib_flex_reports()を実行します。
+    Run gather_ib_flex_reports() from synchronous code.
+    """
+    return asyncio.run(gather_ib_flex_reports(queries, report_types, **kwargs))
+
+
+def _keep_row(report_type, attrib):
+    # 行をフィルタ / Filter rows
+    if report_type == 'OpenPositions':
+        return attrib.get('assetCategory') in _SUPPORTED_ASSET_CATEGORIES
+    if report_type == 'CashReport':
+        return attrib.get('currency') != "BASE_SUMMARY"
+    return False
+
+
+def parse_flex_statement(source, report_types=DEFAULT_REPORT_TYPES):
+    """
+    FlexQueryResponseをストリーミング解析し、要求されたセクションをDataFrameとして返します。
+    Stream-parse a FlexQueryResponse and return the requested sections as DataFrames.
+
+    iterparseで要素を逐次処理し、処理済み要素は即座に解放します。行は列配列に直接追加され、
+    数値列は数値型に変換されます。最初のFlexStatementのみを対象とします。
+    Elements are processed incrementally with iterparse and released as soon as they are handled.
+    Rows go straight into column arrays and numeric columns come back typed.
+    Only the first FlexStatement is read.
+
+    Args:
+        source: Response bytes, a binary file-like object, or a file path
+        report_types: Sections to extract (e.g. ('CashReport', 'OpenPositions'))
+
+    Returns:
+        dict: {report_type: pandas.DataFrame}
+    """
+    report_types = list(report_types)
+    _validate_report_types(report_types)
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    row_tags = {report_type: _REPORT_ROW_TAGS[report_type] for report_type in report_types}
+    # セクションごとの列配列と行数 / Column arrays and row counts per section
+    columns = {report_type: {} for report_type in report_types}
+    row_counts = {report_type: 0 for report_type in report_types}
+    found = set()
+
+    # 開始タグのスタック / Stack of open elements
+    stack = []
     try:
-        root = ET.fromstring(xml_string)
+        for event, element in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element)
+                # FlexQueryResponse/FlexStatements/FlexStatement/<Section>
+                if len(stack) == 4 and stack[2].tag == 'FlexStatement' and element.tag in columns:
+                    found.add(element.tag)
+                continue
+
+            stack.pop()
+            depth = len(stack)
+            if depth == 4 and stack[2].tag == 'FlexStatement':
+                report_type = stack[3].tag
+                if report_type in columns and element.tag == row_tags[report_type] \
+                        and _keep_row(report_type, element.attrib):
+                    section_columns = columns[report_type]
+                    n = row_counts[report_type]
+                    # デバッグ: 最初の要素で利用可能な全属性をログ出力
+                    # Debug: Log all available attributes for first element
+                    if n == 0 and element.attrib:
+                        logger.info(f"Available attributes in {report_type}: {list(element.attrib.keys())}")
+                    for attr in _ATTRIBUTES_TO_KEEP:
+                        value = element.attrib.get(attr)
+                        if value is None:
+                            continue
+                        if attr not in section_columns:
+                            section_columns[attr] = [float('nan')] * n
+                        section_columns[attr].append(value)
+                    row_counts[report_type] = n + 1
+                    # この行に存在しない属性を欠損値で埋める / Pad attributes missing from this row
+                    for values in section_columns.values():
+                        if len(values) == n:
+                            values.append(float('nan'))
+                # 処理済みの行要素を解放 / Release the processed row element
+                element.clear()
+                stack[3].remove(element)
+            elif depth == 2 and element.tag == 'FlexStatement':
+                # 最初のFlexStatementのみ対象 / Only the first FlexStatement is read
+                break
+            elif depth >= 3:
+                element.clear()
     except ET.ParseError as e:
         logger.error(f"Failed to parse XML response: {e}")
         raise ValueError(f"Malformed XML received from IBKR API: {e}") from e
 
-    # 指定されたレポート要素を探索
-    # Find the specified report element
-    report_element = root.find(f'FlexStatements/FlexStatement/{report_type}')
-
-    if report_element is None:
-        logger.error(f"Report type '{report_type}' not found in XML response")
-        raise ValueError(f"Report type '{report_type}' not found in IBKR response. Check your Flex Query configuration.")
-    # データを格納するためのリストを作成
-    # Create list to store data
-    data_list = []
-
-    def extract_data(element):
-        # サポート対象の全資産カテゴリ
-        # All supported asset categories
-            # STK - 株式 (Stock)
-            # OPT - オプション (Option)
-            # FUT - 先物 (Future)
-            # CFD - 差金決済取引 (Contract for Difference)
-            # WAR - ワラント (Warrant)
-            # SWP - 外国為替 (Forex)
-            # FND - 投資信託 (Mutual Fund)
-            # BND - 債券 (Bond)
-            # ICS - 商品間スプレッド (Inter-Commodity Spread)
-        if report_type == 'OpenPositions':
-            # サポート対象の資産カテゴリリスト
-            # List of supported asset categories
-            supported_categories = ["STK", "OPT", "FUT", "CFD", "WAR", "SWP", "FND", "BND", "ICS"]
-            if element.get('assetCategory') not in supported_categories:
-                return
-        elif report_type == 'CashReport':
-            if element.get('currency') == "BASE_SUMMARY":
-                return
-        else:
-            return False
-        # データを格納するための辞書
-        # Dictionary to store data
-        row = {}
-        # 必要な属性のみ辞書に追加
-        # Add only required attributes to dictionary
-        attributes_to_keep = [
-            # 共通属性 / Common attributes
-            'currency',
-            'assetCategory',
-            'fxRateToBase',      # IBKRの為替レート（yfinanceの代替） / IBKR FX rate (replaces yfinance)
-
-            # 現金報告用 / For CashReport
-            'endingCash',
-
-            # 保有ポジション用 / For OpenPositions
-            'symbol',
-            'position',
-            'positionValue',
-            'costBasisMoney',
-            'costBasisPrice',    # 1株あたりのコストベース / Cost basis per share
-            'markPrice',         # 現在の市場価格 / Current market price
-            'openPrice',         # オープン価格 / Opening price
-            'percentOfNAV',      # 純資産価値の割合 / Percentage of NAV
-            'subCategory',
-            'description',  # BND用の利率抽出に使用 / Used for coupon extraction in BND
-
-            # 識別子 / Identifiers
-            'conid',             # IBKRコントラクトID / IBKR contract ID
-            'isin',              # 国際証券識別番号 / International Securities ID
-            'cusip',             # CUSIP番号 / CUSIP code
-
-            # 日付属性 / Date attributes (if available in Flex Query)
-            'openDateTime',           # ポジションオープン日時 / Position open date/time
-            'holdingPeriodDateTime',  # 保有期間開始日時 / Holding period start date/time
-            'reportDate',             # レポート日付 / Report date
-
-            # オプション固有属性 / Option-specific attributes
-            'strike',
-            'expiry',
-            'putCall'
-        ]
-
-        # デバッグ: 最初の要素で利用可能な全属性をログ出力
-        # Debug: Log all available attributes for first element
-        if len(data_list) == 0 and element.attrib:
-            logger.info(f"Available attributes in {report_type}: {list(element.attrib.keys())}")
-
-        for attr in attributes_to_keep:
-            if attr in element.attrib:
-                row[attr] = element.attrib[attr]
-
-        # データをリストに追加
-        # Add data to list
-        data_list.append(row)
-
-    # レポートタイプに応じて要素を抽出
-    # Extract elements based on report type
-    if report_type == 'CashReport':
-        cash_elements = report_element.findall('CashReportCurrency')
-        if not cash_elements:
-            logger.warning("No CashReportCurrency elements found in report")
-        for element in cash_elements:
-            extract_data(element)
-    elif report_type == 'OpenPositions':
-        position_elements = report_element.findall('OpenPosition')
-        if not position_elements:
-            logger.info("No OpenPosition elements found in report (portfolio may be empty)")
-        for element in position_elements:
-            extract_data(element)
-    else:
-        logger.error(f"Unsupported report type: {report_type}")
-        raise ValueError(f"Unsupported report type: {report_type}. Expected 'CashReport' or 'OpenPositions'")
-    # リストからDataFrameを作成
-    # Create DataFrame from list
-    df = pd.DataFrame(data_list)
-    # print(df)
-    return df
+    reports = {}
+    for report_type in report_types:
+        if report_type not in found:
+            logger.error(f"Report type '{report_type}' not found in XML response")
+            raise ValueError(f"Report type '{report_type}' not found in IBKR response. Check your Flex Query configuration.")
+        if row_counts[report_type] == 0:
+            if report_type == 'OpenPositions':
+                logger.info("No OpenPosition elements found in report (portfolio may be empty)")
+            else:
+                logger.warning(f"No {row_tags[report_type]} elements found in report")
+
+        # 列配列からDataFrameを作成し、数値列を型変換
+        # Create DataFrame from column arrays and type numeric columns
+        df = pd.DataFrame(columns[report_type])
+        for col in df.columns:
+            if col in _NUMERIC_ATTRIBUTES:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        reports[report_type] = df
+    return reports
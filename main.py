@@ -1,16 +1,21 @@
 import configparser
+import glob
 import os
+import re
+import threading
 import time
 import logging
 import json
 from datetime import datetime, date
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright
 import ibkr_flex_query_client as ibflex
+import flex_cache
 import moneyforward_processing as mfproc
+import reconciliation
+import sync_state
 import utils
 from contextlib import suppress
-from playwright.sync_api import sync_playwright, Error as PlaywrightError
+from concurrent.futures import Future
 import pandas as pd
 
 # Load environment variables from .env file
@@ -21,58 +26,147 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def get_cache_path(cache_type):
+# キャッシュ形式: 'feather'（列指向バイナリ、pyarrowが必要）または 'json'（フォールバック）
+# Cache format: 'feather' (columnar binary, requires pyarrow) or 'json' (fallback)
+CACHE_FORMAT = os.environ.get('IBKR_CACHE_FORMAT', 'feather').lower()
+# Featherキャッシュのスキーマバージョン（互換性のない変更時に増やす）
+# Schema version of feather caches (bump on incompatible changes)
+CACHE_SCHEMA_VERSION = 1
+_CACHE_EXTENSIONS = {'feather': '.feather', 'json': '.json'}
+_CACHE_METADATA_KEY = b'ibkr_mf_sync'
+
+
+def _get_feather_module():
+    # pyarrowはオプション依存 / pyarrow is an optional dependency
+    try:
+        import pyarrow.feather as feather
+        return feather
+    except ImportError:
+        return None
+
+
+def _resolve_cache_format(cache_format=None):
+    cache_format = (cache_format or CACHE_FORMAT).lower()
+    if cache_format not in _CACHE_EXTENSIONS:
+        logger.warning(f"Unknown cache format '{cache_format}', falling back to json")
+        return 'json'
+    if cache_format == 'feather' and _get_feather_module() is None:
+        logger.info("pyarrow is not installed, falling back to json cache format")
+        return 'json'
+    return cache_format
+
+
+def get_cache_path(cache_type, cache_format=None, query_id=None):
     """
     Get the most recent cache file path for a specific report type.
-    Looks for any existing cache file, not just today's.
+    Uses the cache index (flex_cache) for an O(1) lookup instead of scanning the directory.
 
     Args:
         cache_type: 'cash' or 'positions'
+        cache_format: Format used for the new path if no cache exists yet (default: CACHE_FORMAT)
+        query_id: IBKR Flex Query ID the cache belongs to (optional)
 
     Returns:
         str: Path to cache file (may not exist yet)
     """
-    cache_dir = os.path.join(os.path.dirname(__file__), '.cache')
+    cache_dir = flex_cache.CACHE_DIR
     os.makedirs(cache_dir, exist_ok=True)
 
-    # 既存のキャッシュファイルを探す / Look for existing cache files
-    import glob
-    pattern = os.path.join(cache_dir, f'ibkr_{cache_type}_*.json')
-    existing_caches = glob.glob(pattern)
-
-    if existing_caches:
-        # 最新のキャッシュファイルを返す / Return the most recent cache file
-        return max(existing_caches, key=os.path.getmtime)
+    # 索引から最新のキャッシュファイルを取得 / Get the latest cache file from the index
+    entry = flex_cache.get_latest_entry(cache_type, query_id)
+    if entry is not None:
+        return entry['path']
+
+    # 索引導入前のキャッシュファイルを探す（索引にエントリがない場合のみ、query_idの有無に関係なく）
+    # Look for caches written before the index existed (only when the index has no entry, with or without a query_id)
+    legacy_caches = _legacy_cache_files(cache_dir, cache_type)
+    if legacy_caches:
+        # 古い順にすべて索引に登録し、最新を返す（残りは保持ポリシーで削除される）
+        # Register all of them oldest first and return the latest (the rest are evicted by the retention policy)
+        for path in legacy_caches:
+            flex_cache.record_entry(cache_type, path, query_id=query_id,
+                                    timestamp=datetime.fromtimestamp(os.path.getmtime(path)).isoformat())
+        return legacy_caches[-1]
 
     # 既存のキャッシュがない場合は、今日の日付でパスを返す
     # If no existing cache, return path with today's date
-    return os.path.join(cache_dir, f'ibkr_{cache_type}_{date.today().isoformat()}.json')
+    return _new_cache_path(cache_dir, cache_type, _resolve_cache_format(cache_format), query_id)
+
+
+def _legacy_cache_files(cache_dir, cache_type):
+    # 索引導入前の名前（ibkr_{type}_YYYY-MM-DD.ext）で、どの索引エントリにも登録されていないファイル（古い順）
+    # Files with the pre-index name (ibkr_{type}_YYYY-MM-DD.ext) not referenced by any index entry (oldest first)
+    pattern = re.compile(rf'ibkr_{re.escape(cache_type)}_\d{{4}}-\d{{2}}-\d{{2}}\.(?:feather|json)$')
+    indexed = {os.path.normpath(os.path.join(cache_dir, item['path']))
+               for entry in flex_cache.load_manifest()['entries'].values() for item in entry.get('history', [])}
+    candidates = [path for path in glob.glob(os.path.join(cache_dir, f'ibkr_{cache_type}_*'))
+                  if pattern.match(os.path.basename(path)) and os.path.normpath(path) not in indexed]
+    return sorted(candidates, key=os.path.getmtime)
+
+
+def _new_cache_path(cache_dir, cache_type, cache_format, query_id=None):
+    prefix = f'ibkr_{cache_type}_{flex_cache.safe_component(query_id)}' if query_id is not None else f'ibkr_{cache_type}'
+    return os.path.join(cache_dir, f'{prefix}_{date.today().isoformat()}{_CACHE_EXTENSIONS[cache_format]}')
+
+
+def _read_json_cache(cache_path):
+    # 戻り値: (timestamp文字列, DataFrameを返す関数) / Returns: (timestamp string, DataFrame loader)
+    with open(cache_path, 'r') as f:
+        cache_data = json.load(f)
+    return cache_data.get('timestamp'), lambda: pd.DataFrame(cache_data['data'])
+
+
+def _read_feather_cache(cache_path):
+    # メモリマップで読み込み、行ごとの辞書を作らずに列から直接DataFrameを構築
+    # Load memory-mapped and build the DataFrame straight from columns (no per-row dicts)
+    feather = _get_feather_module()
+    if feather is None:
+        raise RuntimeError("pyarrow is required to read feather caches")
+    table = feather.read_table(cache_path, memory_map=True)
+    metadata = json.loads((table.schema.metadata or {}).get(_CACHE_METADATA_KEY, b'{}'))
+    if metadata.get('schema_version') != CACHE_SCHEMA_VERSION:
+        logger.info(f"Cache {cache_path} has schema version {metadata.get('schema_version')}, "
+                    f"expected {CACHE_SCHEMA_VERSION}; treating as stale")
+        return None, None
+
+    def to_frame():
+        df = table.to_pandas()
+        # 文字列列の欠損値をJSONキャッシュと同様にNaNに揃える
+        # Align missing values in string columns to NaN, as with the JSON cache
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].where(df[col].notna(), float('nan'))
+        return df
+
+    return metadata.get('timestamp'), to_frame
 
 
-def load_cached_data(cache_type, max_age_hours=4):
+def load_cached_data(cache_type, max_age_hours=4, query_id=None):
     """
     Load cached IBKR data if it exists and is less than max_age_hours old.
 
     Args:
         cache_type: 'cash' or 'positions'
         max_age_hours: Maximum age of cache in hours (default: 4)
+        query_id: IBKR Flex Query ID the cache belongs to (optional)
 
     Returns:
         pandas.DataFrame or None: Cached data if valid, None otherwise
     """
-    cache_path = get_cache_path(cache_type)
+    cache_path = get_cache_path(cache_type, query_id=query_id)
 
     if not os.path.exists(cache_path):
         logger.info(f"No cache found for {cache_type}")
         return None
 
     try:
-        with open(cache_path, 'r') as f:
-            cache_data = json.load(f)
+        if cache_path.endswith(_CACHE_EXTENSIONS['feather']):
+            cache_timestamp_str, to_frame = _read_feather_cache(cache_path)
+        else:
+            cache_timestamp_str, to_frame = _read_json_cache(cache_path)
 
         # タイムスタンプを確認（4時間以内か？）
         # Check timestamp (is it less than 4 hours old?)
-        cache_timestamp_str = cache_data.get('timestamp')
         if not cache_timestamp_str:
             logger.info(f"Cache for {cache_type} has no timestamp, treating as stale")
             return None
@@ -86,7 +180,7 @@ def load_cached_data(cache_type, max_age_hours=4):
             return None
 
         # DataFrameに変換 / Convert to DataFrame
-        df = pd.DataFrame(cache_data['data'])
+        df = to_frame()
         logger.info(f"Using cached {cache_type} data from {cache_timestamp_str} ({age_hours:.1f} hours ago)")
         return df
 
@@ -95,31 +189,129 @@ def load_cached_data(cache_type, max_age_hours=4):
         return None
 
 
-def save_cached_data(cache_type, df):
+def _write_json_cache(cache_path, cache_data, df):
+    cache_data = dict(cache_data, data=df.to_dict('records'))
+    flex_cache.write_json_atomic(cache_path, cache_data, indent=2)
+
+
+def _write_feather_cache(cache_path, cache_data, df):
+    import pyarrow as pa
+    feather = _get_feather_module()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_CACHE_METADATA_KEY] = json.dumps(dict(cache_data, schema_version=CACHE_SCHEMA_VERSION)).encode()
+    table = table.replace_schema_metadata(metadata)
+    # lz4圧縮でNASへの書き込み量を削減（一意な一時ファイル経由でアトミックに置き換え）
+    # lz4 compression keeps NAS I/O small (written via a unique temp file and atomically replaced)
+    flex_cache.write_atomic(cache_path, lambda f: feather.write_feather(table, f, compression='lz4'), binary=True)
+
+
+def save_cached_data(cache_type, df, cache_format=None, query_id=None):
     """
-    Save IBKR data to cache.
+    Save IBKR data to cache and register it in the cache index.
+    Old cache files are evicted according to the index retention policy.
 
     Args:
         cache_type: 'cash' or 'positions'
         df: pandas.DataFrame to cache
+        cache_format: 'feather' or 'json' (default: CACHE_FORMAT, json if pyarrow is missing)
+        query_id: IBKR Flex Query ID the cache belongs to (optional)
     """
-    cache_path = get_cache_path(cache_type)
+    cache_format = _resolve_cache_format(cache_format)
+    cache_dir = flex_cache.CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = _new_cache_path(cache_dir, cache_type, cache_format, query_id)
 
+    cache_data = {
+        'date': date.today().isoformat(),
+        'timestamp': datetime.now().isoformat(),
+    }
     try:
-        cache_data = {
-            'date': date.today().isoformat(),
-            'timestamp': datetime.now().isoformat(),
-            'data': df.to_dict('records')
-        }
-
-        with open(cache_path, 'w') as f:
-            json.dump(cache_data, f, indent=2)
-
+        if cache_format == 'feather':
+            try:
+                _write_feather_cache(cache_path, cache_data, df)
+            except Exception as e:
+                # 列指向で保存できない場合（型の混在など）はJSONにフォールバック
+                # Fall back to JSON if the frame cannot be stored columnar (e.g. mixed types)
+                logger.warning(f"Failed to write feather cache for {cache_type}, falling back to json: {e}")
+                cache_path = _new_cache_path(cache_dir, cache_type, 'json', query_id)
+                _write_json_cache(cache_path, cache_data, df)
+        else:
+            _write_json_cache(cache_path, cache_data, df)
+
+        flex_cache.record_entry(cache_type, cache_path, query_id=query_id, timestamp=cache_data['timestamp'])
         logger.info(f"Cached {cache_type} data to {cache_path}")
     except Exception as e:
         logger.warning(f"Failed to save cache for {cache_type}: {e}")
 
 
+# Flexレポートタイプ → キャッシュタイプ / Flex report type → cache type
+REPORT_CACHE_TYPES = {
+    'CashReport': 'cash',
+    'OpenPositions': 'positions',
+}
+
+
+def get_ibkr_reports_with_cache(ib_flex_token, ib_flex_query_id, report_cache_types=None, max_age_hours=4):
+    """
+    Get several IBKR Flex Query sections with caching, downloading the statement at most once.
+
+    Args:
+        ib_flex_token: IBKR Flex token
+        ib_flex_query_id: IBKR Flex Query ID
+        report_cache_types: dict of {report_type: cache_type} (default: REPORT_CACHE_TYPES)
+        max_age_hours: Maximum age of cached data in hours (default: 4)
+
+    Returns:
+        dict: {report_type: pandas.DataFrame}
+    """
+    if report_cache_types is None:
+        report_cache_types = REPORT_CACHE_TYPES
+
+    # キャッシュをチェック / Check cache
+    reports = {}
+    missing = []
+    for report_type, cache_type in report_cache_types.items():
+        cached_df = load_cached_data(cache_type, max_age_hours=max_age_hours, query_id=ib_flex_query_id)
+        if cached_df is not None:
+            reports[report_type] = cached_df
+        else:
+            missing.append(report_type)
+
+    if not missing:
+        return reports
+
+    # 生ステートメントキャッシュから再解析を試みる（ネットワークアクセスなし）
+    # Try re-deriving the sections from the raw statement cache (no network call)
+    # IBKR_FLEX_OFFLINE=true の場合は年齢に関係なく最新の生ステートメントを再生
+    # With IBKR_FLEX_OFFLINE=true, replay the latest raw statement regardless of age
+    offline = os.environ.get('IBKR_FLEX_OFFLINE', 'false').lower() == 'true'
+    try:
+        fresh = ibflex.get_ib_flex_reports_from_cache(
+            ib_flex_query_id, missing, max_age_hours=None if offline else max_age_hours)
+    except ValueError as e:
+        # 生ステートメントに要求セクションがない場合（Flexクエリにセクションを追加した直後など）は再ダウンロード
+        # The raw statement lacks a requested section (e.g. right after adding one to the Flex query): download again
+        if offline:
+            raise
+        logger.warning(f"Cached raw Flex statement is unusable ({e}); downloading a fresh one")
+        fresh = None
+    if fresh is None:
+        if offline:
+            raise RuntimeError(f"IBKR_FLEX_OFFLINE is set but no raw Flex statement is cached for query {ib_flex_query_id}")
+        # キャッシュがないセクションのみ、1回のダウンロードで取得
+        # Fetch all uncached sections from a single download
+        logger.info(f"Fetching fresh {', '.join(report_cache_types[r] for r in missing)} data from IBKR API...")
+        fresh = ibflex.get_ib_flex_reports(ib_flex_token, ib_flex_query_id, missing)
+
+    # キャッシュに保存 / Save to cache
+    for report_type, df in fresh.items():
+        save_cached_data(report_cache_types[report_type], df, query_id=ib_flex_query_id)
+        reports[report_type] = df
+
+    return reports
+
+
 def get_ibkr_data_with_cache(ib_flex_token, ib_flex_query_id, report_type, cache_type):
     """
     Get IBKR Flex Query data with caching.
@@ -133,19 +325,8 @@ def get_ibkr_data_with_cache(ib_flex_token, ib_flex_query_id, report_type, cache
     Returns:
         pandas.DataFrame: IBKR report data
     """
-    # キャッシュをチェック / Check cache
-    cached_df = load_cached_data(cache_type)
-    if cached_df is not None:
-        return cached_df
-
-    # キャッシュがない場合はAPIから取得 / Fetch from API if no cache
-    logger.info(f"Fetching fresh {cache_type} data from IBKR API...")
-    df = ibflex.get_ib_flex_report(ib_flex_token, ib_flex_query_id, report_type)
-
-    # キャッシュに保存 / Save to cache
-    save_cached_data(cache_type, df)
-
-    return df
+    reports = get_ibkr_reports_with_cache(ib_flex_token, ib_flex_query_id, {report_type: cache_type})
+    return reports[report_type]
 
 
 def wait_for_2fa_input(session_path, timeout_seconds=600):
@@ -243,6 +424,91 @@ def get_config_value(env_var, config, section, key, required=True):
         return None
 
 
+def fetch_ibkr_data(ib_flex_token, ib_flex_query_id):
+    """
+    IBKR Flexレポートを取得し、日本円換算列を追加します。
+    Fetch the IBKR Flex reports and add the JPY-converted columns.
+
+    Args:
+        ib_flex_token: IBKR Flex token
+        ib_flex_query_id: IBKR Flex Query ID
+
+    Returns:
+        tuple: (ib_cash_report, ib_open_position) DataFrames
+    """
+    # ---IB FLEXレポートを取得（キャッシュ使用）---
+    # ---GET IB FLEX REPORT (with caching)---
+    # 1回のダウンロードで現金残高と保有ポジションの両方を取得
+    # Fetch both cash balances and open positions from a single download
+    ib_reports = get_ibkr_reports_with_cache(ib_flex_token, ib_flex_query_id)
+    ib_cash_report = ib_reports['CashReport']
+    # 現金残高を日本円に変換
+    # Convert cash balance to JPY
+    ib_cash_report = utils.add_value_jpy(ib_cash_report, 'endingCash', 'endingCash_JPY')
+    ib_open_position = ib_reports['OpenPositions']
+    if not ib_open_position.empty:
+        # デバッグ: 利用可能な列を表示
+        # Debug: Show available columns
+        logger.info(f"Available IBKR OpenPositions columns: {ib_open_position.columns.tolist()}")
+        # 取得金額と現在価値を日本円に変換
+        # Convert acquisition cost and current value to JPY
+        # (欠損レートは現金レポートのfxRateToBaseから補完 / missing rates are filled from the cash report's fxRateToBase)
+        ib_open_position = utils.add_values_jpy(ib_open_position, {
+            'costBasisMoney': 'costBasisMoney_JPY',
+            'positionValue': 'positionValue_JPY',
+        }, reference_frames=[ib_cash_report])
+    else:
+        print("No open positions found.")
+    return ib_cash_report, ib_open_position
+
+
+# バックグラウンド取得の合流待ちに、Flexの全体期限へ加える余裕（秒） / Margin added to the Flex deadline when joining the background fetch (s)
+_FETCH_JOIN_MARGIN_SECONDS = 60
+
+
+def _start_background_fetch(ib_flex_token, ib_flex_query_id):
+    """
+    IBKRの取得をデーモンスレッドで開始し、Futureを返します。
+    Start the IBKR fetch on a daemon thread and return its Future.
+
+    ログイン失敗などで合流しないまま終了する場合でも、取得中のスレッドがインタープリタの終了を妨げません。
+    If the run ends without joining it (e.g. a failed login), the fetch thread does not block interpreter exit.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fetch_ibkr_data(ib_flex_token, ib_flex_query_id))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='ibkr-fetch', daemon=True).start()
+    return future
+
+
+def _join_background_fetch(future):
+    # Flexの全体期限＋余裕で合流を打ち切る / Bound the join by the Flex deadline plus a margin
+    timeout = ibflex.FlexPollPolicy.from_env().deadline_seconds + _FETCH_JOIN_MARGIN_SECONDS
+    return future.result(timeout=timeout)
+
+
+def _unchanged_since_last_sync(ib_cash_report, ib_open_position, previous_state, thresholds):
+    """
+    前回反映した状態からの差分がなければTrueを返します（差分はログに出力）。
+    Return True when nothing changed since the last applied state (changes are logged).
+    """
+    changes = sync_state.diff_state(
+        sync_state.build_target_state(ib_cash_report, ib_open_position), previous_state, thresholds=thresholds)
+    if not changes:
+        logger.info(f"No changes since the last sync at {previous_state.get('applied_at')} - "
+                    f"skipping MoneyForward update")
+        return True
+    logger.info(f"{len(changes)} changes since the last sync: {changes[:10]}")
+    return False
+
+
 def main():
     # ConfigParserオブジェクトを作成してconfig.iniファイルを読み込む
     # Create ConfigParser object and read config.ini file
@@ -262,23 +528,29 @@ def main():
     IB_FLEX_QUERY_FOR_MF_ID = get_config_value('IBKR_FLEX_QUERY_ID', config, 'ibkr_flex_query', 'query_id')
     # ---IB FLEXレポートを取得（キャッシュ使用）---
     # ---GET IB FLEX REPORT (with caching)---
-    ib_cash_report = get_ibkr_data_with_cache(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID, 'CashReport', 'cash')
-    # 現金残高を日本円に変換
-    # Convert cash balance to JPY
-    ib_cash_report = utils.add_value_jpy(ib_cash_report, 'endingCash', 'endingCash_JPY')
-    ib_open_position = get_ibkr_data_with_cache(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID, 'OpenPositions', 'positions')
-    if not ib_open_position.empty:
-        # デバッグ: 利用可能な列を表示
-        # Debug: Show available columns
-        logger.info(f"Available IBKR OpenPositions columns: {ib_open_position.columns.tolist()}")
-        # 取得金額を日本円に変換
-        # Convert acquisition cost to JPY
-        ib_open_position = utils.add_value_jpy(ib_open_position, 'costBasisMoney', 'costBasisMoney_JPY')
-        # 現在価値を日本円に変換
-        # Convert current value to JPY
-        ib_open_position = utils.add_value_jpy(ib_open_position, 'positionValue', 'positionValue_JPY')
+    # パイプラインモード（既定）では、IBKRの取得をバックグラウンドで開始し、
+    # ブラウザ起動・MoneyForwardログインと並行して実行（反映前に合流）
+    # In pipelined mode (default), start the IBKR fetch in the background so it overlaps
+    # with browser launch and MoneyForward login (joined before reconciliation)
+    pipelined = os.environ.get('PIPELINED_SYNC', 'true').lower() == 'true'
+    # 前回反映した状態との差分がなければブラウザ処理（ログイン・読み取り・更新）を省略
+    # Skip the browser phase (login, scraping, updates) when nothing changed since the last applied state
+    skip_unchanged = os.environ.get('SKIP_UNCHANGED_SYNC', 'true').lower() == 'true'
+    previous_state = sync_state.load_state()
+    check_unchanged = previous_state is not None and skip_unchanged
+    thresholds = reconciliation.ChangeThresholds.from_env()
+    ibkr_future = None
+    if pipelined:
+        ibkr_future = _start_background_fetch(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID)
+        logger.info("Started IBKR fetch in the background (pipelined mode)")
     else:
-        print("No open positions found.")
+        ib_cash_report, ib_open_position = fetch_ibkr_data(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID)
+        if check_unchanged and _unchanged_since_last_sync(ib_cash_report, ib_open_position, previous_state,
+                                                          thresholds):
+            return
+    # Playwrightはブラウザ操作時のみ必要なため、ここでインポート（パイプラインモードではIBKR取得と並行）
+    # Playwright is only needed for the browser phase, so import it here (overlaps the IBKR fetch in pipelined mode)
+    from playwright.sync_api import sync_playwright, Error as PlaywrightError
     # ブラウザセッションの保存先（BROWSER_SESSION_PATH環境変数でオーバーライド可能）
     # Browser session storage location (overridable via BROWSER_SESSION_PATH env var)
     storage_state_path = os.environ.get(
@@ -328,6 +600,15 @@ def main():
             dialog.accept()
 
         try:
+            # ---パイプラインモード: ログイン前に取得と合流し、差分がなければブラウザを閉じて終了---
+            # ---Pipelined mode: join the fetch before login; close the browser and stop if nothing changed---
+            if ibkr_future is not None and check_unchanged:
+                logger.info("Waiting for background IBKR fetch to compare with the last sync...")
+                ib_cash_report, ib_open_position = _join_background_fetch(ibkr_future)
+                ibkr_future = None
+                if _unchanged_since_last_sync(ib_cash_report, ib_open_position, previous_state, thresholds):
+                    return
+
             # ダイアログハンドラを追加
             # Add the dialog handler
             page.on("dialog", dialog_handler)
@@ -387,10 +668,31 @@ def main():
             page.goto(MF_IB_INSTITUTION_URL)
             page.wait_for_load_state('networkidle')
 
+            # ---バックグラウンドのIBKR取得と合流---
+            # ---Join the background IBKR fetch---
+            if ibkr_future is not None:
+                logger.info("Waiting for background IBKR fetch to finish...")
+                ib_cash_report, ib_open_position = _join_background_fetch(ibkr_future)
+
             # ---取得したIB FLEXレポートをMoneyForward MEに反映---
             # ---Reflect retrieved IB FLEX report to MoneyForward ME---
-            mfproc.reflect_to_mf_cash_deposit(page, ib_cash_report)
-            mfproc.reflect_to_mf_equity(page, ib_open_position)
+            # MF_DRY_RUN=trueの場合は実行計画をログ出力するのみ / With MF_DRY_RUN=true the plans are only logged
+            dry_run = os.environ.get('MF_DRY_RUN', 'false').lower() == 'true'
+            cash_synced = mfproc.reflect_to_mf_cash_deposit(page, ib_cash_report, thresholds, previous_state,
+                                                            dry_run=dry_run)
+            equity_synced = mfproc.reflect_to_mf_equity(page, ib_open_position, thresholds, previous_state,
+                                                        dry_run=dry_run)
+            mfproc.action_latency.log_summary()
+
+            # 全操作が検証できた場合のみ反映済みの状態を保存（次回の差分判定に使用）
+            # Save the applied state only when every action was verified (used by the next run's diff)
+            if dry_run:
+                logger.info("Dry run - MoneyForward was not modified")
+            elif cash_synced and equity_synced:
+                sync_state.save_state(sync_state.merge_applied_state(
+                    sync_state.build_target_state(ib_cash_report, ib_open_position), previous_state, thresholds))
+            else:
+                logger.warning("Some MoneyForward updates could not be verified - sync state not saved")
 
             # セッション状態を保存（次回から2FA不要）
             # Save session state (skip 2FA on next run)
@@ -401,6 +703,10 @@ def main():
             # Close browser context (always executed even if exception occurs)
             context.close()
             browser.close()
+            # 合流しなかった取得はキャンセル（実行中の場合もデーモンスレッドのため終了を妨げない）
+            # Cancel a fetch that was never joined (a running one is a daemon thread and does not block exit)
+            if ibkr_future is not None:
+                ibkr_future.cancel()
 
 
 if __name__ == "__main__":
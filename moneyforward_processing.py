@@ -1,16 +1,122 @@
 import pandas as pd
-from bs4 import BeautifulSoup
 from datetime import datetime
+import functools
 import logging
-from asset_types import (
-    ASSET_SUBCLASS_MAP,
-    get_asset_type_for_currency,
-    ASSET_TYPE_CASH_DEPOSIT
+import os
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlencode, urljoin, urlsplit
+import asset_map
+import position_keys
+import reconciliation
+# 名称・キー関連の関数はposition_keysから再エクスポート / Naming/key helpers are re-exported from position_keys
+from position_keys import (  # noqa: F401
+    get_underlying_symbol,
+    get_position_key,
+    format_asset_name,
+    aggregate_positions_by_key,
 )
 
 # ロギング設定 / Configure logging
 logger = logging.getLogger(__name__)
 
+# 書き込み操作後の条件待機のタイムアウト（ミリ秒） / Timeout for condition waits after write actions (ms)
+MF_ACTION_TIMEOUT_MS = int(os.environ.get('MF_ACTION_TIMEOUT_MS', '15000'))
+
+
+class ActionLatency:
+    """
+    MoneyForward操作ごとの所要時間を記録し、集計を出力します。
+    Record how long each MoneyForward action takes and report a summary.
+    """
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+
+    @contextmanager
+    def measure(self, action):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._samples[action].append(time.perf_counter() - start)
+
+    def timed(self, action):
+        """関数の実行時間を記録するデコレーター / Decorator recording a function's run time"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.measure(action):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        Returns:
+            dict: {action: {'count', 'total_s', 'mean_s', 'max_s'}}
+        """
+        return {
+            action: {
+                'count': len(samples),
+                'total_s': round(sum(samples), 3),
+                'mean_s': round(sum(samples) / len(samples), 3),
+                'max_s': round(max(samples), 3),
+            }
+            for action, samples in self._samples.items() if samples
+        }
+
+    def log_summary(self):
+        for action, stats in self.summary().items():
+            logger.info(f"MF action latency [{action}]: count={stats['count']} total={stats['total_s']}s "
+                        f"mean={stats['mean_s']}s max={stats['max_s']}s")
+
+    def reset(self):
+        self._samples.clear()
+
+
+action_latency = ActionLatency()
+
+
+def _is_write_response(response):
+    # フォーム送信（POST/PUT/PATCH/DELETE）への応答のみを対象
+    # Only responses to form submissions (POST/PUT/PATCH/DELETE)
+    return response.request.method in ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def _url_matcher(url):
+    # 送信先URLとパスが一致する応答のみ（クエリ・末尾のスラッシュは無視）
+    # Only responses whose path equals the target URL's path (query and trailing slash ignored)
+    path = urlsplit(url).path.rstrip('/')
+    return lambda response_url: urlsplit(response_url).path.rstrip('/') == path
+
+
+def _submit_and_wait(page, submit, url_matches, timeout=None):
+    """
+    送信操作を実行し、固定スリープの代わりにフォームの応答とページの安定を待ちます。
+    Run a submit action, then wait for the form's response and for the page to settle instead of a fixed sleep.
+
+    解析ビーコンなど無関係な書き込み応答で待機が終わらないよう、送信先URLに一致する応答のみを待ちます。
+    Only a response matching the submit target counts, so unrelated writes (e.g. analytics beacons) do not end the wait.
+
+    Args:
+        page: Playwright page object
+        submit: Callable performing the click/submit
+        url_matches: Predicate on the response URL identifying the submitted form's response
+        timeout: Timeout in milliseconds (default: MF_ACTION_TIMEOUT_MS)
+
+    Returns:
+        Playwright Response of the submitted form
+    """
+    timeout = timeout or MF_ACTION_TIMEOUT_MS
+    with page.expect_response(lambda response: _is_write_response(response) and url_matches(response.url),
+                              timeout=timeout) as response_info:
+        submit()
+    page.wait_for_load_state('networkidle', timeout=timeout)
+    return response_info.value
+
 
 class SecureCredential:
     """
@@ -46,161 +152,6 @@ class SecureCredential:
         return "***REDACTED***"
 
 
-def get_underlying_symbol(row):
-    """
-    IBKRデータからクリーンな原資産ティッカーを抽出します。
-    Extract the clean underlying ticker symbol from IBKR data.
-
-    株式 (STK) の場合、シンボルはすでに原資産ティッカー (例: "QSI")。
-    For stocks (STK), the symbol is already the underlying ticker (e.g., "QSI").
-
-    オプション (OPT) の場合、シンボルはOCCコード (例: "PNC   260213P00227500")
-    で、最初の6文字がパディングされた原資産ティッカーです。
-    For options (OPT), the symbol is an OCC code (e.g., "PNC   260213P00227500")
-    where the first 6 chars are the padded underlying ticker.
-    """
-    symbol = str(row.get('symbol', 'UNKNOWN'))
-    asset_category = str(row.get('assetCategory', 'STK'))
-
-    if asset_category == 'OPT' and len(symbol) > 6:
-        # OCC形式: 6文字パディング原資産 + 日付 + タイプ + 行使価格
-        # OCC format: 6-char padded underlying + date + type + strike
-        underlying = symbol[:6].strip()
-        return underlying if underlying else symbol
-
-    return symbol
-
-
-def get_position_key(row):
-    """
-    ポジションのユニークなマージキーを生成します（ポジション数量に依存しない）。
-    Generate a unique merge key for a position, independent of position count.
-
-    キー形式 / Key formats:
-        STK: "QSI"
-        OPT: "PNC260213 P227.5" (原資産+YYMMDD+スペース+P/C+行使価格)
-        FUT: "ES 250321"
-        BND: "US10Y 2.5%"
-        その他: 原資産シンボル / Others: underlying symbol
-    """
-    underlying = get_underlying_symbol(row)
-    asset_category = str(row.get('assetCategory', 'STK'))
-
-    if asset_category == 'OPT':
-        strike = str(row.get('strike', ''))
-        expiry = str(row.get('expiry', ''))
-        put_call = str(row.get('putCall', ''))
-
-        # 有効期限フォーマット: "20260213" -> "260213"
-        # Format expiry: "20260213" -> "260213"
-        if expiry and expiry != 'NONE' and len(expiry) == 8:
-            expiry_formatted = expiry[2:]  # YYYYMMDD -> YYMMDD
-        else:
-            expiry_formatted = expiry if expiry != 'NONE' else ''
-
-        # 行使価格フォーマット: "227.5" -> "227.5", "5.0" -> "5"
-        # Format strike: "227.5" -> "227.5", "5.0" -> "5"
-        strike_formatted = ''
-        try:
-            if strike and strike != 'NONE':
-                strike_num = float(strike)
-                if strike_num == int(strike_num):
-                    strike_formatted = str(int(strike_num))
-                else:
-                    strike_formatted = f"{strike_num:g}"
-            else:
-                strike_formatted = ''
-        except (ValueError, TypeError):
-            strike_formatted = strike if strike != 'NONE' else ''
-
-        pc_indicator = put_call[0].upper() if put_call and put_call != 'NONE' else ''
-
-        # キー形式: "PNC260213 P227.5"
-        # Key format: "PNC260213 P227.5"
-        key = f"{underlying}{expiry_formatted} {pc_indicator}{strike_formatted}"
-        return key[:20]
-
-    elif asset_category == 'FUT':
-        expiry = str(row.get('expiry', ''))
-        if expiry and expiry != 'NONE' and len(expiry) == 8:
-            expiry_formatted = expiry[2:]  # YYYYMMDD -> YYMMDD
-        else:
-            expiry_formatted = ''
-
-        if expiry_formatted:
-            key = f"{underlying} {expiry_formatted}"
-        else:
-            key = underlying
-        return key[:20]
-
-    elif asset_category == 'BND':
-        import re
-        description = str(row.get('description', ''))
-        coupon_match = re.search(r'(\d+\.?\d*)\s*%', description)
-        coupon = f" {coupon_match.group(1)}%" if coupon_match else ''
-        key = f"{underlying}{coupon}"
-        return key[:20]
-
-    else:
-        return underlying[:20]
-
-
-def format_asset_name(row):
-    """
-    IBKRの資産データに基づいてMoneyForward表示用の資産名をフォーマットします。
-    Format asset name for display in MoneyForward based on IBKR asset data.
-
-    get_position_key()でアイデンティティ部分を生成し、20文字以内に収まる場合はポジション数を付加します。
-    Uses get_position_key() for the identity part, appends position count if it fits within 20 chars.
-
-    フォーマット例 / Formatting examples:
-        オプション (OPT): "PNC260213 P227.5-1"  ({symbol}{YYMMDD} {PC}{strike}-{pos})
-        株式 (STK): "QSI (500)"
-        先物 (FUT): "ES 250321 (5)"
-        外国為替 (SWP/CASH): "EUR.USD (100k)"
-
-    引数 / Args:
-        row: IBKRからの資産データを含むDataFrame行
-             DataFrame row containing asset data from IBKR
-
-    戻り値 / Returns:
-        資産名（MoneyForward制約により最大20文字）
-        Asset name (max 20 chars for MoneyForward)
-    """
-    position = str(row.get('position', '0')) if row.get('position', 'NONE') != 'NONE' else '0'
-    asset_category = str(row.get('assetCategory', 'STK'))
-    key = get_position_key(row)
-
-    # オプション: ポジションキーをそのまま名称として使用（ポジション数なし）
-    # Options: use position key directly as name (no position count suffix)
-    # これにより名称とmerge_keyが同一になり、逆変換の必要がなくなる
-    # This makes the name identical to merge_key, eliminating reverse-parsing
-    if asset_category == 'OPT':
-        return key
-
-    # 外国為替: k（千単位）でポジション数をフォーマット
-    # Forex: format position in k (thousands)
-    if asset_category in ('SWP', 'CASH'):
-        try:
-            pos_num = float(position)
-            if abs(pos_num) >= 1000:
-                pos_formatted = f"{int(pos_num / 1000)}k"
-            else:
-                pos_formatted = position
-        except (ValueError, TypeError):
-            pos_formatted = position
-        suffix = f" ({pos_formatted})"
-    else:
-        suffix = f" ({position})"
-
-    # その他の資産タイプ: 括弧付きポジション数 "{key} ({pos})"
-    # Other asset types: parenthesized position count "{key} ({pos})"
-    full_name = f"{key}{suffix}"
-    if len(full_name) <= 20:
-        return full_name
-    return key[:20]
-
-
 def requires_2fa_verification(page):
     """
     Check if the page is showing an email OTP / 2FA verification prompt.
@@ -284,6 +235,7 @@ def submit_2fa_code(page, code):
     return True
 
 
+@action_latency.timed('login')
 def login(page, mf_id, mf_pass):
     """
     MoneyForward MEにログイン / Login to MoneyForward ME
@@ -324,9 +276,9 @@ def login(page, mf_id, mf_pass):
         # 送信ボタンをクリック
         # Click the submit button
         page.click('#submitto')
-        # ページ遷移を待機
-        # Wait for navigation
-        page.wait_for_timeout(2000)
+        # パスワード欄が表示されるまで待機
+        # Wait until the password field is shown
+        page.wait_for_selector('#mfid_user\\[password\\]', state='visible', timeout=MF_ACTION_TIMEOUT_MS)
 
         # パスワードフィールドに入力
         # Fill in the password field
@@ -366,6 +318,7 @@ def login(page, mf_id, mf_pass):
         password = None
 
 
+@action_latency.timed('delete_all_cash_deposit')
 def delete_all_cash_deposit(page):
     # ダイアログ（ポップアップ）を処理 - 表示されるダイアログを自動的に承認（OKボタンを押す）
     # Handle dialog (popup) - Automatically accept displayed dialogs (click OK button)
@@ -384,14 +337,11 @@ def delete_all_cash_deposit(page):
         if not delete_buttons:
             break
 
-        # 最初の削除ボタンをクリック
-        # Click the first delete button
-        delete_buttons[0].click()
-        page.wait_for_timeout(3000)
-
-        # ページ遷移を待機（オプション、ページによって異なる）
-        # Wait for navigation (optional, depending on the page)
-        page.wait_for_load_state('networkidle')
+        # 最初の削除ボタンをクリックし、削除リクエストの応答とページの安定を待機
+        # Click the first delete button and wait for the delete response and the page to settle
+        delete_url = urljoin(page.url, delete_buttons[0].get_attribute('href'))
+        _submit_and_wait(page, delete_buttons[0].click, _url_matcher(delete_url))
+    invalidate_page_snapshot(page)
 
 
 def get_mf_cash_deposit(page):
@@ -411,13 +361,10 @@ def get_mf_cash_deposit(page):
         df['value_JPY'] = df['value_JPY'].str.replace(",", "").str.replace("円", "").astype(int)
     else:
         df['value_JPY'] = None
-    # 'asset_id'列を作成
-    # Create 'asset_id' column
-    df['asset_id'] = None
-    # 行ごとにループし、webの表からasset_idを取得し代入
-    # Loop through each row and get asset_id from web table
-    for index, row in df.iterrows():
-        df.loc[index, 'asset_id'] = get_asset_id_from_mf_table(page, 'table-depo', row['row_no_in_mf_table'])
+    # asset_idはテーブル読み取り時に取得済み（行ごとのブラウザ問い合わせは不要）
+    # asset_id was already extracted while reading the table (no per-row browser calls)
+    if 'asset_id' not in df.columns:
+        df['asset_id'] = None
     return df
 
 
@@ -454,12 +401,6 @@ def _read_mf_table_section(page, table_type):
     # Track source table for use in modify/delete operations
     df['source_table'] = table_type
 
-    # asset_idを取得
-    # Get asset_id for each row
-    df['asset_id'] = None
-    for index, row in df.iterrows():
-        df.loc[index, 'asset_id'] = get_asset_id_from_mf_table(page, table_type, row['row_no_in_mf_table'])
-
     return df
 
 
@@ -479,53 +420,251 @@ def get_mf_equity(page):
     return pd.concat(parts, ignore_index=True)
 
 
+MF_TABLE_TYPES = ('table-depo', 'table-eq', 'table-drv')
+
+# テーブルの読み取り方式: 'html'（page.content()をPythonでパース）または
+# 'evaluate'（ブラウザ内で1回のpage.evaluateにより構造化JSONとして取得）
+# Table extraction mode: 'html' (parse page.content() in Python) or
+# 'evaluate' (one in-browser page.evaluate returning structured JSON)
+MF_EXTRACTION_MODE = os.environ.get('MF_EXTRACTION_MODE', 'html').lower()
+
+# ブラウザ内で対象テーブルの見出し・セル・asset_id・操作リンクをまとめて取得するスクリプト
+# In-browser script returning headers, cell text, asset ids and action links of the target tables
+_EXTRACT_TABLES_JS = """(tableTypes) => {
+    const tableClasses = Array.from(document.querySelectorAll('table.table-bordered'))
+        .map(t => Array.from(t.classList).join(' '));
+    const tables = {};
+    for (const tableType of tableTypes) {
+        const table = document.querySelector(`table.table.table-bordered.${tableType}`);
+        if (!table) continue;
+        const rows = Array.from(table.querySelectorAll('tr'));
+        if (!rows.length) continue;
+        const headers = Array.from(rows[0].querySelectorAll('th')).map(th => th.textContent.trim());
+        tables[tableType] = {
+            headers: headers,
+            rows: rows.slice(1).map(tr => {
+                const modify = tr.querySelector('a[href*="#modal_asset"]');
+                const del = tr.querySelector('a[data-method="delete"]');
+                const modifyHref = modify ? modify.getAttribute('href') : null;
+                return {
+                    cells: Array.from(tr.querySelectorAll('td')).map(td => td.textContent.trim()),
+                    asset_id: modifyHref ? modifyHref.split('#modal_asset')[1] : null,
+                    modify_href: modifyHref,
+                    delete_href: del ? del.getAttribute('href') : null,
+                };
+            }),
+        };
+    }
+    return {table_classes: tableClasses, tables: tables};
+}"""
+
+
+def _extract_row_links(row):
+    """
+    テーブル行からasset_idと変更・削除リンクのhrefを取得します。
+    Extract the asset_id and the modify/delete link hrefs from a table row.
+
+    Returns:
+        tuple: (asset_id, modify_href, delete_href) - None for anything not present in the row
+    """
+    # モーダルリンクを行内で検索（列番号に依存しない汎用方式）
+    # Search for modal link within the row (generic approach not dependent on column number)
+    modify_link = row.find('a', href=lambda h: h and '#modal_asset' in h)
+    delete_link = row.find('a', attrs={'data-method': 'delete'})
+    modify_href = modify_link['href'] if modify_link is not None else None
+    delete_href = delete_link.get('href') if delete_link is not None else None
+    # href属性から目的の文字列を取得し、これをasset_idとする
+    # Get target string from href attribute and use it as asset_id
+    asset_id = modify_href.split('#modal_asset', 1)[1] if modify_href else None
+    return asset_id, modify_href, delete_href
+
+
+def _get_html_parser():
+    # lxmlがインストールされていれば高速なlxmlを使用、なければ標準のhtml.parser
+    # Use the faster lxml parser when installed, otherwise the stdlib html.parser
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+
+class MFPageSnapshot:
+    """
+    MoneyForwardページのHTMLを1回だけ取得・パースし、全テーブルの読み取りとasset_id検索に使い回すスナップショット。
+    Snapshot of a MoneyForward page: the HTML is fetched and parsed once, then shared by every
+    table extraction and asset-id lookup until the page is mutated.
+
+    'evaluate'モードでは、HTMLの代わりにpage.evaluateが返す構造化JSON（payload）から構築します。
+    In 'evaluate' mode it is built from the structured JSON payload returned by page.evaluate instead of HTML.
+    """
+
+    def __init__(self, html=None, url=None, payload=None):
+        self.url = url
+        self.soup = None
+        self._payload = payload
+        self._tables = {}
+        if html is not None:
+            # bs4はテーブル読み取り時のみ必要 / bs4 is only needed when reading tables
+            from bs4 import BeautifulSoup
+            self.soup = BeautifulSoup(html, _get_html_parser())
+
+    @classmethod
+    def from_page(cls, page, mode=None):
+        mode = (mode or MF_EXTRACTION_MODE).lower()
+        if mode == 'evaluate':
+            payload = page.evaluate(_EXTRACT_TABLES_JS, list(MF_TABLE_TYPES))
+            return cls(url=page.url, payload=payload)
+        if mode != 'html':
+            logger.warning(f"Unknown MF_EXTRACTION_MODE '{mode}', falling back to html")
+        return cls(page.content(), url=page.url)
+
+    def table_classes(self):
+        if self._payload is not None:
+            return list(self._payload.get('table_classes', []))
+        tables = self.soup.find_all('table', class_=lambda c: c and 'table-bordered' in c)
+        return [' '.join(t.get('class', [])) for t in tables]
+
+    def _find_table(self, table_type):
+        # テーブルのclass IDを設定 / Set table class ID
+        return self.soup.find('table', class_=f'table table-bordered {table_type}')
+
+    def has_table(self, table_type):
+        """テーブルがページ上に存在するか / Whether the table is present on the page"""
+        if self._payload is not None:
+            return self._payload.get('tables', {}).get(table_type) is not None
+        return self._find_table(table_type) is not None
+
+    def get_table(self, table_type):
+        """
+        テーブルをDataFrameとして返します（テーブルごとに1回だけ構築）。
+        Return the table as a DataFrame (built once per table type).
+        """
+        if table_type not in self._tables:
+            self._tables[table_type] = self._build_table(table_type)
+        return self._tables[table_type].copy()
+
+    def _read_table_rows(self, table_type):
+        """
+        テーブルの見出し・セル値・行リンクを返します（テーブルがない場合はNone）。
+        Return the table's headers, cell values and row links (None when the table is absent).
+        """
+        if self._payload is not None:
+            table = self._payload.get('tables', {}).get(table_type)
+            if table is None:
+                return None
+            rows = table['rows']
+            return (table['headers'], [row['cells'] for row in rows],
+                    [(row['asset_id'], row['modify_href'], row['delete_href']) for row in rows])
+
+        table = self._find_table(table_type)
+        if table is None:
+            return None
+        rows = table.find_all('tr')
+        headers = [th.text.strip() for th in rows[0].find_all('th')]
+        # テーブルの全データを取得（同じ行走査でasset_idと変更・削除リンクも取得）
+        # Get all data from table (asset_id and modify/delete links are taken in the same row walk)
+        depo_data = []  # list
+        links = []
+        for row in rows[1:]:
+            values = [td.text.strip() for td in row.find_all('td')]
+            depo_data.append(values)
+            links.append(_extract_row_links(row))
+        return headers, depo_data, links
+
+    def _build_table(self, table_type):
+        table_rows = self._read_table_rows(table_type)
+        if table_rows is None:
+            # テーブルが存在しない場合は空のdfを返す
+            # If table doesn't exist, return empty df
+            df = pd.DataFrame()
+            df['row_no_in_mf_table'] = None
+            return df
+        headers, depo_data, links = table_rows
+        # Pandasのデータフレームに変換
+        # Convert to Pandas DataFrame
+        df = pd.DataFrame(depo_data, columns=headers)
+        # 'row_no_in_mf_table'列を作成（index + 1）
+        # Create 'row_no_in_mf_table' column (index + 1)
+        df['row_no_in_mf_table'] = df.index + 1
+        # 'row_no_in_mf_table'列を先頭に移動
+        # Move 'row_no_in_mf_table' column to the front
+        df = df.reindex(columns=['row_no_in_mf_table'] + list(df.columns[:-1]))
+        df = df.drop([c for c in ['変更', '削除'] if c in df.columns], axis=1)
+        link_df = pd.DataFrame(links, columns=['asset_id', 'modify_href', 'delete_href'], index=df.index)
+        return pd.concat([df, link_df], axis=1)
+
+    def get_asset_id(self, table_type, row_num):
+        """
+        パース済みテーブルから行のasset_idを取得します（ブラウザへの問い合わせなし）。
+        Look up a row's asset_id in the parsed table (no browser round trip).
+        """
+        if table_type not in self._tables:
+            self._tables[table_type] = self._build_table(table_type)
+        df = self._tables[table_type]
+        if row_num > len(df) or pd.isna(df['asset_id'].iloc[row_num - 1]):
+            raise RuntimeError(f"Element not found at row {row_num} in {table_type}. Page structure may have changed.")
+        return df['asset_id'].iloc[row_num - 1]
+
+
+# ページごとのスナップショット（ページ変更操作の後に破棄）
+# Per-page snapshots (discarded after any mutation of the page)
+_page_snapshots = weakref.WeakKeyDictionary()
+# HTTP直接送信で変更され、表示内容が古くなったページ / Pages whose DOM is outdated after direct HTTP submits
+_stale_pages = weakref.WeakSet()
+
+
+def get_page_snapshot(page):
+    """
+    ページの現在の状態のスナップショットを返します（未取得または遷移後のみpage.content()を呼ぶ）。
+    Return a snapshot of the page's current state; page.content() is only called when there is
+    no snapshot yet or the page has navigated elsewhere.
+    """
+    if page in _stale_pages:
+        refresh_page(page)
+    snapshot = _page_snapshots.get(page)
+    if snapshot is None or snapshot.url != page.url:
+        snapshot = MFPageSnapshot.from_page(page)
+        _page_snapshots[page] = snapshot
+    return snapshot
+
+
+def invalidate_page_snapshot(page):
+    """ページを変更した後にスナップショットを破棄 / Drop the snapshot after the page has been mutated"""
+    _page_snapshots.pop(page, None)
+
+
+def mark_page_stale(page):
+    """
+    ページ外（HTTP直接送信）で変更した後に呼び出し、次回のスナップショット取得前にページを再読み込みさせます。
+    Call after changing data outside the page (direct HTTP submit) so it is reloaded before the next snapshot.
+    """
+    invalidate_page_snapshot(page)
+    _stale_pages.add(page)
+
+
+def refresh_page(page):
+    """ページを再読み込みして安定を待つ / Reload the page and wait for it to settle"""
+    page.reload()
+    page.wait_for_load_state('networkidle', timeout=MF_ACTION_TIMEOUT_MS)
+    _stale_pages.discard(page)
+    invalidate_page_snapshot(page)
+
+
 def log_all_mf_tables(page):
     """Log all table types found on the MF page (diagnostic helper)."""
-    html = page.content()
-    soup = BeautifulSoup(html, 'html.parser')
-    tables = soup.find_all('table', class_=lambda c: c and 'table-bordered' in c)
-    table_classes = [' '.join(t.get('class', [])) for t in tables]
+    table_classes = get_page_snapshot(page).table_classes()
     logger.info(f"All table-bordered tables on MF page: {table_classes}")
 
 
 def get_data_from_mf_table(page, table_type):
-    html = page.content()
-    soup = BeautifulSoup(html, 'html.parser')
-    # テーブルのclass IDを設定
-    # Set table class ID
-    class_id = f'table table-bordered {table_type}'
-    table = soup.find('table', class_=class_id)
-    if table is None:
-        # テーブルが存在しない場合は空のdfを返す
-        # If table doesn't exist, return empty df
-        df = pd.DataFrame()
-        df['row_no_in_mf_table'] = None
-        return df
-    rows = table.find_all('tr')
-    headers = [th.text.strip() for th in rows[0].find_all('th')]
-    # テーブルの全データを取得
-    # Get all data from table
-    depo_data = []  # list
-    for row in rows[1:]:
-        values = [td.text.strip() for td in row.find_all('td')]
-        depo_data.append(values)
-    # Pandasのデータフレームに変換
-    # Convert to Pandas DataFrame
-    df = pd.DataFrame(depo_data, columns=headers)
-    # 'row_no_in_mf_table'列を作成（index + 1）
-    # Create 'row_no_in_mf_table' column (index + 1)
-    df['row_no_in_mf_table'] = df.index + 1
-    # 'row_no_in_mf_table'列を先頭に移動
-    # Move 'row_no_in_mf_table' column to the front
-    df = df.reindex(columns=['row_no_in_mf_table'] + list(df.columns[:-1]))
-    df = df.drop([c for c in ['変更', '削除'] if c in df.columns], axis=1)
-    return df
+    return get_page_snapshot(page).get_table(table_type)
 
 
 def get_asset_id_from_mf_table(page, table_type, row_no_in_mf_table):
     # XPath injection prevention: validate table_type
     # XPath インジェクション防止: table_type を検証
-    if table_type not in ['table-depo', 'table-eq', 'table-drv']:
+    if table_type not in MF_TABLE_TYPES:
         raise ValueError(f"Invalid table type: {table_type}")
 
     # XPath injection prevention: validate row_no_in_mf_table is numeric
@@ -537,22 +676,160 @@ def get_asset_id_from_mf_table(page, table_type, row_no_in_mf_table):
     except (ValueError, TypeError) as e:
         raise ValueError(f"Invalid row number (must be numeric): {row_no_in_mf_table}") from e
 
-    # モーダルリンクを行内で検索（列番号に依存しない汎用方式）
-    # Search for modal link within the row (generic approach not dependent on column number)
-    element_xpath = '//*[@class="table table-bordered {}"]/tbody/tr[{}]//a[contains(@href, "#modal_asset")]'.format(
-        table_type, row_num)
-    element = page.query_selector(element_xpath)
-    if element is None:
-        raise RuntimeError(f"Element not found at row {row_no_in_mf_table} in {table_type}. Page structure may have changed.")
-    # href属性から目的の文字列を取得し、これをasset_idとする
-    # Get target string from href attribute and use it as asset_id
-    href_attribute = element.get_attribute('href')
-    if href_attribute is None:
-        raise RuntimeError(f"Element at row {row_no_in_mf_table} in {table_type} has no href attribute.")
-    asset_id = href_attribute.replace('#modal_asset', '')
-    return asset_id
+    return get_page_snapshot(page).get_asset_id(table_type, row_num)
+
+
+# 資産の書き込み方式: 'ui'（モーダルを操作）または 'direct'（認証済みコンテキストからフォームを直接POST、失敗時はUIにフォールバック）
+# Asset write mode: 'ui' (drive the modal) or 'direct' (POST the form from the authenticated context, falling back to the UI on failure)
+MF_SUBMIT_MODE = os.environ.get('MF_SUBMIT_MODE', 'ui').lower()
+
+# 手入力で資産を追加するフォーム（各資産の変更モーダルと同じuser_asset_det_*フィールドを持つため明示的に指定）
+# The manual add-asset form (targeted explicitly: the per-asset edit modals share its user_asset_det_* fields)
+MF_CREATE_FORM_SELECTOR = 'form#new_user_asset_det'
+# 資産の作成エンドポイント / Asset create endpoint
+MF_CREATE_ACTION_PATH = '/bs/portfolio/new'
+
+# セレクターで特定したページ内のフォームを送信内容ごとシリアライズするスクリプト
+# In-page script serializing a form (found by selector) together with its submit payload
+_SERIALIZE_FORM_JS = """(scope) => {
+    const el = document.querySelector(scope);
+    const form = el && (el.tagName === 'FORM' ? el : el.querySelector('form'));
+    if (!form) return null;
+    const fields = [];
+    new FormData(form).forEach((value, name) => {
+        if (typeof value === 'string') fields.push([name, value]);
+    });
+    const names = {};
+    for (const el of form.elements) {
+        if (!el.name) continue;
+        if (el.id) names['#' + el.id] = el.name;
+        for (const label of (el.labels || [])) names[label.textContent.trim()] = el.name;
+    }
+    const csrf = document.querySelector('meta[name="csrf-token"]');
+    const override = form.querySelector('input[name="_method"]');
+    return {action: form.action, fields: fields, names: names, csrf_token: csrf ? csrf.content : null,
+            method_override: override ? override.value : null,
+            in_asset_modal: !!form.closest('[id^="modal_asset"]')};
+}"""
+
+# 応答に含まれる場合は失敗とみなすマークアップ（Railsのバリデーションエラー表示）
+# Markup that marks a response as failed (Rails validation error rendering)
+_FORM_ERROR_MARKERS = ('field_with_errors', 'error_explanation')
+
+
+class _PostSentError(RuntimeError):
+    """
+    POSTを送信した後の失敗（サーバー側で処理された可能性がある）
+    Failure after the POST was sent (the server may have processed it)
+    """
+
+
+def _post_form(page, url, fields, csrf_token):
+    """
+    認証済みブラウザコンテキスト（Cookie共有）からフォームをPOSTします。
+    POST a form from the authenticated browser context (sharing its cookies).
+
+    成功時はリダイレクトされるため、リダイレクトされずにフォームを再表示した応答や
+    エラー表示を含む応答は、ステータスが200でも失敗とみなします。
+    A successful submit redirects, so a response that re-renders the form without redirecting or
+    contains error markup is a failure even with status 200.
+
+    Raises:
+        _PostSentError: If the request fails or the response is not a successful submit
+    """
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    if csrf_token:
+        headers['X-CSRF-Token'] = csrf_token
+    # タイムアウトなどはサーバーに届いたかどうか判別できないため、送信済みとして扱う
+    # Timeouts and the like cannot tell whether the server got the request, so they count as sent
+    try:
+        response = page.context.request.post(url, data=urlencode(fields), headers=headers,
+                                             timeout=MF_ACTION_TIMEOUT_MS)
+        body = response.text()
+    except Exception as e:
+        raise _PostSentError(f"POST to {url} did not complete: {e}") from e
+    if not response.ok or 'sign_in' in response.url:
+        raise _PostSentError(f"Unexpected response {response.status} from {url} (final URL: {response.url})")
+    if any(marker in body for marker in _FORM_ERROR_MARKERS):
+        raise _PostSentError(f"Response from {url} contains form errors")
+    redirected = urlsplit(response.url).path.rstrip('/') != urlsplit(url).path.rstrip('/')
+    if not redirected and '<form' in body:
+        raise _PostSentError(f"Response from {url} re-rendered the form instead of redirecting")
+    return response
+
+
+def _check_create_form(form):
+    """
+    送信しようとしているフォームが資産の作成フォームであることを確認します（変更モーダルへの誤送信防止）。
+    Make sure the form about to be posted is the asset create form (never an edit modal's form).
+
+    Raises:
+        RuntimeError: If the form is not the create form
+    """
+    if form['in_asset_modal']:
+        raise RuntimeError("Add-asset selector matched a form inside an existing asset's modal")
+    if form['method_override'] and form['method_override'].lower() != 'post':
+        raise RuntimeError(f"Add-asset form overrides the method with '{form['method_override']}'")
+    if urlsplit(form['action']).path.rstrip('/') != MF_CREATE_ACTION_PATH:
+        raise RuntimeError(f"Add-asset form posts to {form['action']}, not {MF_CREATE_ACTION_PATH}")
+
 
+def _direct_submit_form(page, overrides, scope, check=None):
+    """
+    ページ上のフォームの内容に値を上書きして直接送信します（CSRFトークン・hiddenフィールドはフォームから継承）。
+    Submit a form on the page directly with overridden values (CSRF token and hidden fields come from the form).
 
+    Args:
+        page: Playwright page object
+        overrides: dict of {'#element_id' or label text: value}
+        scope: CSS selector of the form or its container
+        check: Optional callable validating the serialized form before posting (raises to abort)
+    """
+    form = page.evaluate(_SERIALIZE_FORM_JS, scope)
+    if form is None:
+        raise RuntimeError(f"Form not found (scope={scope})")
+    if check is not None:
+        check(form)
+    fields = list(form['fields'])
+    for key, value in overrides.items():
+        name = form['names'].get(key)
+        if name is None:
+            raise RuntimeError(f"Form field '{key}' not found in {form['action']}")
+        fields = [(n, v) for n, v in fields if n != name] + [(name, str(value))]
+    return _post_form(page, form['action'], fields, form['csrf_token'])
+
+
+def _try_direct_submit(page, action, submit, fallback_after_send=True):
+    """
+    'direct'モードでHTTP直接送信を試みます。失敗した場合はFalseを返し、呼び出し側はUI操作にフォールバックします。
+    Try a direct HTTP submit in 'direct' mode. Returns False on failure so the caller falls back to the UI.
+
+    Args:
+        fallback_after_send: Falseの場合、POST送信後の失敗はUIで再実行せず（作成の重複を防ぐ）、
+            Trueを返して結果を最後の検証に任せます。
+            When False, a failure after the POST was sent is not retried through the UI (it could
+            create a duplicate): True is returned and the final verification decides the outcome.
+    """
+    if MF_SUBMIT_MODE != 'direct':
+        return False
+    try:
+        with action_latency.measure(f'{action}_direct'):
+            submit()
+    except _PostSentError as e:
+        if not fallback_after_send:
+            logger.error(f"Direct {action} submit was sent but not confirmed, leaving it to verification: {e}")
+            mark_page_stale(page)
+            return True
+        logger.warning(f"Direct {action} submit failed, falling back to UI: {e}")
+        return False
+    except Exception as e:
+        logger.warning(f"Direct {action} submit failed, falling back to UI: {e}")
+        return False
+    mark_page_stale(page)
+    return True
+
+
+@action_latency.timed('modify')
 def modify_asset_in_mf(page, table_type, asset_id, asset_name, market_value, cost_amount=None, update_cost_basis=False):
     """
     Update an existing asset in MoneyForward.
@@ -580,23 +857,28 @@ def modify_asset_in_mf(page, table_type, asset_id, asset_name, market_value, cos
     # asset_id が英数字とアンダースコアのみを含むことを検証
     if not asset_id.replace('_', '').replace('-', '').isalnum():
         raise ValueError(f"Invalid asset_id format (contains special characters): {asset_id}")
+    if table_type not in MF_TABLE_TYPES:
+        raise ValueError(f"Invalid table type: {table_type}")
 
-    # 指定されたテーブル内のすべての変更ボタンを検索
-    # Find all modify buttons within the specified table
-    modify_buttons = page.query_selector_all(
-        f'.table.table-bordered.{table_type} .btn-asset-action[data-toggle="modal"]')
-    # 変更ボタンの中からasset_idを含むボタンを探してクリック
-    # Find the button containing asset_id among modify buttons and click it
-    for modify_button in modify_buttons:
-        href = modify_button.get_attribute('href')
-        if asset_id in href:
-            # クリックするとモーダルが表示される
-            # Clicking displays the modal
-            modify_button.click()
-            break
+    # モーダル内のフォームを直接送信（'direct'モード） / Submit the modal's form directly ('direct' mode)
+    modal_id = f'modal_asset{asset_id}'
+    overrides = {'#user_asset_det_name': str(asset_name)[:20], '#user_asset_det_value': str(market_value)[:12]}
+    if update_cost_basis and cost_amount is not None:
+        overrides['#user_asset_det_entried_price'] = str(cost_amount)[:12]
+    if _try_direct_submit(page, 'modify', lambda: _direct_submit_form(page, overrides, scope=f'#{modal_id}')):
+        return True
+
+    # asset_idをキーにした属性セレクターで変更ボタンを直接特定（ボタンごとの問い合わせは不要）
+    # Locate the modify button directly with an attribute selector keyed on asset_id (no per-button calls)
+    modify_button = page.locator(
+        f'.table.table-bordered.{table_type} .btn-asset-action[data-toggle="modal"][href="#modal_asset{asset_id}"]')
+    if modify_button.count() == 0:
+        raise RuntimeError(f"Modify button not found for asset_id {asset_id} in {table_type}. Page structure may have changed.")
+    # クリックするとモーダルが表示される
+    # Clicking displays the modal
+    modify_button.first.click()
     # 以下、モーダル内での操作
     # Following operations are within the modal
-    modal_id = f'modal_asset{asset_id}'
     # ---資産の名称を変更---
     # ---Change asset name---
     asset_det_name_textbox_xpath = f'//div[@id="{modal_id}"]//input[@id="user_asset_det_name"]'
@@ -627,14 +909,19 @@ def modify_asset_in_mf(page, table_type, asset_id, asset_name, market_value, cos
     commit_btn = page.query_selector(commit_btn_xpath)
     if commit_btn is None:
         raise RuntimeError(f"Commit button not found for asset_id {asset_id}. Modal may not have loaded properly.")
-    commit_btn.click()
-    # ---モーダルが消えるまで待機---
-    # ---Wait until the modal disappears---
-    page.wait_for_timeout(3000)
-    page.wait_for_load_state('networkidle')
+    # ---フォームの応答を待ち、モーダルが消えるまで待機---
+    # ---Wait for the form response, then until the modal disappears---
+    # 送信先はモーダル内フォームのaction（取得できない場合はasset_idを含むURL）
+    # The target is the modal form's action (or any URL containing the asset_id when it cannot be read)
+    action_url = commit_btn.evaluate('el => el.form ? el.form.action : null')
+    url_matches = _url_matcher(action_url) if action_url else (lambda url: asset_id in url)
+    _submit_and_wait(page, commit_btn.click, url_matches)
+    invalidate_page_snapshot(page)
+    page.locator(f'#{modal_id}').wait_for(state='hidden', timeout=MF_ACTION_TIMEOUT_MS)
     return True
 
 
+@action_latency.timed('create')
 def create_asset_in_mf(page, asset_type, asset_name, market_value, cost_amount, purchase_date=None):
     """
     Create a new asset in MoneyForward.
@@ -647,6 +934,20 @@ def create_asset_in_mf(page, asset_type, asset_name, market_value, cost_amount,
         cost_amount: Purchase price/cost basis
         purchase_date: Optional purchase date in 'YYYY-MM-DD' format (from IBKR openDateTime)
     """
+    # 追加フォームを直接送信（'direct'モード） / Submit the add-asset form directly ('direct' mode)
+    overrides = {
+        '資産の種類': str(asset_type),
+        '資産の名称': str(asset_name)[:20],
+        '現在の価値': str(market_value)[:12],
+        '購入価格': str(cost_amount)[:12],
+    }
+    if purchase_date:
+        overrides['#user_asset_det_entried_at'] = purchase_date.replace('-', '/')
+    if _try_direct_submit(page, 'create', lambda: _direct_submit_form(page, overrides, MF_CREATE_FORM_SELECTOR,
+                                                                       check=_check_create_form),
+                          fallback_after_send=False):
+        return True
+
     try:
         # デバッグ: 現在のURLとページタイトルをログ出力
         # Debug: Log current URL and page title
@@ -712,7 +1013,11 @@ def create_asset_in_mf(page, asset_type, asset_name, market_value, cost_amount,
                     # カレンダーウィジェットは明示的なフォーカス変更が必要
                     # Calendar widgets require explicit focus change to commit
                     date_field.press('Tab')
-                    page.wait_for_timeout(500)  # 値のコミットを待つ / Wait for value to commit
+                    # 値がフィールドに反映されるまで待機 / Wait until the value is committed to the field
+                    page.wait_for_function(
+                        "() => { const f = document.querySelector('#user_asset_det_entried_at');"
+                        " return f && f.value !== ''; }",
+                        timeout=MF_ACTION_TIMEOUT_MS)
 
                     # 値が正しく設定されたか確認
                     # Verify the value was set correctly
@@ -729,58 +1034,205 @@ def create_asset_in_mf(page, asset_type, asset_name, market_value, cost_amount,
         if submit_button is None:
             raise RuntimeError("Submit button not found. Page structure may have changed.")
         logger.info("Clicking submit button to create asset...")
+        action_url = submit_button.evaluate('el => el.form ? el.form.action : null')
+        if not action_url:
+            raise RuntimeError("Add asset form not found. Page structure may have changed.")
+
+        def submit():
+            # JavaScriptクリックを使用してハングを回避
+            # Use JavaScript click to avoid hanging
+            try:
+                submit_button.evaluate('el => el.click()')
+                logger.info("Submit button clicked via JavaScript")
+            except:
+                # フォールバック: 通常のクリック
+                # Fallback to normal click
+                submit_button.click()
+                logger.info("Submit button clicked via Playwright")
 
-        # JavaScriptクリックを使用してハングを回避
-        # Use JavaScript click to avoid hanging
-        try:
-            submit_button.evaluate('el => el.click()')
-            logger.info("Submit button clicked via JavaScript")
-        except:
-            # フォールバック: 通常のクリック
-            # Fallback to normal click
-            submit_button.click()
-            logger.info("Submit button clicked via Playwright")
-
-        page.wait_for_timeout(2000)
         try:
-            page.wait_for_load_state('networkidle', timeout=10000)  # 10秒タイムアウト / 10 second timeout
+            # 登録リクエストの応答とページの安定を待機
+            # Wait for the create request's response and for the page to settle
+            _submit_and_wait(page, submit, _url_matcher(action_url))
             logger.info("Asset created successfully")
         except Exception as e:
-            logger.warning(f"Page didn't reach networkidle state after submit, but continuing: {e}")
+            logger.warning(f"Page didn't settle after submit, but continuing: {e}")
             # フォーム送信後にページが完全に落ち着かない場合でも続行
             # Continue even if page doesn't fully settle after form submission
+        finally:
+            invalidate_page_snapshot(page)
         return True
     except Exception as e:
         raise RuntimeError(f"Failed to create asset in MoneyForward: {e}") from e
 
 
+@action_latency.timed('delete')
 def delete_asset_in_mf(page, table_type, asset_id):
+    if not asset_id or not str(asset_id).replace('_', '').replace('-', '').isalnum():
+        raise ValueError(f"Invalid asset_id format (contains special characters): {asset_id}")
+    if table_type not in MF_TABLE_TYPES:
+        raise ValueError(f"Invalid table type: {table_type}")
+    # スナップショットで同じ行にある削除リンクのhrefを取得し、完全一致のセレクターで特定
+    # （部分一致ではasset_id 123が .../1234 にも一致し、別の資産を削除し得る）
+    # Take the delete link href from the same row in the snapshot and locate it with an exact-match selector
+    # (a substring match would let asset_id 123 also match .../1234 and delete the wrong asset)
+    rows = get_page_snapshot(page).get_table(table_type)
+    delete_href = None
+    if 'asset_id' in rows.columns:
+        matches = rows.loc[rows['asset_id'] == str(asset_id), 'delete_href']
+        delete_href = matches.iloc[0] if not matches.empty and pd.notna(matches.iloc[0]) else None
+    if not delete_href:
+        raise RuntimeError(f"Delete link not found for asset_id {asset_id} in {table_type}. Page structure may have changed.")
+    escaped_href = delete_href.replace('\\', '\\\\').replace('"', '\\"')
+    delete_button = page.locator(
+        f'.table.table-bordered.{table_type} .btn-asset-action[data-method="delete"][href="{escaped_href}"]')
+    if delete_button.count() == 0:
+        raise RuntimeError(f"Delete button not found for asset_id {asset_id} in {table_type}. Page structure may have changed.")
+
+    # 削除リンク（Railsのdata-method="delete"）を直接送信（'direct'モード）
+    # Submit the delete link (Rails data-method="delete") directly ('direct' mode)
+    delete_url = urljoin(page.url, delete_href)
+
+    def direct_delete():
+        csrf_token = page.evaluate(
+            "() => { const m = document.querySelector('meta[name=\"csrf-token\"]'); return m ? m.content : null; }")
+        _post_form(page, delete_url, [('_method', 'delete'), ('authenticity_token', csrf_token or '')], csrf_token)
+    if _try_direct_submit(page, 'delete', direct_delete):
+        return True
+
     # ダイアログ（ポップアップ）を処理 - 表示されるダイアログを自動的に承認（OKボタンを押す）
     # Handle dialog (popup) - Automatically accept displayed dialogs (click OK button)
     page.once("dialog", lambda dialog: dialog.accept())
-    # 指定されたテーブル内のすべての削除ボタンを検索
-    # Find all delete buttons within the specified table
-    delete_buttons = page.query_selector_all(
-        f'.table.table-bordered.{table_type} .btn-asset-action[data-method="delete"]')
-    # 削除ボタンの中からasset_idを含むボタンを検索
-    # Find the button containing asset_id among delete buttons
-    deleted = False
-    for delete_button in delete_buttons:
-        href = delete_button.get_attribute('href')
-        if asset_id in href:
-            delete_button.click()
-            page.wait_for_timeout(1000)
-            page.wait_for_load_state('networkidle')
-            deleted = True
-            break
-    if not deleted:
-        logger.warning(f"DELETE FAILED: no delete button found for asset_id={asset_id} in {table_type}. "
-                       f"Found {len(delete_buttons)} buttons with hrefs: "
-                       f"{[b.get_attribute('href') for b in delete_buttons[:3]]}")
-    return deleted
+    _submit_and_wait(page, delete_button.first.click, _url_matcher(delete_url))
+    invalidate_page_snapshot(page)
+    return True
+
 
+# 実行順序: 更新 → ゼロ更新 → 削除 → 追加（asset_idで対象を特定するため、行番号のずれの影響を受けない）
+# Execution order: modify -> modify to zero -> delete -> add (targets are found by asset_id, so row shifts do not matter)
+_ACTION_ORDER = {action: order for order, action in enumerate(reconciliation.ACTION_TYPES)}
 
-def reflect_to_mf_cash_deposit(page, ib_cash_report):
+
+def _apply_mf_action(page, action):
+    if action.action in ('MODIFY', 'MODIFY_TO_ZERO'):
+        return modify_asset_in_mf(page, action.table_type, action.asset_id, action.name, action.value,
+                                  cost_amount=action.cost, update_cost_basis=action.update_cost_basis)
+    if action.action == 'DELETE':
+        return delete_asset_in_mf(page, action.table_type, action.asset_id)
+    if action.action == 'ADD':
+        return create_asset_in_mf(page, action.asset_type, action.name, action.value, action.cost,
+                                  action.purchase_date)
+    raise ValueError(f"Unknown action: {action.action}")
+
+
+def _record_in_asset_map(action):
+    # 成功した更新・削除をasset_idマッピングに反映（追加は検証時にasset_idが判明してから記録）
+    # Reflect a successful modify/delete in the asset_id mapping (adds are recorded once verification finds their asset_id)
+    section = asset_map.SECTION_FOR_TABLE.get(action.table_type, 'equity')
+    if action.action == 'DELETE':
+        asset_map.store.forget(section, action.asset_id)
+    elif action.action in ('MODIFY', 'MODIFY_TO_ZERO'):
+        asset_map.store.record(section, action.key, action.asset_id, action.table_type, action.conid)
+
+
+def execute_mf_actions(page, actions, verify=True):
+    """
+    作成済みの実行計画を一括で適用し、最後に1回だけ再読み込みして結果を検証します。
+    Apply a precomputed action plan in one batch, then reload once and verify the result.
+
+    'direct'モードでは各操作がページ遷移を伴わないため、途中の再読み込み待ちは発生しません。
+    In 'direct' mode no action navigates the page, so there are no intermediate reloads to wait for.
+
+    1件の操作が例外で失敗しても残りの操作は続行し、検証も必ず行います。
+    An action raising does not stop the remaining actions, and the verification always runs.
+
+    Args:
+        page: Playwright page object
+        actions: List of reconciliation.PlannedAction
+        verify: Reload once and compare the final tables against the plan
+
+    Returns:
+        dict: {'executed': int, 'failed': [actions], 'mismatches': [(action, reason)]}
+    """
+    failed = []
+    for action in sorted(actions, key=lambda a: _ACTION_ORDER[a.action]):
+        try:
+            applied = _apply_mf_action(page, action)
+        except Exception as e:
+            logger.error(f"{action.action} FAILED: {action.key} (asset_id={action.asset_id}): {e}")
+            # モーダルが開いたままの可能性があるため、次の操作の前にページを再読み込み
+            # A modal may have been left open, so reload the page before the next action
+            mark_page_stale(page)
+            applied = False
+        if not applied:
+            failed.append(action)
+        elif action.action != 'ADD':
+            _record_in_asset_map(action)
+    mismatches = verify_mf_actions(page, actions) if verify and actions else []
+    return {'executed': len(actions) - len(failed), 'failed': failed, 'mismatches': mismatches}
+
+
+def _read_verification_table(page, table_type):
+    # 検証用に各テーブルを読み取り、照合キー列'key'を付与
+    # Read a table for verification and add the 'key' column used for matching
+    if table_type == 'table-depo':
+        df = get_mf_cash_deposit(page)
+        df['key'] = df['currency']
+    else:
+        df = _read_mf_table_section(page, table_type)
+        df['key'] = df['merge_key'] if 'merge_key' in df.columns else None
+    if 'asset_id' not in df.columns:
+        df['asset_id'] = None
+    return df
+
+
+def verify_mf_actions(page, actions):
+    """
+    ページを1回だけ再読み込みし、最終的なテーブルを実行計画と照合します。
+    Reload the page once and compare the final tables against the action plan.
+
+    Returns:
+        list: [(action, reason)] for every action whose result does not match the plan
+    """
+    refresh_page(page)
+    tables = {}
+
+    def table(table_type):
+        if table_type not in tables:
+            tables[table_type] = _read_verification_table(page, table_type)
+        return tables[table_type]
+
+    mismatches = []
+    for action in actions:
+        if action.action == 'DELETE':
+            if (table(action.table_type)['asset_id'] == action.asset_id).any():
+                mismatches.append((action, 'asset still present'))
+        elif action.action in ('MODIFY', 'MODIFY_TO_ZERO'):
+            rows = table(action.table_type)
+            rows = rows[rows['asset_id'] == action.asset_id]
+            if rows.empty:
+                mismatches.append((action, 'asset not found'))
+            elif int(rows['value_JPY'].iloc[0]) != int(action.value):
+                mismatches.append((action, f"value is {rows['value_JPY'].iloc[0]}, expected {action.value}"))
+        elif action.action == 'ADD':
+            table_types = [action.table_type] if action.table_type else ['table-eq', 'table-drv']
+            found = [(t, table(t)[table(t)['key'] == action.key]) for t in table_types]
+            found = [(t, rows) for t, rows in found if not rows.empty]
+            if not found:
+                mismatches.append((action, 'created asset not found'))
+            else:
+                # 作成された資産のasset_idを記録 / Record the asset_id of the created asset
+                table_type, rows = found[0]
+                asset_map.store.record(asset_map.SECTION_FOR_TABLE[table_type], action.key,
+                                       rows['asset_id'].iloc[0], table_type, action.conid)
+
+    for action, reason in mismatches:
+        logger.warning(f"VERIFY FAILED: {action.action} {action.key} (asset_id={action.asset_id}): {reason}")
+    logger.info(f"Verified {len(actions)} MoneyForward actions: {len(mismatches)} mismatches")
+    return mismatches
+
+
+def reflect_to_mf_cash_deposit(page, ib_cash_report, thresholds=None, applied_state=None, dry_run=False):
     """
     Sync cash deposits from IBKR to MoneyForward.
 
@@ -789,84 +1241,40 @@ def reflect_to_mf_cash_deposit(page, ib_cash_report):
     - If an asset exists in MF but not in IBKR report, we UPDATE it to 0 value
     - This preserves historical data while reflecting current state
     - Manual deletion via delete_all_cash_deposit() still available if needed
+
+    CHANGE THRESHOLDS:
+    - Balance updates within the change thresholds are skipped (see reconciliation.ChangeThresholds)
+    - applied_state (from sync_state) provides the last apply time used by the stale max age
+
+    The plan itself is built by reconciliation.plan_cash_deposit; with dry_run=True it is only logged.
+
+    Returns:
+        bool: True if every planned action was applied and verified
     """
     # ---pageから「預金・現金・暗号資産」の表を取得---
     # ---Get "Deposits, Cash, Cryptocurrency" table from page---
     mf_cash_deposit = get_mf_cash_deposit(page)
 
-    # デバッグ: MoneyForwardにある通貨を表示
-    # Debug: Show currencies in MoneyForward
-    logger.info(f"MoneyForward cash deposits: {mf_cash_deposit['currency'].tolist() if not mf_cash_deposit.empty else 'None'}")
-    logger.info(f"IBKR cash report: {ib_cash_report['currency'].tolist() if not ib_cash_report.empty else 'None'}")
-
-    # 重複チェック: MoneyForwardに同じ通貨の複数のエントリがある場合は警告
-    # Duplicate check: Warn if MoneyForward has multiple entries for the same currency
-    if not mf_cash_deposit.empty:
-        duplicates = mf_cash_deposit[mf_cash_deposit.duplicated(subset=['currency'], keep=False)]
-        if not duplicates.empty:
-            logger.warning(f"WARNING: MoneyForward has duplicate currency entries: {duplicates['currency'].tolist()}")
-            logger.warning("Only the first occurrence will be updated. Please manually remove duplicates.")
-            # 最初の出現のみを保持（重複を削除）
-            # Keep only first occurrence (remove duplicates)
-            mf_cash_deposit = mf_cash_deposit.drop_duplicates(subset=['currency'], keep='first')
-            logger.info(f"After deduplication: {mf_cash_deposit['currency'].tolist()}")
-
-    # ib_cash_reportとmf_cash_depositをマージ（キー: currency）
-    # Merge ib_cash_report and mf_cash_deposit (key: currency)
-    merged_df = pd.merge(mf_cash_deposit, ib_cash_report, on='currency', how='outer')
-
-    # デバッグ: マージ結果を表示
-    # Debug: Show merge results
-    logger.info(f"Merged data:\n{merged_df[['currency', 'row_no_in_mf_table', 'value_JPY', 'endingCash_JPY']].to_string()}")
-    # 非数値列のみ'NONE'で埋める / Fill only non-numeric columns with 'NONE'
-    # 数値列は数値のままにする / Keep numeric columns as numeric
-    string_columns = ['currency', 'row_no_in_mf_table', 'asset_id']
-    for col in string_columns:
-        if col in merged_df.columns:
-            merged_df[col] = merged_df[col].fillna('NONE')
-    # 数値列は0で埋める（後でNoneチェックで検出可能） / Fill numeric columns with NaN (detectable via None check)
-    numeric_columns = ['value_JPY', 'endingCash_JPY']
-    for col in numeric_columns:
-        if col in merged_df.columns:
-            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
-    # 'Action'列を追加（初期値: 'NONE'）
-    # Add 'Action' column (initial value: 'NONE')
-    merged_df['Action'] = 'NONE'
-    # 条件に基づいて'Action'列を更新
-    # Update 'Action' column based on conditions
-    merged_df.loc[(merged_df['row_no_in_mf_table'] != 'NONE') & (
-            merged_df['value_JPY'] != merged_df['endingCash_JPY']), 'Action'] = 'MODIFY'
-    # 保守的アプローチ: MFに資産があるがIBKRにない場合、削除せず0に更新
-    # CONSERVATIVE: If asset in MF but not in IBKR, UPDATE to 0 instead of DELETE
-    # 履歴データを保持しつつ現在の状態（残高なし）を反映
-    # This preserves historical data while showing current state (no balance)
-    merged_df.loc[
-        (merged_df['row_no_in_mf_table'] != 'NONE') & (merged_df['endingCash_JPY'].isna()), 'Action'] = 'MODIFY_TO_ZERO'
-    merged_df.loc[
-        (merged_df['row_no_in_mf_table'] == 'NONE') & (merged_df['endingCash_JPY'].notna()), 'Action'] = 'ADD'
-    # print(merged_df)
-    # ---更新を実施---
-    # ---Execute updates---
-    df_to_modify = merged_df[(merged_df['Action'] == 'MODIFY')]
-    for index, row in df_to_modify.iterrows():
-        # 現在の価値のみ更新し、購入価格は履歴データ保持のため保存
-        # Only update current value, preserve purchase price to maintain historical data
-        modify_asset_in_mf(page, 'table-depo', row['asset_id'], row['currency'], int(row['endingCash_JPY']), update_cost_basis=False)
-    # ---ゼロに更新（削除の代わり）- 履歴データを保持---
-    # ---Update to zero (instead of delete) - Preserves historical data---
-    df_to_zero = merged_df[(merged_df['Action'] == 'MODIFY_TO_ZERO')]
-    for index, row in df_to_zero.iterrows():
-        print(f"Setting {row['currency']} balance to 0 (not deleting to preserve history)")
-        modify_asset_in_mf(page, 'table-depo', row['asset_id'], row['currency'], 0, update_cost_basis=False)
-    # ---追加を実施---
-    # ---Execute additions---
-    df_to_add = merged_df[(merged_df['Action'] == 'ADD')]
-    for index, row in df_to_add.iterrows():
-        create_asset_in_mf(page, ASSET_TYPE_CASH_DEPOSIT, row['currency'], int(row['endingCash_JPY']), '')
-    return True
+    # ---記録済みのasset_idマッピングで照合---
+    # ---Validate against the recorded asset_id mapping---
+    mf_cash_deposit = asset_map.store.apply_to_scrape('cash', mf_cash_deposit, 'currency')
+    scraped_tables = [t for t in ('table-depo',) if get_page_snapshot(page).has_table(t)]
+    asset_map.store.sync_from_scrape('cash', mf_cash_deposit, 'currency', scraped_tables, source_table='table-depo')
+
+    # ---実行計画を作成（ブラウザ操作なし）---
+    # ---Build the action plan (no browser I/O)---
+    plan = reconciliation.plan_cash_deposit(mf_cash_deposit, ib_cash_report, thresholds, applied_state)
+    logger.info(f"Cash deposit plan: {plan.counts()}")
+    if dry_run:
+        return True
+
+    # ---計画を一括実行し、最後に1回だけ検証---
+    # ---Execute the plan in one batch and verify once at the end---
+    result = execute_mf_actions(page, plan.actions)
+    return not result['failed'] and not result['mismatches']
 
 
-def reflect_to_mf_equity(page, ib_open_position):
+def reflect_to_mf_equity(page, ib_open_position, thresholds=None, applied_state=None, dry_run=False):
     """
     IBKRからMoneyForwardにポジション（株式、オプション、先物、CFD、ワラント、外国為替、投資信託、債券など）を同期します。
     Sync positions (stocks, options, futures, CFDs, warrants, forex, funds, bonds, etc.) from IBKR to MoneyForward.
@@ -891,8 +1299,8 @@ def reflect_to_mf_equity(page, ib_open_position):
           Bonds: Mapped to "国債" (7) / "社債" (8) / "外債" (9) / "その他債券" (11)
         - 商品間スプレッド (ICS): "商品先物" (26)にマッピング
           Inter-Commodity Spreads: Mapped to "商品先物" (26)
-        - 完全なマッピングについてはASSET_SUBCLASS_MAPを参照
-          See ASSET_SUBCLASS_MAP for complete mapping of all MoneyForward asset types
+        - 完全なマッピングについてはasset_types.ASSET_SUBCLASS_MAPを参照
+          See asset_types.ASSET_SUBCLASS_MAP for complete mapping of all MoneyForward asset types
 
     削除ポリシー:
     DELETION POLICY:
@@ -904,137 +1312,41 @@ def reflect_to_mf_equity(page, ib_open_position):
           Keeps MoneyForward portfolio in sync with current IBKR state
         - 履歴データが必要な場合は、MoneyForwardのアーカイブ機能を使用してください
           Use MoneyForward's archive features if historical data is needed
+
+    変更しきい値:
+    CHANGE THRESHOLDS:
+        - しきい値以下の評価額の変更は省略（reconciliation.ChangeThresholdsを参照）
+          Value changes within the change thresholds are skipped (see reconciliation.ChangeThresholds)
+        - 表示名（ポジション数）が変わった場合は、しきい値に関係なく更新
+          A changed display name (position count) is always updated regardless of the thresholds
+
+    計画の作成はreconciliation.plan_equityが行います（dry_run=Trueの場合は計画のログ出力のみ）。
+    The plan itself is built by reconciliation.plan_equity (with dry_run=True it is only logged).
+
+    Returns:
+        bool: True if every planned action was applied and verified
     """
     # ---pageから株式ポジションの表を取得---
     # ---Get equity positions table from page---
     mf_equity = get_mf_equity(page)
 
-    # merge_key列の確認 / Verify merge_key columns exist
-    if 'merge_key' not in mf_equity.columns:
-        logger.warning("'merge_key' column not found in MoneyForward equity data.")
-        mf_equity['merge_key'] = None
-
-    # ---IBKRデータのmerge_keyを計算---
-    # ---Compute merge_key for IBKR data---
-    ib_open_position = ib_open_position.copy()
-    ib_open_position['merge_key'] = ib_open_position.apply(get_position_key, axis=1)
-
-    # ---IBKRのロットレベル重複をmerge_keyで集約---
-    # ---Aggregate IBKR lot-level duplicates by merge_key---
-    if ib_open_position['merge_key'].duplicated().any():
-        logger.info(f"Aggregating lot-level IBKR positions: "
-                    f"{ib_open_position[ib_open_position['merge_key'].duplicated(keep=False)]['merge_key'].tolist()}")
-        sum_cols = ['position', 'positionValue', 'costBasisMoney', 'positionValue_JPY', 'costBasisMoney_JPY']
-        agg_dict = {}
-        for col in ib_open_position.columns:
-            if col == 'merge_key':
-                continue
-            agg_dict[col] = 'sum' if col in sum_cols and col in ib_open_position.columns else 'first'
-        ib_open_position = ib_open_position.groupby('merge_key', as_index=False).agg(agg_dict)
-
-    # デバッグ: マージキーの内容を表示
-    # Debug: Show merge key contents
-    logger.info(f"MoneyForward equity merge_keys: {mf_equity['merge_key'].tolist() if not mf_equity.empty else 'None'}")
-    logger.info(f"IBKR positions merge_keys: {ib_open_position['merge_key'].tolist() if not ib_open_position.empty else 'None'}")
-
-    # 重複チェック: MoneyForwardに同じmerge_keyの複数のエントリがある場合は警告
-    # Duplicate check: Warn if MoneyForward has multiple entries for the same merge_key
-    if not mf_equity.empty and 'merge_key' in mf_equity.columns:
-        duplicates = mf_equity[mf_equity.duplicated(subset=['merge_key'], keep=False)]
-        if not duplicates.empty:
-            logger.warning(f"WARNING: MoneyForward has duplicate entries: {duplicates['merge_key'].tolist()}")
-            logger.warning("Only the first occurrence will be updated. Please manually remove duplicates.")
-            mf_equity = mf_equity.drop_duplicates(subset=['merge_key'], keep='first')
-
-    # merge_keyでマージ / Merge on merge_key
-    merged_df = pd.merge(mf_equity, ib_open_position, on='merge_key', how='outer')
-
-    # デバッグ: マージ結果を表示 / Debug: Show merge results
-    display_cols = ['merge_key', 'row_no_in_mf_table']
-    if 'value_JPY' in merged_df.columns:
-        display_cols.append('value_JPY')
-    if 'positionValue_JPY' in merged_df.columns:
-        display_cols.append('positionValue_JPY')
-    logger.info(f"Merged equity data:\n{merged_df[display_cols].to_string()}")
-
-    # 非数値列のみ'NONE'で埋める / Fill only non-numeric columns with 'NONE'
-    string_columns = ['merge_key', 'symbol', 'row_no_in_mf_table', 'asset_id', 'source_table', '銘柄名', 'currency',
-                      'assetCategory', 'subCategory', 'description', 'strike', 'expiry', 'putCall']
-    for col in string_columns:
-        if col in merged_df.columns:
-            merged_df[col] = merged_df[col].fillna('NONE')
-
-    # 数値列は数値型を維持 / Keep numeric columns as numeric type
-    if 'positionValue_JPY' not in merged_df.columns:
-        import numpy as np
-        merged_df['positionValue_JPY'] = np.nan
-
-    numeric_columns = ['value_JPY', 'positionValue_JPY', 'costBasisMoney_JPY', 'position']
-    for col in numeric_columns:
-        if col in merged_df.columns:
-            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
-
-    # 'Action'列を追加 / Add 'Action' column
-    merged_df['Action'] = 'NONE'
-    if 'positionValue_JPY' in merged_df.columns:
-        merged_df.loc[(merged_df['row_no_in_mf_table'] != 'NONE') & (
-                merged_df['value_JPY'] != merged_df['positionValue_JPY']), 'Action'] = 'MODIFY'
-    # MFにポジションがあるがIBKRにない場合、削除
-    # If position exists in MF but not in IBKR, DELETE it
-    merged_df.loc[
-        (merged_df['row_no_in_mf_table'] != 'NONE') & (merged_df['positionValue_JPY'].isna()), 'Action'] = 'DELETE'
-    merged_df.loc[
-        (merged_df['row_no_in_mf_table'] == 'NONE') & (merged_df['positionValue_JPY'].notna()), 'Action'] = 'ADD'
-
-    logger.info(f"Actions:\n{merged_df[['merge_key', 'row_no_in_mf_table', 'Action']].to_string()}")
-
-    # ---更新を実施---
-    # ---Execute updates---
-    df_to_modify = merged_df[(merged_df['Action'] == 'MODIFY')]
-    for index, row in df_to_modify.iterrows():
-        asset_name_to_input = format_asset_name(row)
-        table_type = str(row.get('source_table', 'table-eq'))
-        if table_type == 'NONE':
-            table_type = 'table-eq'
-        modify_asset_in_mf(page, table_type, row['asset_id'], asset_name_to_input, int(row['positionValue_JPY']),
-                           cost_amount=int(row['costBasisMoney_JPY']), update_cost_basis=True)
-
-    # ---削除を実施 - IBKRに存在しないポジションを削除---
-    # ---Execute deletions - Remove positions that don't exist in IBKR---
-    df_to_delete = merged_df[(merged_df['Action'] == 'DELETE')]
-    for index, row in df_to_delete.iterrows():
-        original_name = str(row['銘柄名']) if '銘柄名' in row and row['銘柄名'] != 'NONE' else row['merge_key']
-        table_type = str(row.get('source_table', 'table-eq'))
-        if table_type == 'NONE':
-            table_type = 'table-eq'
-        logger.info(f"Deleting closed position: {original_name} from {table_type}")
-        delete_asset_in_mf(page, table_type, row['asset_id'])
-
-    # ---追加を実施---
-    # ---Execute additions---
-    df_to_add = merged_df[(merged_df['Action'] == 'ADD')]
-    for index, row in df_to_add.iterrows():
-        asset_name_to_input = format_asset_name(row)
-        asset_category = str(row.get('assetCategory', 'STK'))
-        subcategory = str(row.get('subCategory', None)) if 'subCategory' in row and row['subCategory'] != 'NONE' else None
-        asset_type_to_input = get_asset_type_for_currency(row['currency'], asset_category, subcategory)
-
-        # 購入日を取得してフォーマット (openDateTime: "2024-01-15;12:30:00" -> "2024-01-15")
-        # Get and format purchase date (openDateTime: "2024-01-15;12:30:00" -> "2024-01-15")
-        purchase_date = None
-        if 'openDateTime' in row and row['openDateTime'] != 'NONE' and str(row['openDateTime']).strip():
-            try:
-                open_datetime_str = str(row['openDateTime'])
-                purchase_date = open_datetime_str.split(';')[0]
-                logger.info(f"Using IBKR openDateTime for {row['merge_key']}: {purchase_date}")
-            except Exception as e:
-                logger.warning(f"Failed to parse openDateTime '{row.get('openDateTime')}': {e}")
-
-        if not purchase_date:
-            from datetime import date
-            purchase_date = date.today().isoformat()
-            logger.info(f"openDateTime not available for {row['merge_key']}, using current date: {purchase_date}")
+    # ---記録済みのasset_idマッピングで照合し、銘柄名からの推定より記録を優先---
+    # ---Validate against the recorded asset_id mapping, trusting it over keys parsed from names---
+    mf_equity = asset_map.store.apply_to_scrape('equity', mf_equity, 'merge_key')
+    scraped_tables = [t for t in ('table-eq', 'table-drv') if get_page_snapshot(page).has_table(t)]
+    asset_map.store.sync_from_scrape('equity', mf_equity, 'merge_key', scraped_tables)
+    if 'conid' in ib_open_position.columns and not ib_open_position.empty:
+        ib_keys = position_keys.build_position_keys(ib_open_position)['merge_key']
+        mf_equity = asset_map.store.rekey_by_conid('equity', mf_equity, ib_open_position['conid'], ib_keys)
+
+    # ---実行計画を作成（ブラウザ操作なし）---
+    # ---Build the action plan (no browser I/O)---
+    plan = reconciliation.plan_equity(mf_equity, ib_open_position, thresholds, applied_state)
+    logger.info(f"Equity plan: {plan.counts()}")
+    if dry_run:
+        return True
 
-        create_asset_in_mf(page, asset_type_to_input, asset_name_to_input, int(row['positionValue_JPY']),
-                           int(row['costBasisMoney_JPY']), purchase_date)
-    return True
+    # ---計画を一括実行し、最後に1回だけ検証---
+    # ---Execute the plan in one batch and verify once at the end---
+    result = execute_mf_actions(page, plan.actions)
+    return not result['failed'] and not result['mismatches']
@@ -0,0 +1,287 @@
+"""
+IBKRポジションの識別キーと表示名
+Identity keys and display names for IBKR positions
+
+MoneyForwardの資産名とIBKRのポジションを照合するためのmerge_keyの生成、表示名のフォーマット、
+ロットレベル重複の集約を行います。ブラウザ操作に依存しないため、照合処理（reconciliation）と
+MoneyForward操作（moneyforward_processing）の両方から使用されます。
+Builds the merge_key used to match MoneyForward asset names with IBKR positions, formats display
+names and aggregates lot-level duplicates. It has no browser dependency, so both the reconciliation
+planner and the MoneyForward I/O module use it.
+"""
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+# ロギング設定 / Configure logging
+logger = logging.getLogger(__name__)
+
+
+def get_underlying_symbol(row):
+    """
+    IBKRデータからクリーンな原資産ティッカーを抽出します。
+    Extract the clean underlying ticker symbol from IBKR data.
+
+    株式 (STK) の場合、シンボルはすでに原資産ティッカー (例: "QSI")。
+    For stocks (STK), the symbol is already the underlying ticker (e.g., "QSI").
+
+    オプション (OPT) の場合、シンボルはOCCコード (例: "PNC   260213P00227500")
+    で、最初の6文字がパディングされた原資産ティッカーです。
+    For options (OPT), the symbol is an OCC code (e.g., "PNC   260213P00227500")
+    where the first 6 chars are the padded underlying ticker.
+    """
+    symbol = str(row.get('symbol', 'UNKNOWN'))
+    asset_category = str(row.get('assetCategory', 'STK'))
+
+    if asset_category == 'OPT' and len(symbol) > 6:
+        # OCC形式: 6文字パディング原資産 + 日付 + タイプ + 行使価格
+        # OCC format: 6-char padded underlying + date + type + strike
+        underlying = symbol[:6].strip()
+        return underlying if underlying else symbol
+
+    return symbol
+
+
+def _format_strike(strike):
+    # 行使価格フォーマット: "227.5" -> "227.5", "5.0" -> "5"
+    # Format strike: "227.5" -> "227.5", "5.0" -> "5"
+    try:
+        if strike and strike != 'NONE':
+            strike_num = float(strike)
+            if strike_num == int(strike_num):
+                return str(int(strike_num))
+            return f"{strike_num:g}"
+        return ''
+    except (ValueError, TypeError):
+        return strike if strike != 'NONE' else ''
+
+
+def _format_position(position):
+    # ポジション数フォーマット: 整数値は小数点なし "500.0" -> "500"、端数はそのまま "0.5" -> "0.5"
+    # Format position count: integral values without a decimal point "500.0" -> "500", fractions as-is "0.5" -> "0.5"
+    try:
+        pos_num = float(position)
+        if pos_num == int(pos_num):
+            return str(int(pos_num))
+        return str(position)
+    except (ValueError, TypeError, OverflowError):
+        return str(position)
+
+
+def _format_forex_position(position):
+    # 外国為替のポジション数を千単位で表記: "100000" -> "100k"
+    # Forex position in thousands: "100000" -> "100k"
+    try:
+        pos_num = float(position)
+        if abs(pos_num) >= 1000:
+            return f"{int(pos_num / 1000)}k"
+        return position
+    except (ValueError, TypeError):
+        return position
+
+
+def get_position_key(row):
+    """
+    ポジションのユニークなマージキーを生成します（ポジション数量に依存しない）。
+    Generate a unique merge key for a position, independent of position count.
+
+    キー形式 / Key formats:
+        STK: "QSI"
+        OPT: "PNC260213 P227.5" (原資産+YYMMDD+スペース+P/C+行使価格)
+        FUT: "ES 250321"
+        BND: "US10Y 2.5%"
+        その他: 原資産シンボル / Others: underlying symbol
+    """
+    underlying = get_underlying_symbol(row)
+    asset_category = str(row.get('assetCategory', 'STK'))
+
+    if asset_category == 'OPT':
+        strike = str(row.get('strike', ''))
+        expiry = str(row.get('expiry', ''))
+        put_call = str(row.get('putCall', ''))
+
+        # 有効期限フォーマット: "20260213" -> "260213"
+        # Format expiry: "20260213" -> "260213"
+        if expiry and expiry != 'NONE' and len(expiry) == 8:
+            expiry_formatted = expiry[2:]  # YYYYMMDD -> YYMMDD
+        else:
+            expiry_formatted = expiry if expiry != 'NONE' else ''
+
+        strike_formatted = _format_strike(strike)
+
+        pc_indicator = put_call[0].upper() if put_call and put_call != 'NONE' else ''
+
+        # キー形式: "PNC260213 P227.5"
+        # Key format: "PNC260213 P227.5"
+        key = f"{underlying}{expiry_formatted} {pc_indicator}{strike_formatted}"
+        return key[:20]
+
+    elif asset_category == 'FUT':
+        expiry = str(row.get('expiry', ''))
+        if expiry and expiry != 'NONE' and len(expiry) == 8:
+            expiry_formatted = expiry[2:]  # YYYYMMDD -> YYMMDD
+        else:
+            expiry_formatted = ''
+
+        if expiry_formatted:
+            key = f"{underlying} {expiry_formatted}"
+        else:
+            key = underlying
+        return key[:20]
+
+    elif asset_category == 'BND':
+        description = str(row.get('description', ''))
+        coupon_match = re.search(r'(\d+\.?\d*)\s*%', description)
+        coupon = f" {coupon_match.group(1)}%" if coupon_match else ''
+        key = f"{underlying}{coupon}"
+        return key[:20]
+
+    else:
+        return underlying[:20]
+
+
+def format_asset_name(row):
+    """
+    IBKRの資産データに基づいてMoneyForward表示用の資産名をフォーマットします。
+    Format asset name for display in MoneyForward based on IBKR asset data.
+
+    get_position_key()でアイデンティティ部分を生成し、20文字以内に収まる場合はポジション数を付加します。
+    Uses get_position_key() for the identity part, appends position count if it fits within 20 chars.
+
+    フォーマット例 / Formatting examples:
+        オプション (OPT): "PNC260213 P227.5-1"  ({symbol}{YYMMDD} {PC}{strike}-{pos})
+        株式 (STK): "QSI (500)"
+        先物 (FUT): "ES 250321 (5)"
+        外国為替 (SWP/CASH): "EUR.USD (100k)"
+
+    引数 / Args:
+        row: IBKRからの資産データを含むDataFrame行
+             DataFrame row containing asset data from IBKR
+
+    戻り値 / Returns:
+        資産名（MoneyForward制約により最大20文字）
+        Asset name (max 20 chars for MoneyForward)
+    """
+    position = _format_position(row.get('position', '0')) if row.get('position', 'NONE') != 'NONE' else '0'
+    asset_category = str(row.get('assetCategory', 'STK'))
+    key = get_position_key(row)
+
+    # オプション: ポジションキーをそのまま名称として使用（ポジション数なし）
+    # Options: use position key directly as name (no position count suffix)
+    # これにより名称とmerge_keyが同一になり、逆変換の必要がなくなる
+    # This makes the name identical to merge_key, eliminating reverse-parsing
+    if asset_category == 'OPT':
+        return key
+
+    # 外国為替: k（千単位）でポジション数をフォーマット
+    # Forex: format position in k (thousands)
+    if asset_category in ('SWP', 'CASH'):
+        suffix = f" ({_format_forex_position(position)})"
+    else:
+        suffix = f" ({position})"
+
+    # その他の資産タイプ: 括弧付きポジション数 "{key} ({pos})"
+    # Other asset types: parenthesized position count "{key} ({pos})"
+    full_name = f"{key}{suffix}"
+    if len(full_name) <= 20:
+        return full_name
+    return key[:20]
+
+
+def aggregate_positions_by_key(ib_open_position):
+    """
+    IBKRポジションにmerge_keyを付与し、ロットレベルの重複をmerge_keyごとに集約します。
+    Add merge_key to IBKR positions and aggregate lot-level duplicates per merge_key.
+    """
+    # ---IBKRデータのmerge_keyを計算---
+    # ---Compute merge_key for IBKR data---
+    ib_open_position = ib_open_position.copy()
+    ib_open_position['merge_key'] = build_position_keys(ib_open_position)['merge_key']
+
+    # ---IBKRのロットレベル重複をmerge_keyで集約---
+    # ---Aggregate IBKR lot-level duplicates by merge_key---
+    if ib_open_position['merge_key'].duplicated().any():
+        logger.info(f"Aggregating lot-level IBKR positions: "
+                    f"{ib_open_position[ib_open_position['merge_key'].duplicated(keep=False)]['merge_key'].tolist()}")
+        sum_cols = ['position', 'positionValue', 'costBasisMoney', 'positionValue_JPY', 'costBasisMoney_JPY']
+        agg_dict = {}
+        for col in ib_open_position.columns:
+            if col == 'merge_key':
+                continue
+            agg_dict[col] = 'sum' if col in sum_cols and col in ib_open_position.columns else 'first'
+        ib_open_position = ib_open_position.groupby('merge_key', as_index=False).agg(agg_dict)
+    return ib_open_position
+
+
+def _str_column(df, column, default):
+    # 行ごとの str(row.get(column, default)) と同じ文字列列 / Same strings as str(row.get(column, default)) per row
+    if column in df.columns:
+        return df[column].astype(str)
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def build_position_keys(df):
+    """
+    merge_keyと表示名をベクトル演算で一括生成します（get_position_key / format_asset_nameと同一の結果）。
+    Build merge_key and display name columns in one vectorized pass (same output as
+    get_position_key / format_asset_name).
+
+    行使価格と外国為替のポジション数は、ユニークな値ごとに1回だけ書式化してmapします。
+    Strikes and forex position counts are formatted once per unique value and mapped.
+
+    Args:
+        df: IBKR positions DataFrame
+
+    Returns:
+        DataFrame with 'merge_key' and 'asset_name' columns (same index as df)
+    """
+    if df.empty:
+        return pd.DataFrame({'merge_key': pd.Series(dtype=object), 'asset_name': pd.Series(dtype=object)},
+                            index=df.index)
+
+    symbol = _str_column(df, 'symbol', 'UNKNOWN')
+    category = _str_column(df, 'assetCategory', 'STK')
+    is_opt = category == 'OPT'
+
+    # 原資産: オプションはOCCコードの先頭6文字 / Underlying: first 6 chars of the OCC code for options
+    occ_head = symbol.str[:6].str.strip()
+    underlying = symbol.where(~(is_opt & (symbol.str.len() > 6)), occ_head.where(occ_head != '', symbol))
+
+    expiry = _str_column(df, 'expiry', '')
+    is_yyyymmdd = (expiry != '') & (expiry != 'NONE') & (expiry.str.len() == 8)
+    yymmdd = expiry.str[2:]
+    opt_expiry = yymmdd.where(is_yyyymmdd, expiry.where(expiry != 'NONE', ''))
+    fut_expiry = yymmdd.where(is_yyyymmdd, '')
+
+    strike = _str_column(df, 'strike', '')
+    strike_formatted = strike.map({value: _format_strike(value) for value in strike.unique()})
+    put_call = _str_column(df, 'putCall', '')
+    pc_indicator = put_call.str[:1].str.upper().where((put_call != '') & (put_call != 'NONE'), '')
+
+    description = _str_column(df, 'description', '')
+    coupon = (' ' + description.str.extract(r'(\d+\.?\d*)\s*%', expand=False) + '%').fillna('')
+
+    key = pd.Series(np.select(
+        [is_opt, category == 'FUT', category == 'BND'],
+        [underlying + opt_expiry + ' ' + pc_indicator + strike_formatted,
+         (underlying + ' ' + fut_expiry).where(fut_expiry != '', underlying),
+         underlying + coupon],
+        default=underlying,
+    ), index=df.index).str[:20]
+
+    # 表示名: "{key} ({pos})"、外国為替は千単位、オプションはキーのみ
+    # Display name: "{key} ({pos})", forex in thousands, options use the key only
+    if 'position' in df.columns:
+        position = df['position'].astype(str).where(df['position'] != 'NONE', '0')
+        position = position.map({value: _format_position(value) for value in position.unique()})
+    else:
+        position = pd.Series('0', index=df.index, dtype=object)
+    is_forex = category.isin(['SWP', 'CASH'])
+    forex_position = position[is_forex]
+    position = position.where(~is_forex, forex_position.map(
+        {value: _format_forex_position(value) for value in forex_position.unique()}))
+    full_name = key + ' (' + position + ')'
+    name = full_name.where(full_name.str.len() <= 20, key.str[:20]).where(~is_opt, key)
+    return pd.DataFrame({'merge_key': key, 'asset_name': name}, index=df.index)
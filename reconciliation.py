@@ -0,0 +1,462 @@
+"""
+IBKRとMoneyForwardの差分判定（変更しきい値）
+Reconciliation planner between IBKR and MoneyForward (change detection and action plans)
+
+為替の小さな変動による1円単位の差分で毎日すべての資産を更新しないよう、
+絶対額（円）・相対変化率（%）・資産カテゴリ別のしきい値以下の更新を省略します。
+ただし、最後の反映から一定日数（stale max age）を超えた資産は、しきい値以下でも更新します。
+To avoid rewriting every asset daily for one-yen FX wiggles, updates at or below the absolute (yen),
+relative (percent) or per-asset-category thresholds are skipped. Assets last applied more than the
+stale max age ago are still updated even below the thresholds.
+
+計画作成（plan_cash_deposit / plan_equity）はIBKRとMoneyForwardのDataFrameのみを入力とする純粋な処理で、
+ブラウザに依存しません。作成した計画の適用はmoneyforward_processing.execute_mf_actionsが行います。
+Planning (plan_cash_deposit / plan_equity) is pure: it only takes the IBKR and MoneyForward DataFrames
+and needs no browser. Applying a plan is done by moneyforward_processing.execute_mf_actions.
+"""
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+import position_keys
+from asset_types import get_asset_type_for_currency, ASSET_TYPE_CASH_DEPOSIT
+
+# ロギング設定 / Configure logging
+logger = logging.getLogger(__name__)
+
+# 現金（預金）セクションのカテゴリ名 / Category name used for the cash (deposit) section
+CASH_CATEGORY = 'DEPOSIT'
+
+# 計画の操作種別 / Action types of a plan
+ACTION_TYPES = ('MODIFY', 'MODIFY_TO_ZERO', 'DELETE', 'ADD')
+
+
+@dataclass
+class PlannedAction:
+    """
+    MoneyForwardに対する1件の操作（ADD/MODIFY/MODIFY_TO_ZERO/DELETE）とその内容。
+    One operation on MoneyForward (ADD/MODIFY/MODIFY_TO_ZERO/DELETE) with its payload.
+    """
+    action: str
+    table_type: Optional[str]           # None for ADD to equity/derivatives (decided by the asset type)
+    key: str                            # currency / merge_key
+    name: str                           # Display name to write
+    value: Optional[int] = None         # Current value in JPY
+    asset_id: Optional[str] = None      # Existing MoneyForward asset id (MODIFY/MODIFY_TO_ZERO/DELETE)
+    cost: object = None                 # Purchase price (int, or '' for deposits)
+    update_cost_basis: bool = False
+    asset_type: Optional[str] = None    # MoneyForward asset type id (ADD)
+    purchase_date: Optional[str] = None  # 'YYYY-MM-DD' (ADD)
+    conid: Optional[str] = None         # IBKR contract id (positions), recorded in asset_map
+
+
+@dataclass
+class SyncPlan:
+    """
+    1つのセクション（現金または株式等）の実行計画。
+    Action plan for one section (cash or positions).
+    """
+    actions: list = field(default_factory=list)
+    skipped: int = 0
+    merged: Optional[pd.DataFrame] = field(default=None, repr=False)
+
+    def by_action(self, action):
+        return [a for a in self.actions if a.action == action]
+
+    def counts(self):
+        """操作種別ごとの件数 / Number of actions per type"""
+        counts = {action: len(self.by_action(action)) for action in ACTION_TYPES}
+        counts['SKIP'] = self.skipped
+        return counts
+
+
+class ChangeThresholds:
+    """
+    更新を省略する変更しきい値。差分が絶対額と相対変化率の両方を超えた場合のみ更新します。
+    Change thresholds below which updates are skipped. An update is made only when the difference
+    exceeds both the absolute and the relative threshold.
+
+    環境変数で設定可能 / Configurable via environment variables:
+        MF_CHANGE_THRESHOLD_JPY         (default: 0)
+        MF_CHANGE_THRESHOLD_PCT         (default: 0)
+        MF_CHANGE_THRESHOLDS_BY_CATEGORY  JSON, e.g. {"OPT": {"absolute_jpy": 1000, "relative_pct": 1}}
+        MF_STALE_MAX_AGE_DAYS           (default: unset - never force)
+    """
+    def __init__(self, absolute_jpy=0, relative_pct=0.0, per_category=None, stale_max_age_days=None):
+        self.absolute_jpy = absolute_jpy
+        self.relative_pct = relative_pct
+        self.per_category = per_category or {}
+        self.stale_max_age_days = stale_max_age_days
+
+    @classmethod
+    def from_env(cls):
+        """環境変数からしきい値を作成 / Build thresholds from environment variables"""
+        per_category = json.loads(os.environ.get('MF_CHANGE_THRESHOLDS_BY_CATEGORY', '{}') or '{}')
+        stale_max_age_days = os.environ.get('MF_STALE_MAX_AGE_DAYS')
+        return cls(
+            absolute_jpy=float(os.environ.get('MF_CHANGE_THRESHOLD_JPY', '0')),
+            relative_pct=float(os.environ.get('MF_CHANGE_THRESHOLD_PCT', '0')),
+            per_category=per_category,
+            stale_max_age_days=float(stale_max_age_days) if stale_max_age_days else None,
+        )
+
+    def for_category(self, category):
+        """
+        カテゴリのしきい値を返します（未設定の項目は全体の値）。
+        Return the thresholds for a category (falling back to the global values).
+
+        Returns:
+            tuple: (absolute_jpy, relative_pct)
+        """
+        override = self.per_category.get(category, {})
+        return (override.get('absolute_jpy', self.absolute_jpy),
+                override.get('relative_pct', self.relative_pct))
+
+    def below_threshold(self, old_values, new_values, categories):
+        """
+        差分がしきい値以下（更新不要）の行をベクトル演算で判定します。
+        Vectorized check of which rows change by no more than the thresholds (no update needed).
+
+        Args:
+            old_values: Values currently in MoneyForward
+            new_values: Values from IBKR
+            categories: Asset category per row (CASH_CATEGORY for deposits)
+
+        Returns:
+            Series of bool
+        """
+        old_values = pd.to_numeric(pd.Series(old_values), errors='coerce')
+        new_values = pd.to_numeric(pd.Series(new_values, index=old_values.index), errors='coerce')
+        categories = pd.Series(categories, index=old_values.index)
+        limits = categories.map(lambda c: self.for_category(c))
+        absolute = limits.str[0].astype(float)
+        relative = limits.str[1].astype(float)
+        diff = (new_values - old_values).abs()
+        # 旧値が0の場合の相対変化は無限大 / Relative change from zero is infinite
+        relative_diff = (diff / old_values.abs().where(old_values != 0) * 100).fillna(float('inf'))
+        return (diff <= absolute) | (relative_diff <= relative)
+
+    def stale(self, keys, applied_state_section, now=None):
+        """
+        最後の反映から最大経過日数を超えた（または反映日時が不明な）キーを判定します。
+        Check which keys were last applied more than the max age ago (or have no known apply time).
+
+        Returns:
+            Series of bool (all False when no stale max age is configured)
+        """
+        keys = pd.Series(keys)
+        if self.stale_max_age_days is None:
+            return pd.Series(False, index=keys.index)
+        now = now or datetime.now()
+        applied_state_section = applied_state_section or {}
+        applied_at = pd.to_datetime(keys.map(lambda k: applied_state_section.get(k, {}).get('applied_at')),
+                                    errors='coerce')
+        age_days = (pd.Timestamp(now) - applied_at).dt.total_seconds() / 86400
+        return age_days.isna() | (age_days > self.stale_max_age_days)
+
+
+def apply_change_thresholds(merged_df, old_col, new_col, key_col, categories, thresholds=None,
+                            applied_state_section=None, forced=None, now=None):
+    """
+    'MODIFY'行のうち、しきい値以下かつ期限内の更新を'SKIP'に変更します。
+    Turn 'MODIFY' rows whose change is within the thresholds and not stale into 'SKIP'.
+
+    Args:
+        merged_df: Merged IBKR/MF DataFrame with an 'Action' column (modified in place)
+        old_col: Column with the MoneyForward value
+        new_col: Column with the IBKR value
+        key_col: Column with the key used in the applied state (currency / merge_key)
+        categories: Asset category per row
+        thresholds: ChangeThresholds (default: from environment variables)
+        applied_state_section: Applied state section ({key: {'applied_at', ...}}) from sync_state
+        forced: Boolean mask of rows that must be updated regardless (e.g. name changes)
+
+    Returns:
+        int: Number of skipped updates
+    """
+    thresholds = thresholds or ChangeThresholds.from_env()
+    modify = merged_df['Action'] == 'MODIFY'
+    if not modify.any():
+        return 0
+    rows = merged_df[modify]
+    below = thresholds.below_threshold(rows[old_col], rows[new_col], pd.Series(categories, index=merged_df.index)[modify])
+    stale = thresholds.stale(rows[key_col], applied_state_section, now).set_axis(rows.index)
+    skip = below & ~stale
+    if forced is not None:
+        skip &= ~pd.Series(forced, index=merged_df.index)[modify]
+    merged_df.loc[skip[skip].index, 'Action'] = 'SKIP'
+    skipped = int(skip.sum())
+    if skipped:
+        logger.info(f"Skipped {skipped} updates below the change thresholds: "
+                    f"{rows.loc[skip, key_col].tolist()}")
+    forced_stale = int((below & stale).sum())
+    if forced_stale:
+        logger.info(f"Forcing {forced_stale} updates below the thresholds (older than "
+                    f"{thresholds.stale_max_age_days} days)")
+    return skipped
+
+
+def plan_cash_deposit(mf_cash_deposit, ib_cash_report, thresholds=None, applied_state=None, now=None):
+    """
+    預金・現金の実行計画を作成します（ブラウザ操作なし）。
+    Build the action plan for cash deposits (no browser I/O).
+
+    保守的な削除ポリシー: IBKRにない通貨は削除せず、残高を0に更新します（MODIFY_TO_ZERO）。
+    Conservative deletion policy: currencies missing from IBKR are set to 0 instead of deleted (MODIFY_TO_ZERO).
+
+    Args:
+        mf_cash_deposit: MoneyForward deposits ('currency', 'row_no_in_mf_table', 'value_JPY', 'asset_id')
+        ib_cash_report: IBKR cash report with 'currency' and 'endingCash_JPY'
+        thresholds: ChangeThresholds (default: from environment variables)
+        applied_state: Last applied state from sync_state (for the stale max age)
+
+    Returns:
+        SyncPlan
+    """
+    # デバッグ: MoneyForwardにある通貨を表示
+    # Debug: Show currencies in MoneyForward
+    logger.info(f"MoneyForward cash deposits: {mf_cash_deposit['currency'].tolist() if not mf_cash_deposit.empty else 'None'}")
+    logger.info(f"IBKR cash report: {ib_cash_report['currency'].tolist() if not ib_cash_report.empty else 'None'}")
+
+    # 重複チェック: MoneyForwardに同じ通貨の複数のエントリがある場合は警告
+    # Duplicate check: Warn if MoneyForward has multiple entries for the same currency
+    if not mf_cash_deposit.empty:
+        duplicates = mf_cash_deposit[mf_cash_deposit.duplicated(subset=['currency'], keep=False)]
+        if not duplicates.empty:
+            logger.warning(f"WARNING: MoneyForward has duplicate currency entries: {duplicates['currency'].tolist()}")
+            logger.warning("Only the first occurrence will be updated. Please manually remove duplicates.")
+            # 最初の出現のみを保持（重複を削除）
+            # Keep only first occurrence (remove duplicates)
+            mf_cash_deposit = mf_cash_deposit.drop_duplicates(subset=['currency'], keep='first')
+            logger.info(f"After deduplication: {mf_cash_deposit['currency'].tolist()}")
+
+    # ib_cash_reportとmf_cash_depositをマージ（キー: currency）
+    # Merge ib_cash_report and mf_cash_deposit (key: currency)
+    merged_df = pd.merge(mf_cash_deposit, ib_cash_report, on='currency', how='outer')
+
+    # デバッグ: マージ結果を表示
+    # Debug: Show merge results
+    logger.info(f"Merged data:\n{merged_df[['currency', 'row_no_in_mf_table', 'value_JPY', 'endingCash_JPY']].to_string()}")
+    # 非数値列のみ'NONE'で埋める / Fill only non-numeric columns with 'NONE'
+    # 数値列は数値のままにする / Keep numeric columns as numeric
+    string_columns = ['currency', 'row_no_in_mf_table', 'asset_id']
+    for col in string_columns:
+        if col in merged_df.columns:
+            merged_df[col] = merged_df[col].fillna('NONE')
+    # 数値列は0で埋める（後でNoneチェックで検出可能） / Fill numeric columns with NaN (detectable via None check)
+    numeric_columns = ['value_JPY', 'endingCash_JPY']
+    for col in numeric_columns:
+        if col in merged_df.columns:
+            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
+    # 'Action'列を追加（初期値: 'NONE'）
+    # Add 'Action' column (initial value: 'NONE')
+    merged_df['Action'] = 'NONE'
+    # 条件に基づいて'Action'列を更新
+    # Update 'Action' column based on conditions
+    merged_df.loc[(merged_df['row_no_in_mf_table'] != 'NONE') & (
+            merged_df['value_JPY'] != merged_df['endingCash_JPY']), 'Action'] = 'MODIFY'
+    # 保守的アプローチ: MFに資産があるがIBKRにない場合、削除せず0に更新
+    # CONSERVATIVE: If asset in MF but not in IBKR, UPDATE to 0 instead of DELETE
+    # 履歴データを保持しつつ現在の状態（残高なし）を反映
+    # This preserves historical data while showing current state (no balance)
+    merged_df.loc[
+        (merged_df['row_no_in_mf_table'] != 'NONE') & (merged_df['endingCash_JPY'].isna()), 'Action'] = 'MODIFY_TO_ZERO'
+    merged_df.loc[
+        (merged_df['row_no_in_mf_table'] == 'NONE') & (merged_df['endingCash_JPY'].notna()), 'Action'] = 'ADD'
+    # しきい値以下の小さな変更は更新を省略
+    # Skip small changes within the change thresholds
+    skipped = apply_change_thresholds(
+        merged_df, 'value_JPY', 'endingCash_JPY', 'currency', CASH_CATEGORY, thresholds,
+        (applied_state or {}).get('cash'), now=now)
+    # ---実行計画を作成---
+    # ---Build the action plan---
+    plan = SyncPlan(skipped=skipped, merged=merged_df)
+    df_to_modify = merged_df[(merged_df['Action'] == 'MODIFY')]
+    for index, row in df_to_modify.iterrows():
+        # 現在の価値のみ更新し、購入価格は履歴データ保持のため保存
+        # Only update current value, preserve purchase price to maintain historical data
+        plan.actions.append(PlannedAction('MODIFY', 'table-depo', row['currency'], row['currency'],
+                                          int(row['endingCash_JPY']), asset_id=row['asset_id']))
+    # ---ゼロに更新（削除の代わり）- 履歴データを保持---
+    # ---Update to zero (instead of delete) - Preserves historical data---
+    df_to_zero = merged_df[(merged_df['Action'] == 'MODIFY_TO_ZERO')]
+    for index, row in df_to_zero.iterrows():
+        logger.info(f"Setting {row['currency']} balance to 0 (not deleting to preserve history)")
+        plan.actions.append(PlannedAction('MODIFY_TO_ZERO', 'table-depo', row['currency'], row['currency'], 0,
+                                          asset_id=row['asset_id']))
+    # ---追加---
+    # ---Additions---
+    df_to_add = merged_df[(merged_df['Action'] == 'ADD')]
+    for index, row in df_to_add.iterrows():
+        plan.actions.append(PlannedAction('ADD', 'table-depo', row['currency'], row['currency'],
+                                          int(row['endingCash_JPY']), cost='',
+                                          asset_type=ASSET_TYPE_CASH_DEPOSIT))
+    return plan
+
+
+def plan_equity(mf_equity, ib_open_position, thresholds=None, applied_state=None, now=None):
+    """
+    ポジション（株式・先物OPなど）の実行計画を作成します（ブラウザ操作なし）。
+    Build the action plan for positions (equities, derivatives, ...) with no browser I/O.
+
+    Args:
+        mf_equity: MoneyForward positions ('merge_key', 'row_no_in_mf_table', 'value_JPY', 'asset_id', 'source_table')
+        ib_open_position: IBKR open positions with 'positionValue_JPY' and 'costBasisMoney_JPY'
+        thresholds: ChangeThresholds (default: from environment variables)
+        applied_state: Last applied state from sync_state (for the stale max age)
+
+    Returns:
+        SyncPlan
+    """
+    # merge_key列の確認 / Verify merge_key columns exist
+    if 'merge_key' not in mf_equity.columns:
+        logger.warning("'merge_key' column not found in MoneyForward equity data.")
+        mf_equity['merge_key'] = None
+
+    # ---IBKRデータのmerge_keyを計算し、ロットレベル重複を集約---
+    # ---Compute merge_key for IBKR data and aggregate lot-level duplicates---
+    ib_open_position = position_keys.aggregate_positions_by_key(ib_open_position)
+
+    # 表示名はマージ前の集約済みIBKRデータから生成（マージ後は型が変わり "500" が "500.0" になり得るため）
+    # Build display names from the aggregated IBKR frame before the merge (after it, dtypes may change "500" to "500.0")
+    name_by_key = dict(zip(ib_open_position['merge_key'],
+                           position_keys.build_position_keys(ib_open_position)['asset_name']))
+
+    # デバッグ: マージキーの内容を表示
+    # Debug: Show merge key contents
+    logger.info(f"MoneyForward equity merge_keys: {mf_equity['merge_key'].tolist() if not mf_equity.empty else 'None'}")
+    logger.info(f"IBKR positions merge_keys: {ib_open_position['merge_key'].tolist() if not ib_open_position.empty else 'None'}")
+
+    # 重複チェック: MoneyForwardに同じmerge_keyの複数のエントリがある場合は警告
+    # Duplicate check: Warn if MoneyForward has multiple entries for the same merge_key
+    if not mf_equity.empty and 'merge_key' in mf_equity.columns:
+        duplicates = mf_equity[mf_equity.duplicated(subset=['merge_key'], keep=False)]
+        if not duplicates.empty:
+            logger.warning(f"WARNING: MoneyForward has duplicate entries: {duplicates['merge_key'].tolist()}")
+            logger.warning("Only the first occurrence will be updated. Please manually remove duplicates.")
+            mf_equity = mf_equity.drop_duplicates(subset=['merge_key'], keep='first')
+
+    # merge_keyでマージ / Merge on merge_key
+    merged_df = pd.merge(mf_equity, ib_open_position, on='merge_key', how='outer')
+
+    # デバッグ: マージ結果を表示 / Debug: Show merge results
+    display_cols = ['merge_key', 'row_no_in_mf_table']
+    if 'value_JPY' in merged_df.columns:
+        display_cols.append('value_JPY')
+    if 'positionValue_JPY' in merged_df.columns:
+        display_cols.append('positionValue_JPY')
+    logger.info(f"Merged equity data:\n{merged_df[display_cols].to_string()}")
+
+    # 非数値列のみ'NONE'で埋める / Fill only non-numeric columns with 'NONE'
+    string_columns = ['merge_key', 'symbol', 'row_no_in_mf_table', 'asset_id', 'source_table', '銘柄名', 'currency',
+                      'assetCategory', 'subCategory', 'description', 'strike', 'expiry', 'putCall']
+    for col in string_columns:
+        if col in merged_df.columns:
+            merged_df[col] = merged_df[col].fillna('NONE')
+
+    # 数値列は数値型を維持 / Keep numeric columns as numeric type
+    if 'positionValue_JPY' not in merged_df.columns:
+        import numpy as np
+        merged_df['positionValue_JPY'] = np.nan
+
+    numeric_columns = ['value_JPY', 'positionValue_JPY', 'costBasisMoney_JPY', 'position']
+    for col in numeric_columns:
+        if col in merged_df.columns:
+            merged_df[col] = pd.to_numeric(merged_df[col], errors='coerce')
+
+    # 'Action'列を追加 / Add 'Action' column
+    merged_df['Action'] = 'NONE'
+    if 'positionValue_JPY' in merged_df.columns:
+        merged_df.loc[(merged_df['row_no_in_mf_table'] != 'NONE') & (
+                merged_df['value_JPY'] != merged_df['positionValue_JPY']), 'Action'] = 'MODIFY'
+    # MFにポジションがあるがIBKRにない場合、削除
+    # If position exists in MF but not in IBKR, DELETE it
+    merged_df.loc[
+        (merged_df['row_no_in_mf_table'] != 'NONE') & (merged_df['positionValue_JPY'].isna()), 'Action'] = 'DELETE'
+    merged_df.loc[
+        (merged_df['row_no_in_mf_table'] == 'NONE') & (merged_df['positionValue_JPY'].notna()), 'Action'] = 'ADD'
+
+    # 各行の表示名（IBKRにある行のみ） / Display name of each row (rows present in IBKR only)
+    asset_names = merged_df['merge_key'].map(name_by_key)
+
+    # 表示名（ポジション数など）が変わった場合は評価額に関係なく更新
+    # Update when the display name (position count etc.) changed, regardless of the value
+    both = (merged_df['row_no_in_mf_table'] != 'NONE') & merged_df['positionValue_JPY'].notna()
+    name_changed = pd.Series(False, index=merged_df.index)
+    if both.any() and '銘柄名' in merged_df.columns:
+        new_names = asset_names[both]
+        mf_names = merged_df.loc[both, '銘柄名'].astype(str).str.split('|').str[0].str.strip()
+        name_changed = (new_names != mf_names).reindex(merged_df.index, fill_value=False).astype(bool)
+        merged_df.loc[name_changed & (merged_df['Action'] == 'NONE'), 'Action'] = 'MODIFY'
+    # しきい値以下の小さな変更は更新を省略
+    # Skip small changes within the change thresholds
+    skipped = apply_change_thresholds(
+        merged_df, 'value_JPY', 'positionValue_JPY', 'merge_key', merged_df.get('assetCategory', 'STK'),
+        thresholds, (applied_state or {}).get('equity'), forced=name_changed, now=now)
+
+    logger.info(f"Actions:\n{merged_df[['merge_key', 'row_no_in_mf_table', 'Action']].to_string()}")
+
+    # ---実行計画を作成（更新）---
+    # ---Build the action plan (updates)---
+    plan = SyncPlan(skipped=skipped, merged=merged_df)
+    df_to_modify = merged_df[(merged_df['Action'] == 'MODIFY')]
+    for index, row in df_to_modify.iterrows():
+        asset_name_to_input = asset_names[index]
+        table_type = str(row.get('source_table', 'table-eq'))
+        if table_type == 'NONE':
+            table_type = 'table-eq'
+        plan.actions.append(PlannedAction('MODIFY', table_type, row['merge_key'], asset_name_to_input,
+                                          int(row['positionValue_JPY']), asset_id=row['asset_id'],
+                                          cost=int(row['costBasisMoney_JPY']), update_cost_basis=True,
+                                          conid=row.get('conid')))
+
+    # ---削除 - IBKRに存在しないポジションを削除---
+    # ---Deletions - Remove positions that don't exist in IBKR---
+    df_to_delete = merged_df[(merged_df['Action'] == 'DELETE')]
+    for index, row in df_to_delete.iterrows():
+        original_name = str(row['銘柄名']) if '銘柄名' in row and row['銘柄名'] != 'NONE' else row['merge_key']
+        table_type = str(row.get('source_table', 'table-eq'))
+        if table_type == 'NONE':
+            table_type = 'table-eq'
+        logger.info(f"Deleting closed position: {original_name} from {table_type}")
+        plan.actions.append(PlannedAction('DELETE', table_type, row['merge_key'], original_name,
+                                          asset_id=row['asset_id']))
+
+    # ---追加---
+    # ---Additions---
+    df_to_add = merged_df[(merged_df['Action'] == 'ADD')]
+    for index, row in df_to_add.iterrows():
+        asset_name_to_input = asset_names[index]
+        asset_category = str(row.get('assetCategory', 'STK'))
+        subcategory = str(row.get('subCategory', None)) if 'subCategory' in row and row['subCategory'] != 'NONE' else None
+        asset_type_to_input = get_asset_type_for_currency(row['currency'], asset_category, subcategory)
+
+        # 購入日を取得してフォーマット (openDateTime: "2024-01-15;12:30:00" -> "2024-01-15")
+        # Get and format purchase date (openDateTime: "2024-01-15;12:30:00" -> "2024-01-15")
+        purchase_date = None
+        if 'openDateTime' in row and row['openDateTime'] != 'NONE' and str(row['openDateTime']).strip():
+            try:
+                open_datetime_str = str(row['openDateTime'])
+                purchase_date = open_datetime_str.split(';')[0]
+                logger.info(f"Using IBKR openDateTime for {row['merge_key']}: {purchase_date}")
+            except Exception as e:
+                logger.warning(f"Failed to parse openDateTime '{row.get('openDateTime')}': {e}")
+
+        if not purchase_date:
+            from datetime import date
+            purchase_date = date.today().isoformat()
+            logger.info(f"openDateTime not available for {row['merge_key']}, using current date: {purchase_date}")
+
+        # 作成先のテーブル（株式/先物OP）は資産タイプで決まるため、検証時は両方を確認
+        # The destination table (equity/derivatives) depends on the asset type, so verification checks both
+        plan.actions.append(PlannedAction('ADD', None, row['merge_key'], asset_name_to_input,
+                                          int(row['positionValue_JPY']), cost=int(row['costBasisMoney_JPY']),
+                                          asset_type=asset_type_to_input, purchase_date=purchase_date,
+                                          conid=row.get('conid')))
+
+    return plan
@@ -9,17 +9,18 @@ import utils
 def main(MF_EMAIL, MF_PASS, IB_FLEX_QUERY_FOR_MF_ID, IB_FLEX_TOKEN, MF_IB_INSTITUTION_URL):
     # ---IB FLEXレポートを取得---
     # ---GET IB FLEX REPORT---
-    ib_cash_report = ibflex.get_ib_flex_report(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID, 'CashReport')
+    ib_reports = ibflex.get_ib_flex_reports(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID, ['CashReport', 'OpenPositions'])
+    ib_cash_report = ib_reports['CashReport']
     # 現金残高を日本円に変換
     # Convert cash balance to JPY
     ib_cash_report = utils.add_value_jpy(ib_cash_report, 'endingCash', 'endingCash_JPY')
-    ib_open_position = ibflex.get_ib_flex_report(IB_FLEX_TOKEN, IB_FLEX_QUERY_FOR_MF_ID, 'OpenPositions')
-    # 取得金額を日本円に変換
-    # Convert acquisition cost to JPY
-    ib_open_position = utils.add_value_jpy(ib_open_position, 'costBasisMoney', 'costBasisMoney_JPY')
-    # 現在価値を日本円に変換
-    # Convert current value to JPY
-    ib_open_position = utils.add_value_jpy(ib_open_position, 'positionValue', 'positionValue_JPY')
+    ib_open_position = ib_reports['OpenPositions']
+    # 取得金額と現在価値を日本円に変換
+    # Convert acquisition cost and current value to JPY
+    ib_open_position = utils.add_values_jpy(ib_open_position, {
+        'costBasisMoney': 'costBasisMoney_JPY',
+        'positionValue': 'positionValue_JPY',
+    })
     with sync_playwright() as playwright:
         # 新しいブラウザコンテキストを開く
         # Open a new browser context
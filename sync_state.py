@@ -0,0 +1,158 @@
+"""
+前回MoneyForwardに反映した状態の保存と、ブラウザ起動前の差分判定
+Persistence of the last state applied to MoneyForward and the pre-flight diff run before launching the browser
+
+反映に成功するたびに、通貨ごとの現金残高とmerge_keyごとのポジション（表示名・評価額）を
+反映日時とともに保存します。次回の実行では新しいIBKRデータから同じ形の目標状態を作って比較し、
+許容範囲を超える差分がなければブラウザの起動・ログイン・読み取りをすべて省略します。
+After every successful sync, the cash balance per currency and each position per merge_key
+(display name and value) are saved with the time they were applied. The next run builds the same
+shape of target state from the new IBKR data and compares; when nothing differs beyond the
+tolerance, launching the browser, logging in and scraping are skipped entirely.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+
+import flex_cache
+import position_keys
+import reconciliation
+
+# ロギング設定 / Configure logging
+logger = logging.getLogger(__name__)
+
+STATE_PATH = os.path.join(flex_cache.CACHE_DIR, 'sync_state.json')
+_STATE_VERSION = 1
+
+# この金額（円）以下の差分は変更なしとみなす / Differences up to this many yen count as unchanged
+TOLERANCE_JPY = int(os.environ.get('SYNC_SKIP_TOLERANCE_JPY', '0'))
+
+
+def build_target_state(ib_cash_report, ib_open_position):
+    """
+    IBKRデータから、MoneyForwardに反映されるべき状態を作成します。
+    Build the state MoneyForward should show from the IBKR data.
+
+    Returns:
+        dict: {'cash': {currency: {'name', 'value', 'category'}}, 'equity': {merge_key: {'name', 'value', 'category'}}}
+    """
+    cash = {}
+    if ib_cash_report is not None and not ib_cash_report.empty and 'endingCash_JPY' in ib_cash_report.columns:
+        for currency, value in zip(ib_cash_report['currency'], ib_cash_report['endingCash_JPY']):
+            if pd.notna(value):
+                cash[str(currency)] = {'name': str(currency), 'value': int(value),
+                                       'category': reconciliation.CASH_CATEGORY}
+
+    equity = {}
+    if ib_open_position is not None and not ib_open_position.empty and 'positionValue_JPY' in ib_open_position.columns:
+        positions = position_keys.aggregate_positions_by_key(ib_open_position)
+        names = position_keys.build_position_keys(positions)['asset_name']
+        for index, row in positions.iterrows():
+            if pd.notna(row['positionValue_JPY']):
+                equity[str(row['merge_key'])] = {'name': names[index],
+                                                 'value': int(row['positionValue_JPY']),
+                                                 'category': str(row.get('assetCategory', 'STK'))}
+    return {'cash': cash, 'equity': equity}
+
+
+def load_state(path=None):
+    """
+    前回反映した状態を読み込みます（存在しない・読めない場合はNone）。
+    Load the last applied state (None when missing or unreadable).
+    """
+    path = path or STATE_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read sync state {path}: {e}")
+        return None
+    if state.get('version') != _STATE_VERSION:
+        logger.info(f"Ignoring sync state with version {state.get('version')}")
+        return None
+    return state
+
+
+def save_state(target, path=None, applied_at=None):
+    """
+    反映に成功した状態を、各エントリの反映日時とともに保存します。
+    Save a successfully applied state, stamping each entry with the time it was applied.
+    """
+    path = path or STATE_PATH
+    applied_at = (applied_at or datetime.now()).isoformat()
+    state = {'version': _STATE_VERSION, 'applied_at': applied_at}
+    for section in ('cash', 'equity'):
+        state[section] = {key: dict(entry, applied_at=entry.get('applied_at', applied_at))
+                          for key, entry in target.get(section, {}).items()}
+    # 一意な一時ファイルに書き込んでアトミックに置き換え / Write to a unique temp file and atomically replace
+    flex_cache.write_json_atomic(path, state, indent=2, ensure_ascii=False)
+    logger.info(f"Saved sync state to {path}")
+
+
+def _unchanged_keys(new, old, thresholds, now=None):
+    # 表示名が同じで、しきい値以下かつ期限内の変更しかないキー
+    # Keys with the same name whose value change is within the thresholds and not stale
+    common = sorted(k for k in new.keys() & old.keys() if new[k]['name'] == old[k]['name'])
+    if not common:
+        return set()
+    below = thresholds.below_threshold([old[k]['value'] for k in common], [new[k]['value'] for k in common],
+                                       [new[k].get('category') for k in common])
+    stale = thresholds.stale(common, old, now)
+    return {k for k, unchanged in zip(common, below & ~stale) if unchanged}
+
+
+def merge_applied_state(target, previous_state, thresholds=None, now=None):
+    """
+    反映後の状態を作成します。しきい値により更新を省略したキーは、MoneyForwardに残っている
+    前回の値と反映日時を引き継ぎます。
+    Build the state after a sync. Keys whose update was skipped by the thresholds keep the previous
+    value and apply time, since that is what MoneyForward still shows.
+    """
+    if not previous_state:
+        return target
+    thresholds = thresholds or reconciliation.ChangeThresholds.from_env()
+    merged = {}
+    for section in ('cash', 'equity'):
+        new = target.get(section, {})
+        old = previous_state.get(section, {})
+        unchanged = _unchanged_keys(new, old, thresholds, now)
+        merged[section] = {key: (old[key] if key in unchanged else entry) for key, entry in new.items()}
+    return merged
+
+
+def diff_state(target, state, tolerance=None, thresholds=None, now=None):
+    """
+    目標状態と前回反映した状態を比較します。
+    Compare the target state with the last applied state.
+
+    変更しきい値（reconciliation.ChangeThresholds）以下かつ期限内の評価額の変更は、
+    反映時にも省略されるため差分に含めません。
+    Value changes within the change thresholds (reconciliation.ChangeThresholds) that are not stale
+    would be skipped by the sync as well, so they are not reported.
+
+    Returns:
+        list: [(section, key, reason)] for every entry that was added, removed, renamed or
+              changed by more than the tolerance and the change thresholds
+    """
+    tolerance = TOLERANCE_JPY if tolerance is None else tolerance
+    thresholds = thresholds or reconciliation.ChangeThresholds.from_env()
+    changes = []
+    for section in ('cash', 'equity'):
+        new = target.get(section, {})
+        old = state.get(section, {})
+        unchanged = _unchanged_keys(new, old, thresholds, now)
+        for key in new.keys() - old.keys():
+            changes.append((section, key, 'added'))
+        for key in old.keys() - new.keys():
+            changes.append((section, key, 'removed'))
+        for key in new.keys() & old.keys():
+            if new[key]['name'] != old[key]['name']:
+                changes.append((section, key, f"name {old[key]['name']} -> {new[key]['name']}"))
+            elif key not in unchanged and abs(new[key]['value'] - old[key]['value']) > tolerance:
+                changes.append((section, key, f"value {old[key]['value']} -> {new[key]['value']}"))
+    return changes
@@ -0,0 +1,32 @@
+"""
+asset_map.AssetMap.sync_from_scrape の消去範囲のテスト
+Tests for what asset_map.AssetMap.sync_from_scrape drops
+"""
+import pandas as pd
+
+import asset_map
+
+
+def _store(tmp_path):
+    store = asset_map.AssetMap(str(tmp_path / 'asset_map.sqlite3'))
+    store.record('equity', 'AAPL', '1', 'table-eq')
+    store.record('equity', 'MSFT', '2', 'table-eq')
+    store.record('equity', 'ES 250321', '3', 'table-drv')
+    return store
+
+
+def _scrape(rows):
+    return pd.DataFrame(rows, columns=['asset_id', 'merge_key', 'source_table'])
+
+
+def test_empty_scrape_keeps_the_mapping(tmp_path):
+    store = _store(tmp_path)
+    store.sync_from_scrape('equity', _scrape([]), 'merge_key', ['table-eq', 'table-drv'])
+    assert store.keys_by_asset_id('equity') == {'1': 'AAPL', '2': 'MSFT', '3': 'ES 250321'}
+
+
+def test_only_scraped_tables_are_pruned(tmp_path):
+    store = _store(tmp_path)
+    store.sync_from_scrape('equity', _scrape([('1', 'AAPL', 'table-eq'), ('4', 'VT', 'table-eq')]),
+                           'merge_key', ['table-eq'])
+    assert store.keys_by_asset_id('equity') == {'1': 'AAPL', '3': 'ES 250321', '4': 'VT'}
@@ -0,0 +1,37 @@
+"""
+Flexステートメントの数値型付けがMoneyForwardの表示名を変えないことのテスト
+Tests that numeric typing of Flex statements does not change MoneyForward display names
+"""
+import ibkr_flex_query_client as ibflex
+import position_keys
+
+_STATEMENT = b"""<FlexQueryResponse queryName="test" type="AF">
+<FlexStatements count="1">
+<FlexStatement accountId="U1" fromDate="20240102" toDate="20240102">
+<OpenPositions>
+<OpenPosition assetCategory="STK" symbol="QSI" currency="USD" position="500" positionValue="1000" costBasisMoney="900" />
+<OpenPosition assetCategory="STK" symbol="VT" currency="USD" position="0.5" positionValue="50" costBasisMoney="40" />
+<OpenPosition assetCategory="FUT" symbol="ES" currency="USD" position="2" expiry="20250321" positionValue="10" costBasisMoney="10" />
+</OpenPositions>
+</FlexStatement>
+</FlexStatements>
+</FlexQueryResponse>"""
+
+
+def test_positions_are_numeric():
+    positions = ibflex.parse_flex_statement(_STATEMENT, ('OpenPositions',))['OpenPositions']
+    assert positions['position'].dtype.kind == 'f'
+
+
+def test_display_names_unchanged_for_float_positions():
+    positions = ibflex.parse_flex_statement(_STATEMENT, ('OpenPositions',))['OpenPositions']
+    names = [position_keys.format_asset_name(row) for _, row in positions.iterrows()]
+    assert names == ['QSI (500)', 'VT (0.5)', 'ES 250321 (2)']
+    assert position_keys.build_position_keys(positions)['asset_name'].tolist() == names
+
+
+def test_format_asset_name_float_matches_string_position():
+    for position in (500, -3, 100000, 0.5):
+        as_float = position_keys.format_asset_name({'symbol': 'QSI', 'assetCategory': 'STK', 'position': float(position)})
+        as_text = position_keys.format_asset_name({'symbol': 'QSI', 'assetCategory': 'STK', 'position': str(position)})
+        assert as_float == as_text
@@ -0,0 +1,43 @@
+"""
+起動時のimportコストの回帰チェック（python -X importtime の出力を解析）
+Startup import cost regression check (parses the output of python -X importtime)
+"""
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 初回使用時まで読み込まない重い依存 / Heavy dependencies that must not load until first use
+LAZY_MODULES = ('yfinance', 'playwright', 'bs4')
+
+# `import main`の累積時間の上限（マイクロ秒、pandasの読み込みを含む）
+# Budget for the cumulative time of `import main` (microseconds, pandas included)
+IMPORT_BUDGET_US = int(os.environ.get('IMPORT_TIME_BUDGET_US', '3000000'))
+
+
+def _import_times(module):
+    # {モジュール名: 累積時間(us)} / {module name: cumulative time (us)}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # ヘッダー行 / Header line
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def test_main_does_not_import_heavy_dependencies():
+    times = _import_times('main')
+    assert 'main' in times
+    loaded = sorted(name for name in times if name.split('.')[0] in LAZY_MODULES)
+    assert not loaded, f"imported at startup: {loaded}"
+
+
+def test_main_import_time_within_budget():
+    cumulative = _import_times('main')['main']
+    assert cumulative < IMPORT_BUDGET_US, f"import main took {cumulative} us (budget {IMPORT_BUDGET_US} us)"
@@ -0,0 +1,57 @@
+"""
+position_keys.build_position_keys（ベクトル演算）と行ごとの get_position_key / format_asset_name の一致を
+ランダムに生成したDataFrameで検証します。
+Randomized check that position_keys.build_position_keys (vectorized) matches the row-wise
+get_position_key / format_asset_name on generated DataFrames.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+
+import position_keys
+
+# 列ごとの値の候補（欠損・'NONE'・不正な値を含む） / Candidate values per column (missing, 'NONE' and malformed included)
+_VALUES = {
+    'symbol': ['QSI', 'PNC   260213P00227500', 'ES', 'EUR.USD', 'US10Y', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+               '      260213C00005000', 'X', '', 'NONE', np.nan],
+    'assetCategory': ['STK', 'OPT', 'FUT', 'BND', 'CASH', 'SWP', 'FND', 'WAR', 'NONE', np.nan],
+    'strike': ['227.5', '5', '5.0', '0.125', '1e3', 'abc', '', 'NONE', np.nan, 100.0, 42],
+    'expiry': ['20260213', '260213', '2026-02-13', '202602131', '', 'NONE', np.nan, 20260213],
+    'putCall': ['P', 'C', 'put', 'call', '', 'NONE', np.nan],
+    'description': ['US T 2.5% 2034', 'CORP 4 % 2030', 'NO COUPON', '', 'NONE', np.nan],
+    'position': [500, 500.0, -3, 0.5, 1.25, 100000, 250000.0, -1500, 999, 0, '12', 'NONE', np.nan],
+}
+
+
+def _random_frame(rng):
+    # 列の有無と行数もランダム / Random column set and row count
+    columns = [c for c in _VALUES if rng.random() < 0.8]
+    n_rows = rng.randint(1, 30)
+    return pd.DataFrame({c: [rng.choice(_VALUES[c]) for _ in range(n_rows)] for c in columns},
+                        index=rng.sample(range(1000), n_rows))
+
+
+def _row_wise(df):
+    return pd.DataFrame({
+        'merge_key': [position_keys.get_position_key(row) for _, row in df.iterrows()],
+        'asset_name': [position_keys.format_asset_name(row) for _, row in df.iterrows()],
+    }, index=df.index)
+
+
+def test_build_position_keys_matches_row_wise_functions():
+    rng = random.Random(20240601)
+    for _ in range(200):
+        df = _random_frame(rng)
+        # 数値列として読まれた場合も確認 / Also check when the column was read as numeric
+        if 'position' in df.columns and rng.random() < 0.5:
+            df['position'] = pd.to_numeric(df['position'], errors='coerce')
+        expected = _row_wise(df)
+        actual = position_keys.build_position_keys(df)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False, obj=f"frame\n{df}")
+
+
+def test_build_position_keys_empty_frame():
+    result = position_keys.build_position_keys(pd.DataFrame(columns=['symbol', 'position']))
+    assert list(result.columns) == ['merge_key', 'asset_name']
+    assert result.empty
@@ -0,0 +1,63 @@
+"""
+reconciliation.plan_equity の表示名・変更しきい値のテスト
+Tests for display names and change thresholds in reconciliation.plan_equity
+"""
+import pandas as pd
+
+import reconciliation
+
+
+def _mf_equity(rows):
+    # (merge_key, 銘柄名, value_JPY, asset_id) からMoneyForwardの株式表を作成
+    # Build a MoneyForward equity table from (merge_key, 銘柄名, value_JPY, asset_id)
+    return pd.DataFrame([
+        {'row_no_in_mf_table': str(i + 1), 'merge_key': key, '銘柄名': name, 'value_JPY': value,
+         'asset_id': asset_id, 'source_table': 'table-eq'}
+        for i, (key, name, value, asset_id) in enumerate(rows)
+    ])
+
+
+def _ib_positions(rows):
+    # (symbol, position, positionValue_JPY) からIBKRの株式ポジションを作成
+    # Build IBKR stock positions from (symbol, position, positionValue_JPY)
+    return pd.DataFrame([
+        {'symbol': symbol, 'assetCategory': 'STK', 'currency': 'USD', 'position': position,
+         'positionValue_JPY': value, 'costBasisMoney_JPY': value}
+        for symbol, position, value in rows
+    ])
+
+
+def _actions(plan):
+    return sorted((a.action, a.key, a.name) for a in plan.actions)
+
+
+def test_small_change_is_skipped_alongside_a_delete():
+    thresholds = reconciliation.ChangeThresholds(absolute_jpy=1000)
+    mf = _mf_equity([('QSI', 'QSI (500)', 100000, 'a1'), ('OLD', 'OLD (10)', 5000, 'a2')])
+    ib = _ib_positions([('QSI', 500, 100010)])
+
+    plan = reconciliation.plan_equity(mf, ib, thresholds)
+
+    assert _actions(plan) == [('DELETE', 'OLD', 'OLD (10)')]
+    assert plan.skipped == 1
+
+
+def test_small_change_is_skipped_without_a_delete():
+    thresholds = reconciliation.ChangeThresholds(absolute_jpy=1000)
+    mf = _mf_equity([('QSI', 'QSI (500)', 100000, 'a1')])
+    ib = _ib_positions([('QSI', 500, 100010)])
+
+    plan = reconciliation.plan_equity(mf, ib, thresholds)
+
+    assert plan.actions == []
+    assert plan.skipped == 1
+
+
+def test_integral_float_positions_are_named_as_ints():
+    thresholds = reconciliation.ChangeThresholds(absolute_jpy=1000)
+    mf = _mf_equity([('QSI', 'QSI (400)', 100000, 'a1')])
+    ib = _ib_positions([('QSI', 500.0, 100010), ('VT', 0.5, 20000)])
+
+    plan = reconciliation.plan_equity(mf, ib, thresholds)
+
+    assert _actions(plan) == [('ADD', 'VT', 'VT (0.5)'), ('MODIFY', 'QSI', 'QSI (500)')]
@@ -1,24 +1,162 @@
-import yfinance as yf
+import pandas as pd
+import json
 import logging
+import os
+import threading
+from collections import OrderedDict
 from requests.exceptions import RequestException, Timeout
 import time
+import flex_cache
 
 # ロギング設定 / Configure logging
 logger = logging.getLogger(__name__)
 
 
-def get_latest_fx_rate(from_currency='USD', to_currency='JPY', timeout=10, max_retries=3):
+class FxRateCache:
+    """
+    (from, to)通貨ペアをキーとするTTL付き為替レートキャッシュ。
+    TTL-bounded FX rate cache keyed by (from, to) currency pair.
+
+    - プロセス内LRU / In-process LRU
+    - オプションで.cache配下のディスク層 / Optional on-disk layer under .cache
+    - 同じペアへの同時リクエストは1回の取得にまとめる（single-flight）
+      Concurrent requests for the same pair share one fetch (single-flight)
+    """
+    def __init__(self, ttl_seconds=3600, maxsize=64, disk_path=None):
+        self.ttl_seconds = ttl_seconds
+        self.maxsize = maxsize
+        self.disk_path = disk_path
+        self._entries = OrderedDict()  # key -> (rate, fetched_at epoch)
+        self._lock = threading.Lock()
+        # ディスク層の読み込み→更新→書き込みを直列化 / Serializes read-modify-write of the disk layer
+        self._disk_lock = threading.Lock()
+        self._inflight = {}  # key -> threading.Lock
+
+    def _fresh(self, fetched_at):
+        return time.time() - fetched_at <= self.ttl_seconds
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._fresh(entry[1]):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put_memory(self, key, rate, fetched_at):
+        with self._lock:
+            self._entries[key] = (rate, fetched_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _read_disk(self):
+        try:
+            with open(self.disk_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _get_disk(self, key):
+        if not self.disk_path:
+            return None
+        entry = self._read_disk().get(''.join(key))
+        if entry and self._fresh(entry['fetched_at']):
+            self._put_memory(key, entry['rate'], entry['fetched_at'])
+            return entry['rate']
+        return None
+
+    def _put_disk(self, key, rate, fetched_at):
+        if not self.disk_path:
+            return
+        try:
+            with self._disk_lock:
+                data = {k: v for k, v in self._read_disk().items() if self._fresh(v.get('fetched_at', 0))}
+                data[''.join(key)] = {'rate': rate, 'fetched_at': fetched_at}
+                # 一意な一時ファイル経由でアトミックに置き換え / Atomically replaced via a unique temp file
+                flex_cache.write_json_atomic(self.disk_path, data)
+        except Exception as e:
+            logger.warning(f"Failed to write FX rate cache: {e}")
+
+    def get(self, key):
+        """キャッシュ済みのレート（なければNone） / Cached rate, or None"""
+        rate = self._get_memory(key)
+        if rate is None:
+            rate = self._get_disk(key)
+        return rate
+
+    def put(self, key, rate):
+        fetched_at = time.time()
+        self._put_memory(key, rate, fetched_at)
+        self._put_disk(key, rate, fetched_at)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        キャッシュから取得し、なければfetch()を1回だけ呼び出します。
+        Return the cached rate, calling fetch() once on a miss.
+        """
+        rate = self.get(key)
+        if rate is not None:
+            return rate
+        with self._lock:
+            inflight = self._inflight.setdefault(key, threading.Lock())
+        with inflight:
+            # 待機中に他のスレッドが取得済みの可能性 / Another thread may have fetched it while we waited
+            rate = self.get(key)
+            if rate is None:
+                rate = fetch()
+                self.put(key, rate)
+        with self._lock:
+            self._inflight.pop(key, None)
+        return rate
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 為替レートキャッシュ（TTLはFX_RATE_CACHE_TTL_SECONDS、ディスク層はFX_RATE_DISK_CACHE=falseで無効化）
+# FX rate cache (TTL from FX_RATE_CACHE_TTL_SECONDS; disable the disk layer with FX_RATE_DISK_CACHE=false)
+fx_rate_cache = FxRateCache(
+    ttl_seconds=float(os.environ.get('FX_RATE_CACHE_TTL_SECONDS', '3600')),
+    disk_path=(os.path.join(flex_cache.CACHE_DIR, 'fx_rates.json')
+               if os.environ.get('FX_RATE_DISK_CACHE', 'true').lower() == 'true' else None),
+)
+
+
+def get_latest_fx_rate(from_currency='USD', to_currency='JPY', timeout=10, max_retries=3, use_cache=True):
+    """
+    最新の為替レートを取得します（キャッシュ経由、1回の実行で通貨ごとに最大1回のネットワーク呼び出し）。
+    Get the latest FX rate through the cache (at most one network call per currency pair per TTL).
+    """
+    if not use_cache:
+        return _fetch_fx_rate(from_currency, to_currency, timeout, max_retries)
+    return fx_rate_cache.get_or_fetch(
+        (from_currency, to_currency),
+        lambda: _fetch_fx_rate(from_currency, to_currency, timeout, max_retries))
+
+
+def _get_yfinance():
+    # yfinanceはIBKRのレートが欠損した場合のフォールバックでのみ使用するため、初回使用時にインポート
+    # yfinance is only used as a fallback when IBKR rates are missing, so import it on first use
+    import yfinance as yf
+    return yf
+
+
+def _fetch_fx_rate(from_currency='USD', to_currency='JPY', timeout=10, max_retries=3):
     # TODO: 為替レートの精度を向上させ、エラーハンドリングを追加（TODO.md参照）
     # TODO: Improve FX rate accuracy and add error handling (see TODO.md)
     # - Yahoo Financeのレートは概算値
     # - Yahoo Finance rates are approximate
-    # - API呼び出しを減らすためにキャッシュを追加
-    # - Add caching to reduce API calls
     # - API障害を適切に処理
     # - Handle API failures gracefully
     # - 代替FXデータソースを検討
     # - Consider alternative FX data sources
     currency_pair = f'{from_currency}{to_currency}=X'
+    yf = _get_yfinance()
 
     # リトライロジック付きでAPI呼び出し / API call with retry logic
     for attempt in range(max_retries):
@@ -85,7 +223,150 @@ def get_latest_fx_rate(from_currency='USD', to_currency='JPY', timeout=10, max_r
             raise RuntimeError(f"Unexpected error fetching FX rate for {currency_pair}: {e}") from e
 
 
-def add_value_jpy(df, calculation_column_name, additional_column_name):
+def get_latest_fx_rates(currencies, to_currency='JPY', timeout=10, max_retries=3):
+    """
+    複数通貨の為替レートをまとめて取得します（キャッシュ未ヒット分を1回のマルチティッカー取得で解決）。
+    Get FX rates for several currencies at once; cache misses are resolved with one multi-ticker download.
+
+    Args:
+        currencies: Iterable of currency codes (e.g. ['USD', 'HKD'])
+        to_currency: Target currency (default: 'JPY')
+
+    Returns:
+        dict: {currency: rate}
+    """
+    rates = {}
+    to_fetch = []
+    for currency in dict.fromkeys(currencies):
+        if currency == to_currency:
+            rates[currency] = 1.0
+            continue
+        cached = fx_rate_cache.get((currency, to_currency))
+        if cached is not None:
+            rates[currency] = cached
+        else:
+            to_fetch.append(currency)
+    if not to_fetch:
+        return rates
+
+    if len(to_fetch) > 1:
+        fetched = {}
+        try:
+            fetched = _fetch_fx_rates_batch(to_fetch, to_currency, timeout)
+        except Exception as e:
+            logger.warning(f"Batch FX rate download failed, falling back to per-pair requests: {e}")
+        for currency, rate in fetched.items():
+            fx_rate_cache.put((currency, to_currency), rate)
+            rates[currency] = rate
+        to_fetch = [c for c in to_fetch if c not in fetched]
+
+    # 一括取得で得られなかったペアのみ個別に取得 / Fetch individually only what the batch did not return
+    for currency in to_fetch:
+        rates[currency] = float(get_latest_fx_rate(currency, to_currency, timeout, max_retries))
+    return rates
+
+
+def _fetch_fx_rates_batch(currencies, to_currency, timeout):
+    # 1回のyf.downloadで全ペアの終値を取得 / One yf.download call for every pair's close
+    tickers = {f'{currency}{to_currency}=X': currency for currency in currencies}
+    history = _get_yfinance().download(list(tickers), period='5d', progress=False, threads=False, timeout=timeout)
+    if history is None or history.empty or 'Close' not in history.columns.get_level_values(0):
+        raise ValueError(f"No FX rate data returned for {list(tickers)}")
+    closes = history['Close']
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=next(iter(tickers)))
+
+    rates = {}
+    for ticker, currency in tickers.items():
+        if ticker not in closes.columns:
+            continue
+        series = closes[ticker].dropna()
+        if not series.empty and series.iloc[-1] > 0:
+            rates[currency] = float(series.iloc[-1])
+    logger.info(f"Fetched FX rates in one batch: {rates}")
+    return rates
+
+
+def derive_fx_rates_from_ibkr(*frames):
+    """
+    IBKRのfxRateToBaseから通貨ごとの対円レートを導出します（クロスレート）。
+    Derive per-currency rates to JPY from IBKR's fxRateToBase values (cross rates).
+
+    fxRateToBaseは基準通貨へのレートのため、X/JPY = (X/基準通貨) / (JPY/基準通貨)。
+    基準通貨がJPYの場合、JPYのレートは1で、fxRateToBaseがそのまま対円レートになります。
+    fxRateToBase is the rate to the account base currency, so X/JPY = (X/base) / (JPY/base).
+    With a JPY base, JPY's rate is 1 and fxRateToBase is already the rate to JPY.
+
+    Args:
+        *frames: IBKR DataFrames with 'currency' and 'fxRateToBase' columns (e.g. CashReport, OpenPositions)
+
+    Returns:
+        dict: {currency: rate to JPY}
+    """
+    parts = [f[['currency', 'fxRateToBase']] for f in frames
+             if f is not None and not f.empty and {'currency', 'fxRateToBase'} <= set(f.columns)]
+    if not parts:
+        return {}
+    combined = pd.concat(parts, ignore_index=True)
+    combined['fxRateToBase'] = pd.to_numeric(combined['fxRateToBase'], errors='coerce')
+    to_base = combined[combined['fxRateToBase'] > 0].groupby('currency')['fxRateToBase'].first()
+    jpy_to_base = to_base.get('JPY', 1.0)
+    return (to_base / jpy_to_base).to_dict()
+
+
+def _resolve_fx_rates_to_jpy(df, reference_frames=()):
+    """
+    行ごとの日本円への為替レートをベクトル演算で求めます。
+    Resolve the per-row FX rate to JPY with vectorized operations.
+
+    IBKRのfxRateToBaseを優先し、欠損している通貨はまずIBKRの他の行・レポートから導出したレートで補い、
+    それでも不足する通貨のみyfinanceから1回の一括取得で解決します。
+    IBKR's fxRateToBase is preferred. Missing currencies are first filled with rates derived from other
+    IBKR rows/reports, and only what is still missing goes to yfinance in a single batch request.
+    """
+    currency = df['currency']
+    # IBKRのfxRateToBaseを数値に一括変換（空文字・欠損はNaN）
+    # Coerce IBKR's fxRateToBase to numeric in one pass (blank/missing become NaN)
+    if 'fxRateToBase' in df.columns:
+        rates = pd.to_numeric(df['fxRateToBase'], errors='coerce')
+    else:
+        rates = pd.Series(float('nan'), index=df.index)
+    rates = rates.where(currency != 'JPY', 1.0)
+
+    missing = rates.isna()
+    if missing.any():
+        # IBKRのレートからクロスレートを導出して補完
+        # Fill from cross rates derived from IBKR's own rates
+        derived = derive_fx_rates_from_ibkr(df, *reference_frames)
+        rates = rates.fillna(currency.map(derived))
+        still_missing = rates.isna()
+        if still_missing.any():
+            # yfinanceにフォールバック（通貨ごとのレート表を1回で取得してmap）
+            # Fallback to yfinance (fetch a per-currency rate table in one round trip and map it)
+            missing_currencies = currency[still_missing].unique().tolist()
+            logger.info(f"IBKR FX rate not available for {missing_currencies}, using yfinance")
+            rate_table = get_latest_fx_rates(missing_currencies)
+            rates = rates.fillna(currency.map(rate_table))
+
+    ibkr_currencies = sorted(currency[~missing & (currency != 'JPY')].unique().tolist())
+    if ibkr_currencies:
+        logger.info(f"Using IBKR FX rates for {ibkr_currencies}")
+    return rates.astype(float)
+
+
+def add_values_jpy(df, column_map, reference_frames=()):
+    """
+    複数の金額列を1回の呼び出しで日本円に換算します。
+    Convert several value columns to JPY in one call.
+
+    Args:
+        df: DataFrame with 'currency' (and optionally 'fxRateToBase') columns
+        column_map: dict of {source_column: jpy_column}
+        reference_frames: Other IBKR DataFrames whose fxRateToBase values may fill missing rates
+
+    Returns:
+        DataFrame with 'fx_rate_to_JPY' and the JPY columns added (rounded to integer yen)
+    """
     if df.empty:
         # 空のDataFrameを変更せずに返す
         # Return the empty DataFrame without modifications
@@ -93,26 +374,14 @@ def add_value_jpy(df, calculation_column_name, additional_column_name):
     if 'fx_rate_to_JPY' not in df.columns:
         # DataFrameに為替レートを追加
         # Add FX rate to the DataFrame
-        # IBKRのfxRateToBaseを優先して使用、利用できない場合はyfinanceにフォールバック
-        # Prefer IBKR's fxRateToBase, fallback to yfinance if not available
-        def get_fx_rate(row):
-            if row['currency'] == 'JPY':
-                return 1.0
-            # IBKRのfxRateToBaseが利用可能か確認
-            # Check if IBKR's fxRateToBase is available
-            if 'fxRateToBase' in row and row['fxRateToBase'] and str(row['fxRateToBase']).strip():
-                logger.info(f"Using IBKR FX rate for {row['currency']}: {row['fxRateToBase']}")
-                return float(row['fxRateToBase'])
-            # yfinanceにフォールバック
-            # Fallback to yfinance
-            logger.info(f"IBKR FX rate not available for {row['currency']}, using yfinance")
-            return float(get_latest_fx_rate(row['currency']))
-
-        df['fx_rate_to_JPY'] = df.apply(get_fx_rate, axis=1)
-    # JPY列を追加し、日本円に変換
-    # Add JPY column and convert to JPY
-    df[additional_column_name] = df.apply(lambda x: float(x[calculation_column_name]) * x['fx_rate_to_JPY'], axis=1)
-    # JPY列を整数に変換
-    # Convert JPY column to integer
-    df[additional_column_name] = df[additional_column_name].astype(int)
+        df['fx_rate_to_JPY'] = _resolve_fx_rates_to_jpy(df, reference_frames)
+    for calculation_column_name, additional_column_name in column_map.items():
+        # 列全体を掛け算して日本円に変換し、整数に丸める（切り捨てではない）
+        # Multiply whole columns to convert to JPY, then round to integer (not truncate)
+        values = pd.to_numeric(df[calculation_column_name]) * df['fx_rate_to_JPY']
+        df[additional_column_name] = values.round().astype(int)
     return df
+
+
+def add_value_jpy(df, calculation_column_name, additional_column_name):
+    return add_values_jpy(df, {calculation_column_name: additional_column_name})